@@ -0,0 +1,103 @@
+"""大文件下载的服务器CPU开销：比较按块发送和http.response.pathsend由服务器发送文件
+
+依次启动uvicorn（不支持pathsend，按块发送）、关闭FILE_PATHSEND的granian和开启FILE_PATHSEND的granian，
+每种配置下载同一个文件--repeat次，报告服务器进程（含worker子进程）每GB消耗的CPU秒数和吞吐量；
+CPU时间从/proc读取，只支持Linux
+
+用法：python benchmark/bench_download.py --size 1G --repeat 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+from server import configure_data_dir, parse_size, run_server
+
+# 服务器、是否开启FILE_PATHSEND
+CONFIGS: tuple[tuple[str, bool], ...] = (("uvicorn", False), ("granian", False), ("granian", True))
+
+
+def process_tree_cpu_seconds(pid: int) -> float:
+    """pid及其所有子孙进程的用户态和内核态CPU秒数"""
+    children: dict[int, list[int]] = {}
+    times: dict[int, int] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            stat = Path(f"/proc/{entry}/stat").read_text()
+        except OSError:
+            continue
+        # 进程名可能含空格，从最后一个")"之后解析
+        fields = stat[stat.rindex(")") + 2 :].split()
+        children.setdefault(int(fields[1]), []).append(int(entry))
+        times[int(entry)] = int(fields[11]) + int(fields[12])
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        total += times.get(current, 0)
+        pending += children.get(current, [])
+    return total / os.sysconf("SC_CLK_TCK")
+
+
+def download(base_url: str, size: int) -> None:
+    received = 0
+    with httpx.stream("GET", f"{base_url}/restful/bench/download.bin", timeout=None) as response:
+        response.raise_for_status()
+        for chunk in response.iter_raw(1024 * 1024):
+            received += len(chunk)
+    if received != size:
+        raise RuntimeError(f"received {received} bytes, expected {size}")
+
+
+def run_config(env: dict[str, str], server: str, pathsend: bool, size: int, repeat: int) -> dict:
+    env = {**env, "ZJBS_FILE_FILE_PATHSEND": str(pathsend).lower()}
+    cpu_per_gb, throughput = [], []
+    with run_server(env, server) as (base_url, process):
+        download(base_url, size)  # 预热
+        for _ in range(repeat):
+            cpu_start, start = process_tree_cpu_seconds(process.pid), time.perf_counter()
+            download(base_url, size)
+            elapsed = time.perf_counter() - start
+            cpu = process_tree_cpu_seconds(process.pid) - cpu_start
+            cpu_per_gb.append(cpu / (size / 1024**3))
+            throughput.append(size / 1024**2 / elapsed)
+    return {
+        "server": server,
+        "pathsend": pathsend,
+        "size": size,
+        "server_cpu_seconds_per_gb": round(statistics.median(cpu_per_gb), 3),
+        "throughput_mib_per_second": round(statistics.median(throughput), 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", default="1G", help="下载的文件大小")
+    parser.add_argument("--repeat", type=int, default=5, help="每种配置的下载次数，报告中位数")
+    parser.add_argument("--server", action="append", choices=["uvicorn", "granian"], help="默认测试全部")
+    args = parser.parse_args()
+    size = parse_size(args.size)
+
+    with tempfile.TemporaryDirectory(prefix="zjbs-bench-") as tmp_dir:
+        data_dir = Path(tmp_dir)
+        env = configure_data_dir(data_dir)
+        file_path = data_dir / "file" / "bench" / "download.bin"
+        file_path.parent.mkdir(parents=True)
+        with file_path.open("wb") as file:
+            for _ in range(0, size, 1024 * 1024):
+                file.write(os.urandom(min(1024 * 1024, size - file.tell())))
+        for server, pathsend in CONFIGS:
+            if args.server and server not in args.server:
+                continue
+            result = run_config(env, server, pathsend, size, args.repeat)
+            print(json.dumps(result), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+"""文件服务的性能基准测试，结果以JSON输出，保存下来即可比较不同版本
+
+target为asgi时客户端直接调用进程内的应用，为uvicorn时在子进程中启动uvicorn，通过本机TCP访问；
+asgi在内存中缓存整个请求体和响应体，超过100M的传输和压缩只在uvicorn中测试
+压缩包缓存默认关闭，否则重复测试压缩时测到的是缓存
+
+用法：python benchmark/bench_suite.py --target asgi --target uvicorn --sizes 1K,1M,100M,10G --output result.json
+      python benchmark/bench_suite.py --compare old.json new.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from server import ASGI_MAX_SIZE, ROOT_DIR, configure_data_dir, parse_size, run_uvicorn
+
+# 生成测试文件时每次写入的块，重复使用同一块随机数据，生成10GB文件也很快
+WRITE_BLOCK_SIZE = 1024 * 1024
+SMALL_FILE_SIZE = 4 * 1024
+
+
+def parse_list(text: str, parse: Callable[[str], int]) -> list[int]:
+    return [parse(item) for item in text.split(",") if item.strip()]
+
+
+def write_random_file(path: Path, size: int) -> None:
+    block = os.urandom(min(size, WRITE_BLOCK_SIZE))
+    with open(path, "wb") as file:
+        remaining = size
+        while remaining > 0:
+            remaining -= file.write(block[:remaining])
+
+
+def make_tree(directory: Path, total_size: int, file_count: int) -> None:
+    """一半文件是可压缩的文本，一半是随机数据"""
+    directory.mkdir(parents=True, exist_ok=True)
+    file_size = max(1, total_size // file_count)
+    for index in range(file_count):
+        sub_directory = directory / f"d{index % 16}"
+        sub_directory.mkdir(exist_ok=True)
+        if index % 2:
+            write_random_file(sub_directory / f"{index}.bin", file_size)
+        else:
+            line = f"{index},channel,{index * 0.001:.6f},sample\n".encode()
+            (sub_directory / f"{index}.csv").write_bytes(line * (file_size // len(line) + 1))
+
+
+class Runner:
+    def __init__(self, client, target: str, file_dir: Path, work_dir: Path, repeat: int):
+        self.client = client
+        self.target = target
+        self.file_dir = file_dir
+        self.work_dir = work_dir
+        self.repeat = repeat
+        self.results: list[dict] = []
+
+    async def measure(
+        self, case: str, params: dict, run: Callable[[], Awaitable[None]], size_bytes: int = 0, operations: int = 1
+    ) -> None:
+        durations = []
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            await run()
+            durations.append(time.perf_counter() - start)
+        best, median = min(durations), statistics.median(durations)
+        result = {
+            "target": self.target,
+            "case": case,
+            "params": params,
+            "repeat": self.repeat,
+            "best_seconds": round(best, 6),
+            "median_seconds": round(median, 6),
+            "ops_per_second": round(operations / median, 2),
+        }
+        if size_bytes:
+            result["size_bytes"] = size_bytes
+            result["throughput_mb_s"] = round(size_bytes / median / 1024**2, 2)
+        print(json.dumps(result, ensure_ascii=False), file=sys.stderr)
+        self.results.append(result)
+
+    def skip_large(self, case: str, size: int) -> bool:
+        """asgi目标跳过超过ASGI_MAX_SIZE的传输"""
+        if self.target != "asgi" or size <= ASGI_MAX_SIZE:
+            return False
+        print(json.dumps({"target": self.target, "case": case, "skipped_size": size}), file=sys.stderr)
+        return True
+
+    async def bench_transfer(self, sizes: list[int]) -> None:
+        for size in sizes:
+            if self.skip_large("transfer", size):
+                continue
+            local_file = self.work_dir / f"transfer_{size}.bin"
+            write_random_file(local_file, size)
+            target = self.work_dir / f"download_{size}.bin"
+
+            async def upload() -> None:
+                with open(local_file, "rb") as reader:
+                    await self.client.upload(
+                        "/bench/transfer", reader, local_file.name, mkdir=True, allow_overwrite=True
+                    )
+
+            async def download() -> None:
+                await self.client.download_file(f"/bench/transfer/{local_file.name}", target)
+
+            await self.measure("upload_file", {"size": size}, upload, size)
+            await self.measure("download_file", {"size": size}, download, size)
+            local_file.unlink()
+            target.unlink(missing_ok=True)
+            (self.file_dir / "bench" / "transfer" / local_file.name).unlink()
+
+    async def bench_listing(self, counts: list[int]) -> None:
+        for count in counts:
+            directory = self.file_dir / "bench" / f"listing_{count}"
+            directory.mkdir(parents=True)
+            for index in range(count):
+                (directory / f"{index:07d}.edf").touch()
+
+            async def list_directory() -> None:
+                await self.client.list_directory(f"/bench/listing_{count}")
+
+            async def walk_directory() -> None:
+                async for _ in self.client.walk_directory(f"/bench/listing_{count}"):
+                    pass
+
+            await self.measure("list_directory", {"entries": count}, list_directory, operations=count)
+            await self.measure("walk_directory", {"entries": count}, walk_directory, operations=count)
+            shutil.rmtree(directory)
+
+    async def bench_compress(self, methods: list[str], tree_size: int, tree_files: int) -> None:
+        from zjbs_file_client import CompressMethod
+
+        if self.skip_large("compress", tree_size):
+            return
+        tree_name = "tree"
+        make_tree(self.file_dir / "bench" / tree_name, tree_size, tree_files)
+        local_tree = self.work_dir / tree_name
+        make_tree(local_tree, tree_size, tree_files)
+        tree_params = {"tree_size": tree_size, "tree_files": tree_files}
+        for method in methods:
+            compress_method = CompressMethod(method)
+            params = {"path": f"/bench/{tree_name}", "compress_method": method}
+
+            async def compress() -> None:
+                # 只测服务器压缩并发送，丢弃响应体，不在客户端解压
+                async with self.client.inner.stream("POST", "/download-directory", params=params) as response:
+                    response.raise_for_status()
+                    async for _ in response.aiter_raw():
+                        pass
+
+            async def upload_directory() -> None:
+                await self.client.upload_directory(f"/bench/upload_{method}", local_tree, compress_method, mkdir=True)
+                shutil.rmtree(self.file_dir / "bench" / f"upload_{method}")
+
+            case_params = {**tree_params, "compress_method": method}
+            await self.measure("compress", case_params, compress, tree_size)
+            # 客户端上传文件夹不支持zip
+            if compress_method != CompressMethod.zip:
+                await self.measure("upload_directory", case_params, upload_directory, tree_size)
+        shutil.rmtree(local_tree)
+        shutil.rmtree(self.file_dir / "bench" / tree_name)
+
+    async def bench_small_files(self, counts: list[int]) -> None:
+        from zjbs_file_client import CompressMethod
+
+        content = os.urandom(SMALL_FILE_SIZE)
+        for count in counts:
+            local_dir = self.work_dir / f"small_{count}"
+            local_dir.mkdir()
+            for index in range(count):
+                (local_dir / f"{index}.bin").write_bytes(content)
+
+            async def upload_many() -> None:
+                files = [(f"{index}.bin", content) for index in range(count)]
+                await self.client.upload_many(f"/bench/small_many_{count}", files, mkdir=True, allow_overwrite=True)
+
+            async def upload_directory() -> None:
+                await self.client.upload_directory(
+                    f"/bench/small_directory_{count}", local_dir, CompressMethod.not_compressed, mkdir=True
+                )
+                shutil.rmtree(self.file_dir / "bench" / f"small_directory_{count}")
+
+            async def download_directory() -> None:
+                target = self.work_dir / f"small_download_{count}"
+                target.mkdir()
+                await self.client.download_directory(
+                    f"/bench/small_many_{count}", target, CompressMethod.not_compressed
+                )
+                shutil.rmtree(target)
+
+            params = {"files": count, "file_size": SMALL_FILE_SIZE}
+            size = count * SMALL_FILE_SIZE
+            await self.measure("small_files_upload_many", params, upload_many, size, count)
+            await self.measure("small_files_upload_directory", params, upload_directory, size, count)
+            await self.measure("small_files_download_directory", params, download_directory, size, count)
+            shutil.rmtree(local_dir)
+            shutil.rmtree(self.file_dir / "bench" / f"small_many_{count}")
+
+
+async def run_target(args: argparse.Namespace, target: str, env: dict[str, str], data_dir: Path) -> list[dict]:
+    from zjbs_file_client import AsyncClient
+
+    file_dir = Path(os.environ["ZJBS_FILE_FILE_DIR"])
+    work_dir = data_dir / f"work_{target}"
+    work_dir.mkdir()
+    if target == "asgi":
+        from zjbs_file_server.main import app
+
+        async with AsyncClient(base_url="http://testserver", app=app, timeout=None) as client:
+            return await run_cases(args, Runner(client, target, file_dir, work_dir, args.repeat))
+    with run_uvicorn(env, args.workers) as base_url:
+        async with AsyncClient(base_url=base_url, timeout=None) as client:
+            return await run_cases(args, Runner(client, target, file_dir, work_dir, args.repeat))
+
+
+async def run_cases(args: argparse.Namespace, runner: Runner) -> list[dict]:
+    try:
+        if "transfer" in args.cases:
+            await runner.bench_transfer(args.sizes)
+        if "listing" in args.cases:
+            await runner.bench_listing(args.listing_entries)
+        if "compress" in args.cases:
+            await runner.bench_compress(args.compress_methods, args.tree_size, args.tree_files)
+        if "small_files" in args.cases:
+            await runner.bench_small_files(args.small_files)
+    finally:
+        shutil.rmtree(runner.file_dir / "bench", ignore_errors=True)
+        shutil.rmtree(runner.work_dir, ignore_errors=True)
+    return runner.results
+
+
+def environment_info() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(old_path: Path, new_path: Path) -> None:
+    """按(target, case, params)匹配两次结果，输出中位耗时的比值，大于1表示变慢"""
+    old, new = json.loads(old_path.read_text()), json.loads(new_path.read_text())
+
+    def key(result: dict) -> str:
+        return json.dumps([result["target"], result["case"], result["params"]], sort_keys=True)
+
+    old_results = {key(result): result for result in old["results"]}
+    for result in new["results"]:
+        if (old_result := old_results.get(key(result))) is None:
+            continue
+        ratio = result["median_seconds"] / old_result["median_seconds"]
+        comparison = {"target": result["target"], "case": result["case"], "params": result["params"]}
+        print(json.dumps(comparison | {"median_ratio": round(ratio, 3)}, ensure_ascii=False))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", action="append", choices=["asgi", "uvicorn"], help="默认只测试asgi")
+    parser.add_argument(
+        "--case",
+        dest="cases",
+        action="append",
+        choices=["transfer", "listing", "compress", "small_files"],
+        help="默认测试全部",
+    )
+    parser.add_argument("--sizes", default="1K,1M,100M", help="上传、下载的文件大小，逗号分隔，最大可到10G")
+    parser.add_argument("--listing-entries", default="100,10000", help="文件夹的项数，逗号分隔，最大可到1000000")
+    parser.add_argument(
+        "--compress-methods", default="not_compressed,zip,tgz,txz,tzst,ptgz", help="测试的压缩方式，逗号分隔"
+    )
+    parser.add_argument("--tree-size", default="64M", help="压缩测试的文件夹总大小")
+    parser.add_argument("--tree-files", type=int, default=256, help="压缩测试的文件夹中的文件数")
+    parser.add_argument("--small-files", default="1000", help="小文件测试的文件数，逗号分隔")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数，报告最好和中位耗时")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn的worker数")
+    parser.add_argument("--output", type=Path, help="结果写入的JSON文件，默认输出到标准输出")
+    parser.add_argument("--compare", type=Path, nargs=2, metavar=("OLD", "NEW"), help="比较两次结果，不运行测试")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    args.targets = args.target or ["asgi"]
+    args.cases = args.cases or ["transfer", "listing", "compress", "small_files"]
+    args.sizes = parse_list(args.sizes, parse_size)
+    args.listing_entries = parse_list(args.listing_entries, int)
+    args.compress_methods = [method.strip() for method in args.compress_methods.split(",") if method.strip()]
+    args.tree_size = parse_size(args.tree_size)
+    args.small_files = parse_list(args.small_files, int)
+
+    with tempfile.TemporaryDirectory(prefix="zjbs-bench-") as tmp_dir:
+        data_dir = Path(tmp_dir)
+        env = configure_data_dir(data_dir, {"ZJBS_FILE_ARCHIVE_CACHE_MAX_SIZE": "0"})
+        results = []
+        for target in args.targets:
+            results += asyncio.run(run_target(args, target, env, data_dir))
+
+    report = {"environment": environment_info(), "config": vars(args) | {"compare": None}, "results": results}
+    text = json.dumps(report, ensure_ascii=False, indent=2, default=str)
+    if args.output:
+        args.output.write_text(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""混合负载压测：按目标请求速率发起大文件下载、小文件上传、列出文件夹等请求，报告每种操作的延迟分位数、错误率和吞吐量
+
+请求按泊松过程到达，延迟从计划发起的时间算起，并发数达到--clients时新请求排队，排队时间也计入延迟；
+另有探测请求定期列出一个只有一项的文件夹，探测延迟升高说明服务器的事件循环被阻塞，例如async def路由中调用了同步函数
+
+默认在子进程中启动uvicorn；--base-url指定已经运行的服务器，测试数据放在其/loadtest下，结束后删除
+
+用法：python benchmark/load_test.py --rate 100 --clients 200 --duration 30 --mix download_large=1,upload_small=5,list=4
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import httpx
+from server import ASGI_MAX_SIZE, configure_data_dir, parse_size, run_uvicorn
+
+OPERATIONS = ("download_large", "download_small", "upload_small", "upload_large", "list", "walk")
+ROOT = "/loadtest"
+
+
+def parse_mix(text: str) -> dict[str, float]:
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r}, choose from {', '.join(OPERATIONS)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """最近秩法"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(len(sorted_values) * fraction + 0.5) - 1))
+    return sorted_values[index]
+
+
+@dataclass
+class OperationStats:
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+    bytes: int = 0
+    error_samples: list[str] = field(default_factory=list)
+
+    def report(self, duration: float) -> dict:
+        latencies = sorted(self.latencies)
+        total = len(latencies) + self.errors
+        return {
+            "requests": total,
+            "errors": self.errors,
+            "error_rate": round(self.errors / total, 4) if total else 0.0,
+            "requests_per_second": round(total / duration, 2),
+            "throughput_mb_s": round(self.bytes / duration / 1024**2, 2),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "max_ms": round((latencies[-1] if latencies else 0.0) * 1000, 2),
+            "error_samples": self.error_samples,
+        }
+
+
+class LoadTest:
+    def __init__(self, client, args: argparse.Namespace):
+        self.client = client
+        self.args = args
+        self.stats = {name: OperationStats() for name in [*args.mix, "probe"]}
+        self.small_content = os.urandom(args.small_size)
+        self.large_content = os.urandom(args.large_size) if "upload_large" in args.mix else b""
+
+    async def prepare(self) -> None:
+        """上传测试数据：大小文件各一个，以及有--list-entries项的文件夹"""
+        await self.client.upload(ROOT, self.small_content, "small.bin", mkdir=True, allow_overwrite=True)
+        await self.client.upload(ROOT, os.urandom(self.args.large_size), "large.bin", allow_overwrite=True)
+        files = [(f"{index}.bin", self.small_content) for index in range(self.args.list_entries)]
+        await self.client.upload_many(f"{ROOT}/list", files, mkdir=True, allow_overwrite=True)
+        await self.client.upload(f"{ROOT}/probe", b"", "empty", mkdir=True, allow_overwrite=True)
+
+    async def cleanup(self) -> None:
+        await self.client.delete(ROOT, recursive=True)
+
+    async def _download(self, path: str) -> int:
+        size = 0
+        async with self.client.inner.stream("POST", "/download-file", params={"path": path}) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_raw():
+                size += len(chunk)
+        return size
+
+    async def run_operation(self, name: str) -> int:
+        """返回传输的字节数"""
+        match name:
+            case "download_large":
+                return await self._download(f"{ROOT}/large.bin")
+            case "download_small":
+                return await self._download(f"{ROOT}/small.bin")
+            case "upload_small" | "upload_large":
+                content = self.small_content if name == "upload_small" else self.large_content
+                await self.client.upload(f"{ROOT}/uploads", content, f"{uuid.uuid4().hex}.bin", mkdir=True)
+                return len(content)
+            case "list":
+                await self.client.list_directory(f"{ROOT}/list")
+                return 0
+            case "walk":
+                async for _ in self.client.walk_directory(f"{ROOT}/list"):
+                    pass
+                return 0
+            case "probe":
+                await self.client.list_directory(f"{ROOT}/probe")
+                return 0
+        raise ValueError(name)
+
+    async def issue(self, name: str, scheduled: float, semaphore: asyncio.Semaphore) -> None:
+        stats = self.stats[name]
+        async with semaphore if name != "probe" else nullcontext():
+            try:
+                size = await self.run_operation(name)
+            except Exception as e:
+                stats.errors += 1
+                if len(stats.error_samples) < 5:
+                    stats.error_samples.append(repr(e))
+                return
+        stats.latencies.append(time.perf_counter() - scheduled)
+        stats.bytes += size
+
+    async def run(self) -> dict:
+        names, weights = list(self.args.mix), list(self.args.mix.values())
+        semaphore = asyncio.Semaphore(self.args.clients)
+        rng = random.Random(self.args.seed)
+        tasks: set[asyncio.Task] = set()
+
+        def spawn(name: str, scheduled: float) -> None:
+            task = asyncio.create_task(self.issue(name, scheduled, semaphore))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        start = time.perf_counter()
+        end = start + self.args.duration
+        next_request = next_probe = start
+        while (now := time.perf_counter()) < end:
+            while next_request <= now:
+                spawn(rng.choices(names, weights)[0], next_request)
+                next_request += rng.expovariate(self.args.rate)
+            if next_probe <= now:
+                spawn("probe", next_probe)
+                next_probe += self.args.probe_interval
+            await asyncio.sleep(max(0.0, min(next_request, next_probe, end) - time.perf_counter()))
+        if tasks:
+            await asyncio.wait(tasks)
+        duration = time.perf_counter() - start
+        return {
+            "duration_seconds": round(duration, 3),
+            "operations": {name: stats.report(duration) for name, stats in self.stats.items()},
+        }
+
+
+async def run_load_test(args: argparse.Namespace, base_url: str | None) -> dict:
+    from zjbs_file_client import AsyncClient
+
+    if base_url is None:
+        from zjbs_file_server.main import app
+
+        client = AsyncClient(base_url="http://testserver", app=app, timeout=args.timeout)
+    else:
+        limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=args.clients)
+        client = AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits)
+    async with client:
+        load_test = LoadTest(client, args)
+        await load_test.prepare()
+        try:
+            return await load_test.run()
+        finally:
+            await load_test.cleanup()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", help="已经运行的服务器地址，默认在子进程中启动uvicorn")
+    parser.add_argument(
+        "--asgi", action="store_true", help="在进程内调用应用，客户端与服务器共用事件循环，只用于没有uvicorn时检查脚本"
+    )
+    parser.add_argument("--workers", type=int, default=1, help="启动uvicorn时的worker数")
+    parser.add_argument("--rate", type=float, default=50, help="目标请求速率，每秒请求数")
+    parser.add_argument("--clients", type=int, default=200, help="最大并发请求数")
+    parser.add_argument("--duration", type=float, default=30, help="持续秒数")
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=parse_mix("download_large=1,download_small=3,upload_small=3,list=3"),
+        help=f"操作及权重，逗号分隔，可选{', '.join(OPERATIONS)}",
+    )
+    parser.add_argument("--large-size", type=parse_size, default=parse_size("32M"), help="大文件的大小")
+    parser.add_argument("--small-size", type=parse_size, default=parse_size("4K"), help="小文件的大小")
+    parser.add_argument("--list-entries", type=int, default=1000, help="列出的文件夹中的项数")
+    parser.add_argument("--probe-interval", type=float, default=0.1, help="探测请求的间隔秒数")
+    parser.add_argument("--timeout", type=float, default=300, help="单个请求的超时秒数")
+    parser.add_argument("--seed", type=int, default=0, help="随机数种子，相同种子产生相同的请求序列")
+    parser.add_argument("--output", type=Path, help="结果写入的JSON文件，默认输出到标准输出")
+    args = parser.parse_args()
+    if args.asgi and args.large_size > ASGI_MAX_SIZE:
+        parser.error(f"--asgi buffers whole bodies in memory, --large-size must not exceed {ASGI_MAX_SIZE}")
+
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    if args.base_url:
+        result = asyncio.run(run_load_test(args, args.base_url))
+    else:
+        with tempfile.TemporaryDirectory(prefix="zjbs-load-") as tmp_dir:
+            env = configure_data_dir(Path(tmp_dir))
+            if args.asgi:
+                result = asyncio.run(run_load_test(args, None))
+            else:
+                with run_uvicorn(env, args.workers) as base_url:
+                    result = asyncio.run(run_load_test(args, base_url))
+
+    text = json.dumps({"config": config, **result}, ensure_ascii=False, indent=2)
+    if args.output:
+        args.output.write_text(text)
+    else:
+        print(text)
+    if any(report["errors"] for report in result["operations"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""基准测试共用的服务器启动方法和参数解析：数据目录放在临时文件夹中，不影响.data"""
+
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+import httpx
+
+ROOT_DIR = Path(__file__).parent.parent
+SOURCE_PATHS = [str(ROOT_DIR / "src"), str(ROOT_DIR / "client" / "src")]
+sys.path.extend(SOURCE_PATHS)
+
+SIZE_UNITS = {"K": 1024, "M": 1024**2, "G": 1024**3}
+# 进程内调用应用时httpx的ASGITransport在内存中缓存整个请求体和响应体，只测试不超过此大小的传输
+ASGI_MAX_SIZE = 100 * 1024**2
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().upper().removesuffix("B")
+    if text and text[-1] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+def configure_data_dir(data_dir: Path, extra_env: dict[str, str] | None = None) -> dict[str, str]:
+    """在导入zjbs_file_server之前调用，服务器的各个目录都放在data_dir中；返回启动子进程时使用的环境变量
+
+    总是覆盖已有的环境变量，否则会在真实的FILE_DIR中测试，结束时删除其中的bench文件夹
+    """
+    env = {
+        "ZJBS_FILE_FILE_DIR": str(data_dir / "file"),
+        "ZJBS_FILE_TEMP_DIR": str(data_dir / "temp"),
+        "ZJBS_FILE_LOG_DIR": str(data_dir / "log"),
+        "ZJBS_FILE_DEDUP_STORE_DIR": str(data_dir / "blob"),
+        "ZJBS_FILE_CHECKSUM_DB_PATH": str(data_dir / "checksum.sqlite3"),
+        **(extra_env or {}),
+    }
+    os.environ.update(env)
+    for name in ("file", "temp", "log"):
+        (data_dir / name).mkdir(parents=True, exist_ok=True)
+    return {**os.environ, "PYTHONPATH": os.pathsep.join([*SOURCE_PATHS, os.environ.get("PYTHONPATH", "")])}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+SERVER_COMMANDS = {
+    "uvicorn": ["-m", "uvicorn", "zjbs_file_server.main:app", "--log-level", "warning", "--workers"],
+    "granian": ["-m", "granian", "--interface", "asgi", "--log-level", "warning", "--workers"],
+}
+
+
+@contextmanager
+def run_server(
+    env: dict[str, str], server: str = "uvicorn", workers: int = 1, timeout: float = 30
+) -> Iterator[tuple[str, subprocess.Popen]]:
+    """在子进程中启动uvicorn或granian，返回base_url和子进程"""
+    port = _free_port()
+    command = [sys.executable, *SERVER_COMMANDS[server], str(workers), "--port", str(port)]
+    if server == "granian":
+        command.append("zjbs_file_server.main:app")
+    process = subprocess.Popen(command, env=env)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                httpx.get(f"{base_url}/metrics", timeout=1)
+                break
+            except httpx.TransportError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f"{server} failed to start, is {server} installed?")
+                time.sleep(0.1)
+        yield base_url, process
+    finally:
+        process.terminate()
+        process.wait()
+
+
+@contextmanager
+def run_uvicorn(env: dict[str, str], workers: int = 1, timeout: float = 30) -> Iterator[str]:
+    """在子进程中启动uvicorn，返回base_url"""
+    with run_server(env, "uvicorn", workers, timeout) as (base_url, _):
+        yield base_url
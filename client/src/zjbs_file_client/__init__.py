@@ -1,4 +1,30 @@
 from .client import AsyncClient, Client
-from .model import CompressMethod, FileSystemInfo, FileType
+from .model import (
+    BatchOperationResult,
+    CompressMethod,
+    FileChecksum,
+    FileSystemInfo,
+    FileTreeInfo,
+    FileType,
+    ListSortKey,
+    SyncDirection,
+    SyncPlan,
+    TempSpaceUsage,
+    UploadSessionInfo,
+)
 
-__all__ = ["Client", "AsyncClient", "FileSystemInfo", "FileType", "CompressMethod"]
+__all__ = [
+    "BatchOperationResult",
+    "Client",
+    "AsyncClient",
+    "FileChecksum",
+    "FileSystemInfo",
+    "FileTreeInfo",
+    "FileType",
+    "CompressMethod",
+    "ListSortKey",
+    "SyncDirection",
+    "SyncPlan",
+    "TempSpaceUsage",
+    "UploadSessionInfo",
+]
@@ -0,0 +1,57 @@
+import argparse
+import os
+import sys
+
+from .client import Client
+from .model import SyncDirection
+
+BASE_URL_ENV = "ZJBS_FILE_SERVER_URL"
+
+
+def _parse_args(argv: list[str] | None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="zjbs-file-client", description="ZJBrainSciencePlatform file client")
+    parser.add_argument(
+        "--base-url", default=os.environ.get(BASE_URL_ENV), help=f"文件服务器地址，默认读取环境变量{BASE_URL_ENV}"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    sync_parser = subparsers.add_parser("sync", help="同步本地文件夹和服务器上的文件夹，只传输新增或变化的文件")
+    sync_parser.add_argument("local_dir", help="本地文件夹")
+    sync_parser.add_argument("remote_dir", help="服务器上的文件夹，以/开头")
+    sync_parser.add_argument(
+        "--direction", type=SyncDirection, choices=list(SyncDirection), default=SyncDirection.upload, help="同步方向"
+    )
+    sync_parser.add_argument("--delete", action="store_true", help="删除目标中源没有的文件和文件夹")
+    sync_parser.add_argument("--checksum", action="store_true", help="大小相同的文件比较sha256而不是修改时间")
+    sync_parser.add_argument("--concurrency", type=int, default=4, help="同时传输的文件数")
+    sync_parser.add_argument("--dry-run", action="store_true", help="只打印同步计划，不做修改")
+
+    args = parser.parse_args(argv)
+    if not args.base_url:
+        parser.error(f"--base-url or environment variable {BASE_URL_ENV} is required")
+    return args
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = _parse_args(argv)
+    with Client(args.base_url, timeout=None) as client:
+        match args.command:
+            case "sync":
+                plan = client.sync(
+                    args.local_dir,
+                    args.remote_dir,
+                    args.direction,
+                    delete=args.delete,
+                    checksum=args.checksum,
+                    concurrency=args.concurrency,
+                    dry_run=args.dry_run,
+                )
+                for path in plan.delete:
+                    print(f"delete {path}")
+                for path in plan.transfer:
+                    print(f"{args.direction} {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,19 @@
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import lzma
+import os
+import posixpath
+import queue
 import tarfile
-import tempfile
-from contextlib import contextmanager
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager, nullcontext
 from io import IOBase
 from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Iterable, Iterator, Literal
 
 import httpx
 from httpx import Response
@@ -10,69 +21,420 @@ from httpx import Response
 # noinspection PyProtectedMember
 from httpx._types import FileTypes, QueryParamTypes, RequestFiles
 
-from .model import CompressMethod, FileSystemInfo
+from .compression import write_tar
+from .delta import BLOCK_SIZE_HEADER, FILE_SIZE_HEADER, BlockSignature, aiter_delta, iter_delta
+from .model import (
+    BatchOperationResult,
+    CompressMethod,
+    FileChecksum,
+    FileSystemInfo,
+    FileTreeInfo,
+    FileType,
+    ListSortKey,
+    SyncDirection,
+    SyncPlan,
+    TempSpaceUsage,
+    UploadSessionInfo,
+)
+from .sync import (
+    TreeState,
+    delete_local,
+    file_sha256,
+    plan_sync,
+    prepare_local_target,
+    remote_path,
+    remote_tree,
+    scan_local,
+    set_local_mtime,
+    update_local_mtimes,
+)
+
+DEFAULT_CHUNK_SIZE = 16 * 1024 * 1024
+# 断点续传时在目标文件旁保存服务器ETag的文件后缀
+RESUME_ETAG_SUFFIX = ".etag"
+# 上传文件夹时压缩数据块的大小和最多缓存的块数
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+UPLOAD_QUEUE_SIZE = 8
 
 
 def _prepare_upload(
-    directory: str, file: FileTypes, filename: str, mkdir: bool | None, allow_overwrite: bool | None
+    directory: str,
+    file: FileTypes,
+    filename: str,
+    mkdir: bool | None,
+    allow_overwrite: bool | None,
+    expected_sha256: str | None,
 ) -> tuple[RequestFiles, QueryParamTypes]:
     params = {"directory": directory}
     if mkdir is not None:
         params["mkdir"] = mkdir
     if allow_overwrite is not None:
         params["allow_overwrite"] = allow_overwrite
+    if expected_sha256 is not None:
+        params["expected_sha256"] = expected_sha256
     files = {"file": (filename, file, "application/octet-stream")}
     return files, params
 
 
+def _prepare_upload_by_hash(
+    directory: str, filename: str, sha256: str, mkdir: bool | None, allow_overwrite: bool | None
+) -> QueryParamTypes:
+    params = {"directory": directory, "filename": filename, "sha256": sha256}
+    if mkdir is not None:
+        params["mkdir"] = mkdir
+    if allow_overwrite is not None:
+        params["allow_overwrite"] = allow_overwrite
+    return params
+
+
+def _prepare_upload_many(
+    directory: str, files: Iterable[tuple[str, FileTypes]], mkdir: bool | None, allow_overwrite: bool | None
+) -> tuple[RequestFiles, QueryParamTypes]:
+    params = {"directory": directory}
+    if mkdir is not None:
+        params["mkdir"] = mkdir
+    if allow_overwrite is not None:
+        params["allow_overwrite"] = allow_overwrite
+    request_files = [("files", (filename, file, "application/octet-stream")) for filename, file in files]
+    return request_files, params
+
+
+def _prepare_delete_many(paths: Iterable[str], recursive: bool) -> list[dict]:
+    return [{"type": "delete", "path": path, "recursive": recursive} for path in paths]
+
+
+def _prepare_rename_many(renames: Iterable[tuple[str, str]]) -> list[dict]:
+    return [{"type": "rename", "path": path, "new_name": new_name} for path, new_name in renames]
+
+
+def _finish_batch(response: Response) -> list[BatchOperationResult]:
+    return [BatchOperationResult(**result) for result in response.json()]
+
+
 @contextmanager
+def _open_tar(fileobj: BinaryIO, compress_method: CompressMethod, mode: Literal["r", "w"]) -> Iterator[tarfile.TarFile]:
+    match compress_method:
+        case CompressMethod.not_compressed:
+            compressed = nullcontext(fileobj)
+        case CompressMethod.tgz | CompressMethod.ptgz:
+            compressed = gzip.GzipFile(fileobj=fileobj, mode=f"{mode}b")
+        case CompressMethod.txz:
+            compressed = lzma.LZMAFile(fileobj, mode=f"{mode}b")
+        case CompressMethod.tzst:
+            try:
+                import zstandard
+            except ImportError:
+                raise ImportError("compress method tzst requires zstandard, install zjbs-file-client[zstd]")
+            if mode == "w":
+                compressed = zstandard.ZstdCompressor(threads=-1).stream_writer(fileobj, closefd=False)
+            else:
+                compressed = zstandard.ZstdDecompressor().stream_reader(fileobj, read_across_frames=True, closefd=False)
+        case _:
+            raise ValueError(f"unsupported compress_method: {compress_method}")
+    with compressed as stream, tarfile.open(fileobj=stream, mode=f"{mode}|") as tar_file:
+        yield tar_file
+
+
+class _ProducerClosed(Exception):
+    pass
+
+
+def _multipart_file_part(name: str, filename: str, boundary: str) -> tuple[bytes, bytes]:
+    """只有一个文件字段的multipart请求体中，文件内容之前和之后的字节"""
+    filename = filename.replace("\\", "\\\\").replace('"', '\\"')
+    preamble = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+        f"Content-Type: application/octet-stream\r\n\r\n"
+    ).encode()
+    return preamble, f"\r\n--{boundary}--\r\n".encode()
+
+
+async def _aiter_file_upload(file: str | Path, preamble: bytes, epilogue: bytes) -> AsyncIterator[bytes]:
+    """在线程中打开和读取本地文件，上传大文件时不阻塞事件循环"""
+    reader = await asyncio.to_thread(open, file, "rb")
+    try:
+        yield preamble
+        while chunk := await asyncio.to_thread(reader.read, UPLOAD_BLOCK_SIZE):
+            yield chunk
+        yield epilogue
+    finally:
+        await asyncio.to_thread(reader.close)
+
+
+class _DirectoryUploadBody:
+    """上传文件夹的multipart请求体：后台线程边打包压缩边把数据块放入有界队列，发送方边取边发
+
+    压缩和上传同时进行，内存中最多缓存UPLOAD_QUEUE_SIZE个数据块，与文件夹大小无关
+    """
+
+    def __init__(self, directory: Path, compress_method: CompressMethod, adaptive: bool, boundary: str):
+        self.directory = directory
+        self.compress_method = compress_method
+        self.adaptive = adaptive
+        self.preamble, self.epilogue = _multipart_file_part("compressed_dir", directory.name, boundary)
+        self.queue: queue.Queue[bytes | BaseException | None] = queue.Queue(maxsize=UPLOAD_QUEUE_SIZE)
+        self.closed = threading.Event()
+        self.buffer = bytearray()
+        self.thread: threading.Thread | None = None
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        if len(self.buffer) >= UPLOAD_BLOCK_SIZE:
+            self._put(bytes(self.buffer))
+            self.buffer.clear()
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def _put(self, item: bytes | BaseException | None) -> None:
+        while not self.closed.is_set():
+            try:
+                self.queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+        raise _ProducerClosed()
+
+    def _produce(self) -> None:
+        try:
+            write_tar(self, self.directory, self.compress_method, self.adaptive)
+            if self.buffer:
+                self._put(bytes(self.buffer))
+            self._put(None)
+        except _ProducerClosed:
+            pass
+        except BaseException as e:
+            try:
+                self._put(e)
+            except _ProducerClosed:
+                pass
+
+    def _start(self) -> None:
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._produce, name="upload-directory", daemon=True)
+            self.thread.start()
+
+    def _get(self) -> bytes | None:
+        """关闭后不再等待，发送被取消时取数据的线程不会一直阻塞"""
+        while not self.closed.is_set():
+            try:
+                item = self.queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            if isinstance(item, BaseException):
+                raise item
+            return item
+        raise _ProducerClosed()
+
+    def iter_chunks(self) -> Iterator[bytes]:
+        self._start()
+        yield self.preamble
+        while (chunk := self._get()) is not None:
+            yield chunk
+        yield self.epilogue
+
+    async def aiter_chunks(self) -> AsyncIterator[bytes]:
+        self._start()
+        yield self.preamble
+        while (chunk := await asyncio.to_thread(self._get)) is not None:
+            yield chunk
+        yield self.epilogue
+
+    def close(self) -> None:
+        self.closed.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    async def aclose(self) -> None:
+        """在线程中等待生产线程退出，不阻塞事件循环"""
+        self.closed.set()
+        if self.thread is not None:
+            await asyncio.to_thread(self.thread.join)
+
+
 def _prepare_upload_directory(
     parent_dir: str,
     directory: Path | str,
     compress_method: CompressMethod,
     mkdir: bool | None,
     zip_metadata_encoding: str | None,
-) -> tuple[RequestFiles, QueryParamTypes]:
+    adaptive: bool,
+) -> tuple[_DirectoryUploadBody, dict[str, str], QueryParamTypes]:
+    """调用方发送完成或失败后必须关闭返回的请求体，结束后台的生产线程"""
     directory = Path(directory)
-    with tempfile.SpooledTemporaryFile() as tmp_compress_file:
-        match compress_method:
-            case CompressMethod.tgz | CompressMethod.txz:
-                with tarfile.open(
-                    fileobj=tmp_compress_file, mode="w:gz" if compress_method == CompressMethod.tgz else "w:xz"
-                ) as tar_file:
-                    tar_file.add(directory, arcname=directory.name)
-            case _:
-                raise ValueError(f"unsupported compress_method: {compress_method}")
-        params = {"parent_dir": parent_dir, "compress_method": compress_method}
-        if mkdir is not None:
-            params["mkdir"] = mkdir
-        if zip_metadata_encoding is not None:
-            params["zip_metadata_encoding"] = zip_metadata_encoding
-        files = {"compressed_dir": (directory.name, tmp_compress_file, "application/octet-stream")}
-        yield files, params
-
-
-def _finish_download(response: Response, target: IOBase | str | Path) -> None:
-    target_writer = target
+    boundary = os.urandom(16).hex()
+    body = _DirectoryUploadBody(directory, compress_method, adaptive, boundary)
+    headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+    params = {"parent_dir": parent_dir, "compress_method": compress_method}
+    if mkdir is not None:
+        params["mkdir"] = mkdir
+    if zip_metadata_encoding is not None:
+        params["zip_metadata_encoding"] = zip_metadata_encoding
+    return body, headers, params
+
+
+def _resume_etag_path(target: str | Path) -> Path:
+    """断点续传时保存服务器ETag的文件，下载完成后删除"""
+    target = Path(target)
+    return target.with_name(target.name + RESUME_ETAG_SUFFIX)
+
+
+def _prepare_download(target: IOBase | str | Path, resume: bool, if_none_match: str | None) -> dict[str, str]:
+    """断点续传时用If-Range带上次下载时的ETag，服务器上的文件变化后返回整个文件，从头下载；没有记录ETag时从头下载"""
+    headers = {}
+    if if_none_match is not None:
+        headers["If-None-Match"] = if_none_match
+    if resume:
+        if not isinstance(target, str | Path):
+            raise ValueError("resume requires target to be a path")
+        target = Path(target)
+        etag_path = _resume_etag_path(target)
+        if target.is_file() and (downloaded_size := target.stat().st_size) > 0 and etag_path.is_file():
+            headers["Range"] = f"bytes={downloaded_size}-"
+            headers["If-Range"] = etag_path.read_text().strip()
+    return headers
+
+
+@contextmanager
+def _open_download_target(response: Response, target: IOBase | str | Path, resume: bool) -> Iterator[IOBase | None]:
+    # 文件没有变化，服务器返回304
+    if response.status_code == httpx.codes.NOT_MODIFIED:
+        yield None
+        return
+    # 断点续传时目标文件已经完整，服务器返回416
+    if (
+        resume
+        and response.status_code == httpx.codes.REQUESTED_RANGE_NOT_SATISFIABLE
+        and response.headers.get("Content-Range") == f"bytes */{Path(target).stat().st_size}"
+    ):
+        _resume_etag_path(target).unlink(missing_ok=True)
+        yield None
+        return
+    response.raise_for_status()
+    if not isinstance(target, str | Path):
+        yield target
+        return
+    # If-Range不匹配时服务器返回200和整个文件，覆盖已经下载的部分
+    mode = "ab" if resume and response.status_code == httpx.codes.PARTIAL_CONTENT else "wb"
+    etag_path = _resume_etag_path(target)
+    if resume:
+        etag = response.headers.get("ETag")
+        # If-Range只能使用强ETag
+        if etag is not None and not etag.startswith("W/"):
+            etag_path.write_text(etag)
+        else:
+            etag_path.unlink(missing_ok=True)
+    with open(target, mode) as target_writer:
+        yield target_writer
+    # 下载中断时保留ETag，下次续传
+    if resume:
+        etag_path.unlink(missing_ok=True)
+
+
+@asynccontextmanager
+async def _aopen_download_target(
+    response: Response, target: IOBase | str | Path, resume: bool
+) -> AsyncIterator[IOBase | None]:
+    """在线程中执行_open_download_target的文件操作，包括打开目标文件和读写.etag文件"""
+    context = _open_download_target(response, target, resume)
+    target_writer = await asyncio.to_thread(context.__enter__)
     try:
-        if isinstance(target, str | Path):
-            target_writer = open(target, "wb")
-        for chunk in response.iter_bytes(1024 * 1024):
-            target_writer.write(chunk)
-    finally:
-        if isinstance(target, str | Path):
-            target_writer.close()
+        yield target_writer
+    except BaseException as e:
+        if not await asyncio.to_thread(context.__exit__, type(e), e, e.__traceback__):
+            raise
+    else:
+        await asyncio.to_thread(context.__exit__, None, None, None)
+
+
+def _finish_probe_download(response: Response, target: str | Path) -> tuple[int, str | None] | None:
+    """解析探测请求的响应，返回(文件大小, 校验值)
+
+    文件为空时直接创建目标文件，文件没有变化时不修改目标文件，都返回None
+    """
+    if response.status_code == httpx.codes.NOT_MODIFIED:
+        return None
+    content_range = response.headers.get("Content-Range", "")
+    if response.status_code == httpx.codes.REQUESTED_RANGE_NOT_SATISFIABLE and content_range == "bytes */0":
+        open(target, "wb").close()
+        return None
+    response.raise_for_status()
+    if response.status_code != httpx.codes.PARTIAL_CONTENT:
+        raise ValueError("server does not support range requests")
+    total_size = int(content_range.rsplit("/", 1)[1])
+    # 预先分配目标文件，各个分段按偏移量写入
+    with open(target, "wb") as target_writer:
+        target_writer.truncate(total_size)
+    return total_size, response.headers.get("ETag")
+
+
+def _check_verify(verify: bool, resume: bool, segments: int) -> None:
+    if verify and (resume or segments > 1):
+        raise ValueError("verify is not supported with resume or segmented download")
+
+
+def _parse_repr_digest(response: Response) -> str | None:
+    """从Repr-Digest头中取出十六进制的sha256，没有时返回None"""
+    for item in response.headers.get("Repr-Digest", "").split(","):
+        algorithm, _, value = item.strip().partition("=")
+        if algorithm == "sha-256" and len(value) > 2 and value.startswith(":") and value.endswith(":"):
+            return base64.b64decode(value[1:-1]).hex()
+    return None
+
+
+def _check_download_sha256(path: str, sha256: str, expected_sha256: str) -> None:
+    if sha256 != expected_sha256:
+        raise RuntimeError(f"sha256 mismatch for {path}: expected {expected_sha256}, got {sha256}")
+
+
+def _split_segments(total_size: int, segments: int) -> list[tuple[int, int]]:
+    segment_size = -(-total_size // segments)
+    return [(start, min(start + segment_size, total_size)) for start in range(0, total_size, segment_size)]
+
+
+def _segment_headers(start: int, end: int, etag: str | None) -> dict[str, str]:
+    headers = {"Range": f"bytes={start}-{end - 1}"}
+    if etag is not None:
+        headers["If-Range"] = etag
+    return headers
 
 
-def _finish_download_directory(response: Response, path: str, target_parent_directory: str | Path) -> Path:
+def _check_segment_response(response: Response) -> None:
+    response.raise_for_status()
+    # If-Range不匹配时服务器返回整个文件，说明下载过程中文件被修改
+    if response.status_code != httpx.codes.PARTIAL_CONTENT:
+        raise RuntimeError("file changed on server during segmented download")
+
+
+def _prepare_download_directory(
+    path: str, compress_method: CompressMethod, compress_level: int | None, compress_threads: int | None, adaptive: bool
+) -> QueryParamTypes:
+    params = {"path": path, "compress_method": compress_method}
+    if adaptive:
+        params["adaptive"] = adaptive
+    if compress_level is not None:
+        params["compress_level"] = compress_level
+    if compress_threads is not None:
+        params["compress_threads"] = compress_threads
+    return params
+
+
+def _finish_download_directory(
+    response: Response, path: str, target_parent_directory: str | Path, compress_method: CompressMethod
+) -> Path:
     target_parent_directory = Path(target_parent_directory)
+    if response.status_code == httpx.codes.NOT_MODIFIED:
+        return target_parent_directory / path.rstrip("/").rsplit("/", 1)[1]
+    response.raise_for_status()
     target_parent_directory.mkdir(parents=True, exist_ok=True)
-    tar_file_path = target_parent_directory / f"{path.lstrip('/').replace('/', '_')}.tar.xz"
+    tar_file_path = target_parent_directory / f"{path.lstrip('/').replace('/', '_')}.{compress_method}"
     try:
         with open(tar_file_path, "wb") as tar_file:
             for chunk in response.iter_bytes(1024 * 1024):
                 tar_file.write(chunk)
-        with tarfile.open(tar_file_path, "r:xz") as tar_file:
+        with open(tar_file_path, "rb") as compressed, _open_tar(compressed, compress_method, "r") as tar_file:
             tar_file.extractall(target_parent_directory)
         return target_parent_directory / path.rstrip("/").rsplit("/", 1)[1]
     finally:
@@ -86,10 +448,129 @@ def _prepare_delete(path: str, recursive: bool | None) -> QueryParamTypes:
     return params
 
 
+def _prepare_list_directory(
+    directory: str,
+    sort: ListSortKey | None,
+    reverse: bool,
+    name_pattern: str | None,
+    file_type: FileType | None,
+    limit: int | None,
+    cursor: str | None,
+    stream: bool,
+) -> QueryParamTypes:
+    params = {"directory": directory, "reverse": reverse, "stream": stream}
+    if sort is not None:
+        params["sort"] = sort
+    if name_pattern is not None:
+        params["name_pattern"] = name_pattern
+    if file_type is not None:
+        params["file_type"] = file_type
+    if limit is not None:
+        params["limit"] = limit
+    if cursor is not None:
+        params["cursor"] = cursor
+    return params
+
+
 def _finish_list_directory(response: Response) -> list[FileSystemInfo]:
     return [FileSystemInfo(**info) for info in response.json()]
 
 
+def _finish_list_directory_page(response: Response) -> tuple[list[FileSystemInfo], str | None]:
+    return _finish_list_directory(response), response.headers.get("X-Next-Cursor")
+
+
+def _parse_list_line(line: str) -> FileSystemInfo | None:
+    return FileSystemInfo(**json.loads(line)) if line.strip() else None
+
+
+def _prepare_walk_directory(
+    directory: str, max_depth: int | None, include: list[str] | None, exclude: list[str] | None, follow_symlinks: bool
+) -> QueryParamTypes:
+    params = {"directory": directory, "follow_symlinks": follow_symlinks}
+    if max_depth is not None:
+        params["max_depth"] = max_depth
+    if include:
+        params["include"] = include
+    if exclude:
+        params["exclude"] = exclude
+    return params
+
+
+def _parse_walk_line(line: str) -> FileTreeInfo | None:
+    return FileTreeInfo(**json.loads(line)) if line.strip() else None
+
+
+def _prepare_create_upload_session(
+    directory: str, filename: str, size: int, mkdir: bool | None, allow_overwrite: bool | None
+) -> QueryParamTypes:
+    params = {"directory": directory, "filename": filename, "size": size}
+    if mkdir is not None:
+        params["mkdir"] = mkdir
+    if allow_overwrite is not None:
+        params["allow_overwrite"] = allow_overwrite
+    return params
+
+
+def _finish_upload_session(response: Response) -> UploadSessionInfo:
+    info = response.json()
+    info["received"] = [(start, end) for start, end in info["received"]]
+    return UploadSessionInfo(**info)
+
+
+def _missing_chunks(session: UploadSessionInfo, chunk_size: int) -> list[tuple[int, int]]:
+    missing = []
+    position = 0
+    for start, end in [*session.received, (session.size, session.size)]:
+        while position < start:
+            length = min(chunk_size, start - position)
+            missing.append((position, length))
+            position += length
+        position = max(position, end)
+    return missing
+
+
+def _read_chunk(file: str | Path, offset: int, length: int) -> bytes:
+    with open(file, "rb") as reader:
+        reader.seek(offset)
+        return reader.read(length)
+
+
+def _prepare_delta_signature(path: str, block_size: int | None) -> QueryParamTypes:
+    params = {"path": path}
+    if block_size is not None:
+        params["block_size"] = block_size
+    return params
+
+
+def _finish_delta_signature(response: Response, path: str) -> tuple[BlockSignature, QueryParamTypes] | None:
+    """服务器上没有该文件时返回None"""
+    if response.status_code == httpx.codes.NOT_FOUND:
+        return None
+    response.raise_for_status()
+    block_size = int(response.headers[BLOCK_SIZE_HEADER])
+    signature = BlockSignature(response.content, block_size, int(response.headers[FILE_SIZE_HEADER]))
+    return signature, {"path": path, "base_etag": response.headers["ETag"], "block_size": block_size}
+
+
+def _is_missing_sync_root(error: httpx.HTTPStatusError, direction: SyncDirection) -> bool:
+    """同步到服务器时目标文件夹可以不存在"""
+    return direction == SyncDirection.upload and error.response.status_code == httpx.codes.NOT_FOUND
+
+
+def _plan_sync(
+    local: TreeState, remote: TreeState, direction: SyncDirection, delete: bool, checksum: bool
+) -> tuple[SyncPlan, list[str]]:
+    if direction == SyncDirection.upload:
+        return plan_sync(local, remote, delete, checksum)
+    return plan_sync(remote, local, delete, checksum)
+
+
+def _check_batch_results(results: list[BatchOperationResult]) -> None:
+    if failed := [result for result in results if not result.success]:
+        raise RuntimeError(f"sync delete fail: {', '.join(f'{result.path}: {result.error}' for result in failed)}")
+
+
 class AsyncClient:
     def __init__(self, base_url: str, **kwargs):
         self.inner = httpx.AsyncClient(base_url=base_url, **kwargs)
@@ -108,11 +589,46 @@ class AsyncClient:
         filename: str,
         mkdir: bool | None = None,
         allow_overwrite: bool | None = None,
+        expected_sha256: str | None = None,
     ) -> None:
-        files, params = _prepare_upload(directory, file, filename, mkdir, allow_overwrite)
+        """expected_sha256与上传内容的sha256不匹配时服务器拒绝上传"""
+        files, params = _prepare_upload(directory, file, filename, mkdir, allow_overwrite, expected_sha256)
         response = await self.inner.post("/upload-file", files=files, params=params)
         response.raise_for_status()
 
+    async def _upload_local_file(
+        self, directory: str, file: str | Path, filename: str, mkdir: bool | None, allow_overwrite: bool | None
+    ) -> None:
+        """上传本地路径的文件，读取文件在线程中执行"""
+        boundary = os.urandom(16).hex()
+        _, params = _prepare_upload(directory, None, filename, mkdir, allow_overwrite, None)
+        content = _aiter_file_upload(file, *_multipart_file_part("file", filename, boundary))
+        headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+        response = await self.inner.post("/upload-file", content=content, headers=headers, params=params)
+        response.raise_for_status()
+
+    async def upload_by_hash(
+        self, directory: str, filename: str, sha256: str, mkdir: bool | None = None, allow_overwrite: bool | None = None
+    ) -> bool:
+        """服务器开启去重且已有相同内容时直接创建文件，返回False时需要再调用upload上传内容"""
+        params = _prepare_upload_by_hash(directory, filename, sha256, mkdir, allow_overwrite)
+        response = await self.inner.post("/upload-by-hash", params=params)
+        response.raise_for_status()
+        return response.json()
+
+    async def upload_many(
+        self,
+        directory: str,
+        files: Iterable[tuple[str, FileTypes]],
+        mkdir: bool | None = None,
+        allow_overwrite: bool | None = None,
+    ) -> list[BatchOperationResult]:
+        """在一个请求中上传多个(文件名, 文件)，返回每个文件的结果，某个文件失败不影响其他文件"""
+        request_files, params = _prepare_upload_many(directory, files, mkdir, allow_overwrite)
+        response = await self.inner.post("/upload-files", files=request_files, params=params)
+        response.raise_for_status()
+        return _finish_batch(response)
+
     async def upload_directory(
         self,
         parent_dir: str,
@@ -120,23 +636,170 @@ class AsyncClient:
         compress_method: CompressMethod,
         mkdir: bool | None = None,
         zip_metadata_encoding: str | None = None,
+        adaptive: bool = False,
     ) -> None:
-        with _prepare_upload_directory(parent_dir, directory, compress_method, mkdir, zip_metadata_encoding) as (
-            files,
-            params,
-        ):
-            response = await self.inner.post("/upload-directory", files=files, params=params)
+        """compress_method为not_compressed时上传不压缩的tar包；adaptive为True时，已经压缩过的文件只存储不压缩"""
+        body, headers, params = _prepare_upload_directory(
+            parent_dir, directory, compress_method, mkdir, zip_metadata_encoding, adaptive
+        )
+        try:
+            response = await self.inner.post(
+                "/upload-directory", content=body.aiter_chunks(), headers=headers, params=params
+            )
             response.raise_for_status()
+        finally:
+            await body.aclose()
 
-    async def download_file(self, path: str, target: IOBase | str | Path) -> None:
-        response = await self.inner.post("/download-file", params={"path": path})
+    async def create_upload_session(
+        self, directory: str, filename: str, size: int, mkdir: bool | None = None, allow_overwrite: bool | None = None
+    ) -> UploadSessionInfo:
+        params = _prepare_create_upload_session(directory, filename, size, mkdir, allow_overwrite)
+        response = await self.inner.post("/upload-session/create", params=params)
         response.raise_for_status()
-        _finish_download(response, target)
+        return _finish_upload_session(response)
 
-    async def download_directory(self, path: str, target_parent_directory: str | Path) -> Path:
-        response = await self.inner.post("/download-directory", params={"path": path})
+    async def get_upload_session(self, session_id: str) -> UploadSessionInfo:
+        response = await self.inner.post("/upload-session/status", params={"session_id": session_id})
         response.raise_for_status()
-        return _finish_download_directory(response, path, target_parent_directory)
+        return _finish_upload_session(response)
+
+    async def upload_chunk(self, session_id: str, offset: int, data: bytes) -> None:
+        response = await self.inner.put(
+            "/upload-session/chunk", params={"session_id": session_id, "offset": offset}, content=data
+        )
+        response.raise_for_status()
+
+    async def commit_upload_session(self, session_id: str) -> None:
+        response = await self.inner.post("/upload-session/commit", params={"session_id": session_id})
+        response.raise_for_status()
+
+    async def abort_upload_session(self, session_id: str) -> None:
+        response = await self.inner.post("/upload-session/abort", params={"session_id": session_id})
+        response.raise_for_status()
+
+    async def upload_session_file(
+        self, session_id: str, file: str | Path, chunk_size: int = DEFAULT_CHUNK_SIZE, concurrency: int = 4
+    ) -> None:
+        """上传会话中还没有收到的部分，然后提交会话；中断后用同一个session_id再次调用即可续传"""
+        session = await self.get_upload_session(session_id)
+        if (file_size := await asyncio.to_thread(os.path.getsize, file)) != session.size:
+            raise ValueError(f"file size {file_size} does not match upload session size {session.size}")
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def upload_missing_chunk(offset: int, length: int) -> None:
+            async with semaphore:
+                data = await asyncio.to_thread(_read_chunk, file, offset, length)
+                await self.upload_chunk(session_id, offset, data)
+
+        await asyncio.gather(*(upload_missing_chunk(*chunk) for chunk in _missing_chunks(session, chunk_size)))
+        await self.commit_upload_session(session_id)
+
+    async def upload_delta(self, path: str, file: str | Path, block_size: int | None = None) -> bool:
+        """只上传file与服务器上path的不同部分，适合修改过的大文件；返回False表示服务器上没有该文件，已经上传了完整的文件"""
+        response = await self.inner.post("/delta/signature", params=_prepare_delta_signature(path, block_size))
+        if (prepared := _finish_delta_signature(response, path)) is None:
+            directory, filename = posixpath.split(path)
+            await self._upload_local_file(directory, file, filename, None, True)
+            return False
+        signature, params = prepared
+        response = await self.inner.post("/delta/upload", params=params, content=aiter_delta(file, signature))
+        response.raise_for_status()
+        return True
+
+    async def download_file(
+        self,
+        path: str,
+        target: IOBase | str | Path,
+        resume: bool = False,
+        segments: int = 1,
+        segment_retries: int = 3,
+        if_none_match: str | None = None,
+        verify: bool = False,
+    ) -> str | None:
+        """返回服务器上文件的ETag；if_none_match与之匹配时服务器返回304，不修改target
+
+        resume为True时下载过程中在target旁的.etag文件中记录ETag，再次调用时用If-Range续传，服务器上的文件变化后从头下载；
+        verify为True时边下载边计算sha256，与服务器记录的sha256比较，不匹配时抛出RuntimeError
+        """
+        _check_verify(verify, resume, segments)
+        if segments > 1:
+            return await self._download_file_segmented(path, target, segments, segment_retries, if_none_match)
+        headers = await asyncio.to_thread(_prepare_download, target, resume, if_none_match)
+        digest = hashlib.sha256() if verify else None
+        async with self.inner.stream("POST", "/download-file", params={"path": path}, headers=headers) as response:
+            async with _aopen_download_target(response, target, resume) as target_writer:
+                if target_writer is not None:
+                    async for chunk in response.aiter_bytes(1024 * 1024):
+                        await asyncio.to_thread(target_writer.write, chunk)
+                        if digest is not None:
+                            digest.update(chunk)
+            if digest is not None and target_writer is not None:
+                expected_sha256 = _parse_repr_digest(response) or (await self.checksum(path)).sha256
+                _check_download_sha256(path, digest.hexdigest(), expected_sha256)
+            return response.headers.get("ETag")
+
+    async def _download_file_segmented(
+        self, path: str, target: str | Path, segments: int, retries: int, if_none_match: str | None
+    ) -> str | None:
+        if not isinstance(target, str | Path):
+            raise ValueError("segmented download requires target to be a path")
+        headers = {"Range": "bytes=0-0"}
+        if if_none_match is not None:
+            headers["If-None-Match"] = if_none_match
+        probe = await self.inner.post("/download-file", params={"path": path}, headers=headers)
+        if (probe_result := await asyncio.to_thread(_finish_probe_download, probe, target)) is None:
+            return probe.headers.get("ETag")
+        total_size, etag = probe_result
+
+        async def download_segment(start: int, end: int) -> None:
+            for attempt in range(retries + 1):
+                if start >= end:
+                    return
+                try:
+                    async with self.inner.stream(
+                        "POST", "/download-file", params={"path": path}, headers=_segment_headers(start, end, etag)
+                    ) as response:
+                        _check_segment_response(response)
+                        # 文件操作在线程中执行，不阻塞事件循环
+                        target_writer = await asyncio.to_thread(open, target, "r+b")
+                        try:
+                            await asyncio.to_thread(target_writer.seek, start)
+                            async for chunk in response.aiter_bytes(1024 * 1024):
+                                await asyncio.to_thread(target_writer.write, chunk)
+                                start += len(chunk)
+                        finally:
+                            await asyncio.to_thread(target_writer.close)
+                    return
+                except httpx.TransportError:
+                    # 从已经写入的位置继续下载本分段
+                    if attempt == retries:
+                        raise
+
+        tasks = [
+            asyncio.create_task(download_segment(start, end)) for start, end in _split_segments(total_size, segments)
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        return etag
+
+    async def download_directory(
+        self,
+        path: str,
+        target_parent_directory: str | Path,
+        compress_method: CompressMethod = CompressMethod.txz,
+        compress_level: int | None = None,
+        compress_threads: int | None = None,
+        adaptive: bool = False,
+        if_none_match: str | None = None,
+    ) -> Path:
+        """if_none_match与服务器上文件夹的ETag匹配时不下载，直接返回本地文件夹的路径"""
+        params = _prepare_download_directory(path, compress_method, compress_level, compress_threads, adaptive)
+        headers = {"If-None-Match": if_none_match} if if_none_match is not None else None
+        response = await self.inner.post("/download-directory", params=params, headers=headers)
+        return _finish_download_directory(response, path, target_parent_directory, compress_method)
 
     async def delete(self, path: str, recursive: bool | None = None) -> bool:
         params = _prepare_delete(path, recursive)
@@ -144,15 +807,147 @@ class AsyncClient:
         response.raise_for_status()
         return bool(response.text)
 
-    async def list_directory(self, directory: str) -> list[FileSystemInfo]:
-        response = await self.inner.post("/list-directory", params={"directory": directory})
+    async def delete_many(self, paths: Iterable[str], recursive: bool = False) -> list[BatchOperationResult]:
+        response = await self.inner.post("/batch-operations", json=_prepare_delete_many(paths, recursive))
+        response.raise_for_status()
+        return _finish_batch(response)
+
+    async def rename_many(self, renames: Iterable[tuple[str, str]]) -> list[BatchOperationResult]:
+        """批量重命名(路径, 新文件名)"""
+        response = await self.inner.post("/batch-operations", json=_prepare_rename_many(renames))
         response.raise_for_status()
-        return _finish_list_directory(response)
+        return _finish_batch(response)
+
+    async def list_directory(
+        self,
+        directory: str,
+        sort: ListSortKey | None = None,
+        reverse: bool = False,
+        name_pattern: str | None = None,
+        file_type: FileType | None = None,
+    ) -> list[FileSystemInfo]:
+        return [info async for info in self.iter_directory(directory, sort, reverse, name_pattern, file_type)]
+
+    async def iter_directory(
+        self,
+        directory: str,
+        sort: ListSortKey | None = None,
+        reverse: bool = False,
+        name_pattern: str | None = None,
+        file_type: FileType | None = None,
+    ) -> AsyncIterator[FileSystemInfo]:
+        """以NDJSON流式获取文件列表，边接收边产出"""
+        params = _prepare_list_directory(directory, sort, reverse, name_pattern, file_type, None, None, True)
+        async with self.inner.stream("POST", "/list-directory", params=params) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if (info := _parse_list_line(line)) is not None:
+                    yield info
+
+    async def list_directory_page(
+        self,
+        directory: str,
+        limit: int,
+        cursor: str | None = None,
+        sort: ListSortKey | None = None,
+        reverse: bool = False,
+        name_pattern: str | None = None,
+        file_type: FileType | None = None,
+    ) -> tuple[list[FileSystemInfo], str | None]:
+        """分页获取文件列表，返回这一页和下一页的游标，没有下一页时游标为None"""
+        params = _prepare_list_directory(directory, sort, reverse, name_pattern, file_type, limit, cursor, False)
+        response = await self.inner.post("/list-directory", params=params)
+        response.raise_for_status()
+        return _finish_list_directory_page(response)
+
+    async def walk_directory(
+        self,
+        directory: str,
+        max_depth: int | None = None,
+        include: list[str] | None = None,
+        exclude: list[str] | None = None,
+        follow_symlinks: bool = False,
+    ) -> AsyncIterator[FileTreeInfo]:
+        """由服务器递归遍历文件树，边接收边产出，一次请求获取整棵树"""
+        params = _prepare_walk_directory(directory, max_depth, include, exclude, follow_symlinks)
+        async with self.inner.stream("POST", "/walk-directory", params=params) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if (info := _parse_walk_line(line)) is not None:
+                    yield info
+
+    async def checksum(self, path: str) -> FileChecksum:
+        response = await self.inner.post("/checksum", params={"path": path})
+        response.raise_for_status()
+        return FileChecksum(**response.json())
+
+    async def temp_space_usage(self) -> TempSpaceUsage:
+        response = await self.inner.post("/temp-space")
+        response.raise_for_status()
+        return TempSpaceUsage(**response.json())
 
     async def rename(self, path: str, new_name: str) -> None:
         response = await self.inner.post("/rename", params={"path": path, "new_name": new_name})
         response.raise_for_status()
 
+    async def sync(
+        self,
+        local_dir: str | Path,
+        remote_dir: str,
+        direction: SyncDirection,
+        delete: bool = False,
+        checksum: bool = False,
+        concurrency: int = 4,
+        dry_run: bool = False,
+    ) -> SyncPlan:
+        """比较本地文件夹和服务器上的文件夹，只传输新增或变化的文件，返回同步计划
+
+        默认按大小和修改时间比较，大小相同但源文件更新时再比较sha256，checksum为True时大小相同的文件都比较sha256；
+        delete为True时删除目标中多余的项和与源类型不同的项，否则类型不同的项记录在plan.conflicts中，不做处理；
+        只同步文件，不会创建空文件夹；dry_run为True时只计算计划，不做修改
+        """
+        local_dir = Path(local_dir)
+        local = await asyncio.to_thread(scan_local, local_dir)
+        try:
+            remote = remote_tree([info async for info in self.walk_directory(remote_dir)])
+        except httpx.HTTPStatusError as e:
+            if not _is_missing_sync_root(e, direction):
+                raise
+            remote = TreeState({}, set())
+        plan, same_size = _plan_sync(local, remote, direction, delete, checksum)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def differs(path: str) -> bool:
+            async with semaphore:
+                remote_checksum = await self.checksum(remote_path(remote_dir, path))
+                return remote_checksum.sha256 != await asyncio.to_thread(file_sha256, local_dir / path)
+
+        changed = await asyncio.gather(*(differs(path) for path in same_size))
+        plan.transfer = sorted([*plan.transfer, *(path for path, differ in zip(same_size, changed) if differ)])
+        if dry_run:
+            return plan
+        if direction == SyncDirection.download:
+            unchanged = [path for path, differ in zip(same_size, changed) if not differ]
+            await asyncio.to_thread(update_local_mtimes, local_dir, unchanged, remote)
+
+        async def transfer(path: str) -> None:
+            async with semaphore:
+                if direction == SyncDirection.upload:
+                    directory, filename = posixpath.split(remote_path(remote_dir, path))
+                    await self._upload_local_file(directory, local_dir / path, filename, True, True)
+                else:
+                    local_path = await asyncio.to_thread(prepare_local_target, local_dir, path)
+                    await self.download_file(remote_path(remote_dir, path), local_path)
+                    await asyncio.to_thread(set_local_mtime, local_path, remote.files[path])
+
+        if direction == SyncDirection.upload and plan.delete:
+            paths = [remote_path(remote_dir, path) for path in plan.delete]
+            _check_batch_results(await self.delete_many(paths, recursive=True))
+        elif plan.delete:
+            await asyncio.to_thread(delete_local, local_dir, plan.delete)
+        await asyncio.gather(*(transfer(path) for path in plan.transfer))
+        return plan
+
 
 class Client:
     def __init__(self, base_url: str, **kwargs):
@@ -172,11 +967,35 @@ class Client:
         filename: str,
         mkdir: bool | None = None,
         allow_overwrite: bool | None = None,
+        expected_sha256: str | None = None,
     ) -> None:
-        files, params = _prepare_upload(directory, file, filename, mkdir, allow_overwrite)
+        """expected_sha256与上传内容的sha256不匹配时服务器拒绝上传"""
+        files, params = _prepare_upload(directory, file, filename, mkdir, allow_overwrite, expected_sha256)
         response = self.inner.post("/upload-file", files=files, params=params)
         response.raise_for_status()
 
+    def upload_by_hash(
+        self, directory: str, filename: str, sha256: str, mkdir: bool | None = None, allow_overwrite: bool | None = None
+    ) -> bool:
+        """服务器开启去重且已有相同内容时直接创建文件，返回False时需要再调用upload上传内容"""
+        params = _prepare_upload_by_hash(directory, filename, sha256, mkdir, allow_overwrite)
+        response = self.inner.post("/upload-by-hash", params=params)
+        response.raise_for_status()
+        return response.json()
+
+    def upload_many(
+        self,
+        directory: str,
+        files: Iterable[tuple[str, FileTypes]],
+        mkdir: bool | None = None,
+        allow_overwrite: bool | None = None,
+    ) -> list[BatchOperationResult]:
+        """在一个请求中上传多个(文件名, 文件)，返回每个文件的结果，某个文件失败不影响其他文件"""
+        request_files, params = _prepare_upload_many(directory, files, mkdir, allow_overwrite)
+        response = self.inner.post("/upload-files", files=request_files, params=params)
+        response.raise_for_status()
+        return _finish_batch(response)
+
     def upload_directory(
         self,
         parent_dir: str,
@@ -184,23 +1003,161 @@ class Client:
         compress_method: CompressMethod,
         mkdir: bool | None = None,
         zip_metadata_encoding: str | None = None,
+        adaptive: bool = False,
     ) -> None:
-        with _prepare_upload_directory(parent_dir, directory, compress_method, mkdir, zip_metadata_encoding) as (
-            files,
-            params,
-        ):
-            response = self.inner.post("/upload-directory", files=files, params=params)
+        """compress_method为not_compressed时上传不压缩的tar包；adaptive为True时，已经压缩过的文件只存储不压缩"""
+        body, headers, params = _prepare_upload_directory(
+            parent_dir, directory, compress_method, mkdir, zip_metadata_encoding, adaptive
+        )
+        try:
+            response = self.inner.post("/upload-directory", content=body.iter_chunks(), headers=headers, params=params)
             response.raise_for_status()
+        finally:
+            body.close()
+
+    def create_upload_session(
+        self, directory: str, filename: str, size: int, mkdir: bool | None = None, allow_overwrite: bool | None = None
+    ) -> UploadSessionInfo:
+        params = _prepare_create_upload_session(directory, filename, size, mkdir, allow_overwrite)
+        response = self.inner.post("/upload-session/create", params=params)
+        response.raise_for_status()
+        return _finish_upload_session(response)
 
-    def download_file(self, path: str, target: IOBase | str | Path) -> None:
-        response = self.inner.post("/download-file", params={"path": path})
+    def get_upload_session(self, session_id: str) -> UploadSessionInfo:
+        response = self.inner.post("/upload-session/status", params={"session_id": session_id})
         response.raise_for_status()
-        _finish_download(response, target)
+        return _finish_upload_session(response)
 
-    def download_directory(self, path: str, target_parent_directory: str | Path) -> Path:
-        response = self.inner.post("/download-directory", params={"path": path})
+    def upload_chunk(self, session_id: str, offset: int, data: bytes) -> None:
+        response = self.inner.put(
+            "/upload-session/chunk", params={"session_id": session_id, "offset": offset}, content=data
+        )
         response.raise_for_status()
-        return _finish_download_directory(response, path, target_parent_directory)
+
+    def commit_upload_session(self, session_id: str) -> None:
+        response = self.inner.post("/upload-session/commit", params={"session_id": session_id})
+        response.raise_for_status()
+
+    def abort_upload_session(self, session_id: str) -> None:
+        response = self.inner.post("/upload-session/abort", params={"session_id": session_id})
+        response.raise_for_status()
+
+    def upload_session_file(
+        self, session_id: str, file: str | Path, chunk_size: int = DEFAULT_CHUNK_SIZE, concurrency: int = 4
+    ) -> None:
+        """上传会话中还没有收到的部分，然后提交会话；中断后用同一个session_id再次调用即可续传"""
+        session = self.get_upload_session(session_id)
+        if os.path.getsize(file) != session.size:
+            raise ValueError(f"file size {os.path.getsize(file)} does not match upload session size {session.size}")
+
+        def upload_missing_chunk(offset: int, length: int) -> None:
+            self.upload_chunk(session_id, offset, _read_chunk(file, offset, length))
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(upload_missing_chunk, *chunk) for chunk in _missing_chunks(session, chunk_size)]
+            for future in futures:
+                future.result()
+        self.commit_upload_session(session_id)
+
+    def upload_delta(self, path: str, file: str | Path, block_size: int | None = None) -> bool:
+        """只上传file与服务器上path的不同部分，适合修改过的大文件；返回False表示服务器上没有该文件，已经上传了完整的文件"""
+        response = self.inner.post("/delta/signature", params=_prepare_delta_signature(path, block_size))
+        if (prepared := _finish_delta_signature(response, path)) is None:
+            directory, filename = posixpath.split(path)
+            with open(file, "rb") as reader:
+                self.upload(directory, reader, filename, allow_overwrite=True)
+            return False
+        signature, params = prepared
+        response = self.inner.post("/delta/upload", params=params, content=iter_delta(file, signature))
+        response.raise_for_status()
+        return True
+
+    def download_file(
+        self,
+        path: str,
+        target: IOBase | str | Path,
+        resume: bool = False,
+        segments: int = 1,
+        segment_retries: int = 3,
+        if_none_match: str | None = None,
+        verify: bool = False,
+    ) -> str | None:
+        """返回服务器上文件的ETag；if_none_match与之匹配时服务器返回304，不修改target
+
+        resume为True时下载过程中在target旁的.etag文件中记录ETag，再次调用时用If-Range续传，服务器上的文件变化后从头下载；
+        verify为True时边下载边计算sha256，与服务器记录的sha256比较，不匹配时抛出RuntimeError
+        """
+        _check_verify(verify, resume, segments)
+        if segments > 1:
+            return self._download_file_segmented(path, target, segments, segment_retries, if_none_match)
+        headers = _prepare_download(target, resume, if_none_match)
+        digest = hashlib.sha256() if verify else None
+        with self.inner.stream("POST", "/download-file", params={"path": path}, headers=headers) as response:
+            with _open_download_target(response, target, resume) as target_writer:
+                if target_writer is not None:
+                    for chunk in response.iter_bytes(1024 * 1024):
+                        target_writer.write(chunk)
+                        if digest is not None:
+                            digest.update(chunk)
+            if digest is not None and target_writer is not None:
+                expected_sha256 = _parse_repr_digest(response) or (self.checksum(path)).sha256
+                _check_download_sha256(path, digest.hexdigest(), expected_sha256)
+            return response.headers.get("ETag")
+
+    def _download_file_segmented(
+        self, path: str, target: str | Path, segments: int, retries: int, if_none_match: str | None
+    ) -> str | None:
+        if not isinstance(target, str | Path):
+            raise ValueError("segmented download requires target to be a path")
+        headers = {"Range": "bytes=0-0"}
+        if if_none_match is not None:
+            headers["If-None-Match"] = if_none_match
+        probe = self.inner.post("/download-file", params={"path": path}, headers=headers)
+        if (probe_result := _finish_probe_download(probe, target)) is None:
+            return probe.headers.get("ETag")
+        total_size, etag = probe_result
+
+        def download_segment(start: int, end: int) -> None:
+            for attempt in range(retries + 1):
+                if start >= end:
+                    return
+                try:
+                    with self.inner.stream(
+                        "POST", "/download-file", params={"path": path}, headers=_segment_headers(start, end, etag)
+                    ) as response:
+                        _check_segment_response(response)
+                        with open(target, "r+b") as target_writer:
+                            target_writer.seek(start)
+                            for chunk in response.iter_bytes(1024 * 1024):
+                                target_writer.write(chunk)
+                                start += len(chunk)
+                    return
+                except httpx.TransportError:
+                    # 从已经写入的位置继续下载本分段
+                    if attempt == retries:
+                        raise
+
+        with ThreadPoolExecutor(max_workers=segments) as executor:
+            futures = [executor.submit(download_segment, *segment) for segment in _split_segments(total_size, segments)]
+            for future in futures:
+                future.result()
+        return etag
+
+    def download_directory(
+        self,
+        path: str,
+        target_parent_directory: str | Path,
+        compress_method: CompressMethod = CompressMethod.txz,
+        compress_level: int | None = None,
+        compress_threads: int | None = None,
+        adaptive: bool = False,
+        if_none_match: str | None = None,
+    ) -> Path:
+        """if_none_match与服务器上文件夹的ETag匹配时不下载，直接返回本地文件夹的路径"""
+        params = _prepare_download_directory(path, compress_method, compress_level, compress_threads, adaptive)
+        headers = {"If-None-Match": if_none_match} if if_none_match is not None else None
+        response = self.inner.post("/download-directory", params=params, headers=headers)
+        return _finish_download_directory(response, path, target_parent_directory, compress_method)
 
     def delete(self, path: str, recursive: bool | None = None) -> bool:
         params = _prepare_delete(path, recursive)
@@ -208,11 +1165,141 @@ class Client:
         response.raise_for_status()
         return bool(response.text)
 
-    def list_directory(self, directory: str) -> list[FileSystemInfo]:
-        response = self.inner.post("/list-directory", params={"directory": directory})
+    def delete_many(self, paths: Iterable[str], recursive: bool = False) -> list[BatchOperationResult]:
+        response = self.inner.post("/batch-operations", json=_prepare_delete_many(paths, recursive))
+        response.raise_for_status()
+        return _finish_batch(response)
+
+    def rename_many(self, renames: Iterable[tuple[str, str]]) -> list[BatchOperationResult]:
+        """批量重命名(路径, 新文件名)"""
+        response = self.inner.post("/batch-operations", json=_prepare_rename_many(renames))
+        response.raise_for_status()
+        return _finish_batch(response)
+
+    def list_directory(
+        self,
+        directory: str,
+        sort: ListSortKey | None = None,
+        reverse: bool = False,
+        name_pattern: str | None = None,
+        file_type: FileType | None = None,
+    ) -> list[FileSystemInfo]:
+        return list(self.iter_directory(directory, sort, reverse, name_pattern, file_type))
+
+    def iter_directory(
+        self,
+        directory: str,
+        sort: ListSortKey | None = None,
+        reverse: bool = False,
+        name_pattern: str | None = None,
+        file_type: FileType | None = None,
+    ) -> Iterator[FileSystemInfo]:
+        """以NDJSON流式获取文件列表，边接收边产出"""
+        params = _prepare_list_directory(directory, sort, reverse, name_pattern, file_type, None, None, True)
+        with self.inner.stream("POST", "/list-directory", params=params) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if (info := _parse_list_line(line)) is not None:
+                    yield info
+
+    def list_directory_page(
+        self,
+        directory: str,
+        limit: int,
+        cursor: str | None = None,
+        sort: ListSortKey | None = None,
+        reverse: bool = False,
+        name_pattern: str | None = None,
+        file_type: FileType | None = None,
+    ) -> tuple[list[FileSystemInfo], str | None]:
+        """分页获取文件列表，返回这一页和下一页的游标，没有下一页时游标为None"""
+        params = _prepare_list_directory(directory, sort, reverse, name_pattern, file_type, limit, cursor, False)
+        response = self.inner.post("/list-directory", params=params)
+        response.raise_for_status()
+        return _finish_list_directory_page(response)
+
+    def walk_directory(
+        self,
+        directory: str,
+        max_depth: int | None = None,
+        include: list[str] | None = None,
+        exclude: list[str] | None = None,
+        follow_symlinks: bool = False,
+    ) -> Iterator[FileTreeInfo]:
+        """由服务器递归遍历文件树，边接收边产出，一次请求获取整棵树"""
+        params = _prepare_walk_directory(directory, max_depth, include, exclude, follow_symlinks)
+        with self.inner.stream("POST", "/walk-directory", params=params) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if (info := _parse_walk_line(line)) is not None:
+                    yield info
+
+    def checksum(self, path: str) -> FileChecksum:
+        response = self.inner.post("/checksum", params={"path": path})
+        response.raise_for_status()
+        return FileChecksum(**response.json())
+
+    def temp_space_usage(self) -> TempSpaceUsage:
+        response = self.inner.post("/temp-space")
         response.raise_for_status()
-        return _finish_list_directory(response)
+        return TempSpaceUsage(**response.json())
 
     def rename(self, path: str, new_name: str) -> None:
         response = self.inner.post("/rename", params={"path": path, "new_name": new_name})
         response.raise_for_status()
+
+    def sync(
+        self,
+        local_dir: str | Path,
+        remote_dir: str,
+        direction: SyncDirection,
+        delete: bool = False,
+        checksum: bool = False,
+        concurrency: int = 4,
+        dry_run: bool = False,
+    ) -> SyncPlan:
+        """比较本地文件夹和服务器上的文件夹，只传输新增或变化的文件，返回同步计划
+
+        默认按大小和修改时间比较，大小相同但源文件更新时再比较sha256，checksum为True时大小相同的文件都比较sha256；
+        delete为True时删除目标中多余的项和与源类型不同的项，否则类型不同的项记录在plan.conflicts中，不做处理；
+        只同步文件，不会创建空文件夹；dry_run为True时只计算计划，不做修改
+        """
+        local_dir = Path(local_dir)
+        local = scan_local(local_dir)
+        try:
+            remote = remote_tree(self.walk_directory(remote_dir))
+        except httpx.HTTPStatusError as e:
+            if not _is_missing_sync_root(e, direction):
+                raise
+            remote = TreeState({}, set())
+        plan, same_size = _plan_sync(local, remote, direction, delete, checksum)
+
+        def differs(path: str) -> bool:
+            return self.checksum(remote_path(remote_dir, path)).sha256 != file_sha256(local_dir / path)
+
+        def transfer(path: str) -> None:
+            if direction == SyncDirection.upload:
+                directory, filename = posixpath.split(remote_path(remote_dir, path))
+                with open(local_dir / path, "rb") as reader:
+                    self.upload(directory, reader, filename, mkdir=True, allow_overwrite=True)
+            else:
+                local_path = prepare_local_target(local_dir, path)
+                self.download_file(remote_path(remote_dir, path), local_path)
+                set_local_mtime(local_path, remote.files[path])
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            changed = list(executor.map(differs, same_size))
+            plan.transfer = sorted([*plan.transfer, *(path for path, differ in zip(same_size, changed) if differ)])
+            if dry_run:
+                return plan
+            if direction == SyncDirection.download:
+                update_local_mtimes(local_dir, [path for path, differ in zip(same_size, changed) if not differ], remote)
+            if direction == SyncDirection.upload and plan.delete:
+                paths = [remote_path(remote_dir, path) for path in plan.delete]
+                _check_batch_results(self.delete_many(paths, recursive=True))
+            elif plan.delete:
+                delete_local(local_dir, plan.delete)
+            futures = [executor.submit(transfer, path) for path in plan.transfer]
+            for future in futures:
+                future.result()
+        return plan
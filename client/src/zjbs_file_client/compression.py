@@ -0,0 +1,174 @@
+import gzip
+import lzma
+import os
+import struct
+import tarfile
+import zlib
+from contextlib import ExitStack, contextmanager, nullcontext
+from pathlib import Path
+from typing import BinaryIO, ContextManager, Iterator
+
+from .model import CompressMethod
+
+# 扩展名表明内容已经压缩过的文件
+INCOMPRESSIBLE_SUFFIXES = frozenset(
+    {
+        ".gz", ".tgz", ".bz2", ".xz", ".txz", ".zst", ".lz4", ".zip", ".7z", ".rar",
+        ".jpg", ".jpeg", ".png", ".gif", ".webp", ".jp2",
+        ".mp3", ".m4a", ".ogg", ".flac", ".mp4", ".m4v", ".mkv", ".mov", ".avi", ".webm",
+        ".npz",
+    }
+)  # fmt: skip
+# 小于此大小的文件总是压缩
+ADAPTIVE_MIN_SIZE = 64 * 1024
+# 从文件中间采样试压缩的字节数
+ADAPTIVE_SAMPLE_SIZE = 64 * 1024
+# 试压缩后大小超过原大小的这个比例，认为不可压缩
+ADAPTIVE_RATIO_THRESHOLD = 0.9
+
+
+def is_incompressible(path: str | Path, size: int) -> bool:
+    if os.path.splitext(path)[1].lower() in INCOMPRESSIBLE_SUFFIXES:
+        return True
+    if size < ADAPTIVE_MIN_SIZE:
+        return False
+    try:
+        with open(path, "rb") as file:
+            file.seek(max(0, size // 2 - ADAPTIVE_SAMPLE_SIZE // 2))
+            sample = file.read(ADAPTIVE_SAMPLE_SIZE)
+    except OSError:
+        return False
+    return len(zlib.compress(sample, 1)) > len(sample) * ADAPTIVE_RATIO_THRESHOLD
+
+
+def _encode_varint(value: int) -> bytes:
+    result = bytearray()
+    while value >= 0x80:
+        result.append(value & 0x7F | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+
+class StoredXzWriter:
+    """写出不做压缩的xz流（LZMA2未压缩块），xz没有存储级别，lzma在不可压缩的数据上很慢"""
+
+    CHUNK_SIZE = 64 * 1024
+    STREAM_FLAGS = b"\x00\x01"
+
+    def __init__(self, fileobj: BinaryIO):
+        self.fileobj = fileobj
+        self.uncompressed_size = 0
+        self.compressed_size = 0
+        self.crc = 0
+        self.buffer = bytearray()
+        self.fileobj.write(b"\xfd7zXZ\x00" + self.STREAM_FLAGS + struct.pack("<I", zlib.crc32(self.STREAM_FLAGS)))
+        block_header = b"\x02\x00\x21\x01\x00\x00\x00\x00"
+        self.block_header = block_header + struct.pack("<I", zlib.crc32(block_header))
+        self.fileobj.write(self.block_header)
+
+    def write(self, data: bytes) -> int:
+        self.uncompressed_size += len(data)
+        self.crc = zlib.crc32(data, self.crc)
+        self.buffer += data
+        while len(self.buffer) >= self.CHUNK_SIZE:
+            self._write_chunk(bytes(self.buffer[: self.CHUNK_SIZE]))
+            del self.buffer[: self.CHUNK_SIZE]
+        return len(data)
+
+    def _write_chunk(self, chunk: bytes) -> None:
+        control = b"\x01" if self.compressed_size == 0 else b"\x02"
+        self.fileobj.write(control + struct.pack(">H", len(chunk) - 1))
+        self.fileobj.write(chunk)
+        self.compressed_size += 3 + len(chunk)
+
+    def close(self) -> None:
+        if self.buffer:
+            self._write_chunk(bytes(self.buffer))
+            self.buffer.clear()
+        self.fileobj.write(b"\x00")
+        self.compressed_size += 1
+        self.fileobj.write(b"\x00" * (-self.compressed_size % 4))
+        self.fileobj.write(struct.pack("<I", self.crc))
+        unpadded_size = len(self.block_header) + self.compressed_size + 4
+        index = b"\x00" + _encode_varint(1) + _encode_varint(unpadded_size) + _encode_varint(self.uncompressed_size)
+        index += b"\x00" * (-len(index) % 4)
+        index += struct.pack("<I", zlib.crc32(index))
+        self.fileobj.write(index)
+        footer = struct.pack("<I", len(index) // 4 - 1) + self.STREAM_FLAGS
+        self.fileobj.write(struct.pack("<I", zlib.crc32(footer)) + footer + b"YZ")
+
+
+@contextmanager
+def _open_stored_xz(fileobj: BinaryIO) -> Iterator[BinaryIO]:
+    writer = StoredXzWriter(fileobj)
+    yield writer
+    writer.close()
+
+
+def _open_compress_stream(fileobj: BinaryIO, compress_method: CompressMethod, store: bool) -> ContextManager[BinaryIO]:
+    """store为True时只存储不压缩；多个gzip成员、xz流、zstd帧首尾相接仍然是合法的文件"""
+    match compress_method:
+        case CompressMethod.not_compressed:
+            return nullcontext(fileobj)
+        case CompressMethod.tgz | CompressMethod.ptgz:
+            return gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=0 if store else 9)
+        case CompressMethod.txz:
+            return _open_stored_xz(fileobj) if store else lzma.LZMAFile(fileobj, mode="wb")
+        case CompressMethod.tzst:
+            try:
+                import zstandard
+            except ImportError:
+                raise ImportError("compress method tzst requires zstandard, install zjbs-file-client[zstd]")
+            return zstandard.ZstdCompressor(level=1 if store else 3, threads=-1).stream_writer(fileobj, closefd=False)
+        case _:
+            raise ValueError(f"unsupported compress_method: {compress_method}")
+
+
+class _AdaptiveWriter:
+    """写入每个tar成员之前按是否可压缩切换压缩流"""
+
+    def __init__(self, fileobj: BinaryIO, compress_method: CompressMethod):
+        self.fileobj = fileobj
+        self.compress_method = compress_method
+        self.store = False
+        self.exit_stack: ExitStack | None = None
+        self.writer: BinaryIO | None = None
+
+    def set_store(self, store: bool) -> None:
+        if store != self.store:
+            self.close()
+            self.store = store
+
+    def write(self, data: bytes) -> int:
+        if self.writer is None:
+            self.exit_stack = ExitStack()
+            stream = _open_compress_stream(self.fileobj, self.compress_method, self.store)
+            self.writer = self.exit_stack.enter_context(stream)
+        return self.writer.write(data)
+
+    def close(self) -> None:
+        if self.exit_stack is not None:
+            self.exit_stack.close()
+            self.exit_stack = None
+            self.writer = None
+
+
+def write_tar(fileobj: BinaryIO, directory: Path, compress_method: CompressMethod, adaptive: bool) -> None:
+    """把文件夹打包压缩写入fileobj；adaptive为True时，已经压缩过的文件只存储不压缩"""
+    if not adaptive:
+        with _open_compress_stream(fileobj, compress_method, False) as writer:
+            with tarfile.open(fileobj=writer, mode="w|") as tar_file:
+                tar_file.add(directory, arcname=directory.name)
+        return
+
+    writer = _AdaptiveWriter(fileobj, compress_method)
+
+    def switch_compression(tar_info: tarfile.TarInfo) -> tarfile.TarInfo:
+        if tar_info.isreg():
+            writer.set_store(is_incompressible(directory.parent / tar_info.name, tar_info.size))
+        return tar_info
+
+    with tarfile.open(fileobj=writer, mode="w|") as tar_file:
+        tar_file.add(directory, arcname=directory.name, filter=switch_compression)
+    writer.close()
@@ -0,0 +1,179 @@
+import asyncio
+import hashlib
+import mmap
+import struct
+import zlib
+from pathlib import Path
+from typing import AsyncIterator, Iterator
+
+# 与服务器的签名格式一致：每块的adler32、16字节blake2b
+SIGNATURE_STRUCT = struct.Struct("<I16s")
+STRONG_DIGEST_SIZE = 16
+BLOCK_SIZE_HEADER = "X-Block-Size"
+FILE_SIZE_HEADER = "X-File-Size"
+# 每条新数据指令的最大长度
+MAX_LITERAL_SIZE = 4 * 1024 * 1024
+# 攒够这么多字节再交给httpx发送
+DELTA_CHUNK_SIZE = 1024 * 1024
+# 连续这么多块没有匹配时不再逐字节查找，跳过一段再找，跳过的长度逐次加倍
+ROLL_WINDOW_BLOCKS = 16
+MAX_SKIP_SIZE = 64 * 1024 * 1024
+
+_ADLER_MOD = 65521
+
+
+class BlockSignature:
+    """服务器上旧文件的分块签名，最后一块不满一块时单独保存，只在新文件末尾匹配"""
+
+    def __init__(self, data: bytes, block_size: int, file_size: int):
+        self.block_size = block_size
+        self.blocks: dict[int, list[tuple[bytes, int]]] = {}
+        self.tail: tuple[int, bytes, int] | None = None
+        self.tail_size = file_size % block_size
+        count = len(data) // SIGNATURE_STRUCT.size
+        for index, (weak, strong) in enumerate(SIGNATURE_STRUCT.iter_unpack(data)):
+            if index == count - 1 and self.tail_size:
+                self.tail = (weak, strong, index)
+            else:
+                self.blocks.setdefault(weak, []).append((strong, index))
+
+    def find(self, weak: int, block: bytes | memoryview) -> int | None:
+        candidates = self.blocks.get(weak)
+        if not candidates:
+            return None
+        strong = hashlib.blake2b(block, digest_size=STRONG_DIGEST_SIZE).digest()
+        for candidate, index in candidates:
+            if candidate == strong:
+                return index
+        return None
+
+    def find_tail(self, block: bytes | memoryview) -> int | None:
+        if self.tail is None or len(block) != self.tail_size:
+            return None
+        weak, strong, index = self.tail
+        if zlib.adler32(block) != weak:
+            return None
+        return index if hashlib.blake2b(block, digest_size=STRONG_DIGEST_SIZE).digest() == strong else None
+
+
+class _DeltaWriter:
+    """生成增量指令，相邻的复制指令合并为一条"""
+
+    def __init__(self):
+        self.output = bytearray()
+        self.copy_start = 0
+        self.copy_count = 0
+
+    def copy(self, index: int) -> None:
+        if self.copy_count and index == self.copy_start + self.copy_count:
+            self.copy_count += 1
+            return
+        self._flush_copy()
+        self.copy_start, self.copy_count = index, 1
+
+    def literal(self, data: bytes | memoryview) -> None:
+        self._flush_copy()
+        for start in range(0, len(data), MAX_LITERAL_SIZE):
+            part = data[start : start + MAX_LITERAL_SIZE]
+            self.output += b"L" + struct.pack("<I", len(part))
+            self.output += part
+
+    def finish(self, sha256: bytes) -> None:
+        self._flush_copy()
+        self.output += b"E" + sha256
+
+    def take(self) -> bytes:
+        data = bytes(self.output)
+        self.output.clear()
+        return data
+
+    def _flush_copy(self) -> None:
+        if self.copy_count:
+            self.output += b"C" + struct.pack("<QI", self.copy_start, self.copy_count)
+            self.copy_count = 0
+
+
+def iter_delta(file: str | Path, signature: BlockSignature) -> Iterator[bytes]:
+    """用可滚动的adler32在新文件中查找旧文件的块，生成增量指令的数据块"""
+    with open(file, "rb") as reader:
+        size = reader.seek(0, 2)
+        data = mmap.mmap(reader.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+    try:
+        view = memoryview(data)
+        try:
+            yield from _iter_delta(data, view, signature)
+            writer = _DeltaWriter()
+            writer.finish(hashlib.sha256(view).digest())
+            yield writer.take()
+        finally:
+            view.release()
+    finally:
+        if size:
+            data.close()
+
+
+def _iter_delta(data: bytes | mmap.mmap, view: memoryview, signature: BlockSignature) -> Iterator[bytes]:
+    size, block_size = len(data), signature.block_size
+    writer = _DeltaWriter()
+    position = literal_start = 0
+    weak = None
+    rolled = 0
+    skip_size = roll_window = ROLL_WINDOW_BLOCKS * block_size
+    while position + block_size <= size:
+        if weak is None:
+            weak = zlib.adler32(view[position : position + block_size])
+        index = signature.find(weak, view[position : position + block_size])
+        if index is not None:
+            if literal_start < position:
+                writer.literal(view[literal_start:position])
+            writer.copy(index)
+            position += block_size
+            literal_start = position
+            weak = None
+            rolled = 0
+            skip_size = roll_window
+            if len(writer.output) >= DELTA_CHUNK_SIZE:
+                yield writer.take()
+            continue
+
+        rolled += 1
+        if rolled >= roll_window:
+            # 大段的新数据，逐字节查找太慢
+            position += skip_size
+            skip_size = min(skip_size * 2, MAX_SKIP_SIZE)
+            weak = None
+            rolled = 0
+        elif position + block_size < size:
+            out_byte, in_byte = data[position], data[position + block_size]
+            a = ((weak & 0xFFFF) - out_byte + in_byte) % _ADLER_MOD
+            b = ((weak >> 16) - block_size * out_byte + a - 1) % _ADLER_MOD
+            weak = (b << 16) | a
+            position += 1
+        else:
+            break
+        if position - literal_start >= MAX_LITERAL_SIZE:
+            writer.literal(view[literal_start:position])
+            literal_start = position
+            yield writer.take()
+
+    tail_start = size - signature.tail_size
+    if signature.tail is not None and tail_start >= literal_start:
+        index = signature.find_tail(view[tail_start:])
+        if index is not None:
+            if literal_start < tail_start:
+                writer.literal(view[literal_start:tail_start])
+            writer.copy(index)
+            literal_start = size
+    if literal_start < size:
+        writer.literal(view[literal_start:])
+    yield writer.take()
+
+
+async def aiter_delta(file: str | Path, signature: BlockSignature) -> AsyncIterator[bytes]:
+    """在线程中查找，避免阻塞事件循环"""
+    iterator = iter_delta(file, signature)
+    try:
+        while (chunk := await asyncio.to_thread(next, iterator, None)) is not None:
+            yield chunk
+    finally:
+        iterator.close()
@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 from enum import StrEnum
 
@@ -6,6 +6,7 @@ from enum import StrEnum
 class FileType(StrEnum):
     file = "file"
     directory = "directory"
+    symlink = "symlink"
 
 
 @dataclass
@@ -16,8 +17,78 @@ class FileSystemInfo:
     size: int | None
 
 
+@dataclass
+class FileTreeInfo(FileSystemInfo):
+    # 相对于遍历起点的路径，以/分隔
+    path: str
+
+
+@dataclass
+class UploadSessionInfo:
+    session_id: str
+    directory: str
+    filename: str
+    size: int
+    received: list[tuple[int, int]]
+
+
+@dataclass
+class FileChecksum:
+    path: str
+    size: int
+    sha256: str
+    crc32: str
+
+
+@dataclass
+class TempSpaceUsage:
+    quota: int
+    reserved: int
+    written: int
+    active_reservations: int
+    disk_total: int
+    disk_free: int
+    min_free_space: int
+    upload_sessions: int
+    last_sweep: datetime | None
+    swept_files: int
+    swept_bytes: int
+
+
+@dataclass
+class SyncPlan:
+    # 需要传输的文件和需要在目标中删除的文件或文件夹，都是相对于同步根目录的路径，以/分隔
+    transfer: list[str]
+    delete: list[str]
+    # delete为False时目标中与源类型不同、没有处理的项
+    conflicts: list[str] = field(default_factory=list)
+
+
+@dataclass
+class BatchOperationResult:
+    path: str
+    success: bool
+    error: str | None
+
+
 class CompressMethod(StrEnum):
     not_compressed = "not_compressed"
     zip = "zip"
     tgz = "tgz"
     txz = "txz"
+    tzst = "tzst"
+    ptgz = "ptgz"
+
+
+class ListSortKey(StrEnum):
+    name = "name"
+    last_modified = "last_modified"
+    size = "size"
+    type = "type"
+
+
+class SyncDirection(StrEnum):
+    # 本地文件夹同步到服务器
+    upload = "upload"
+    # 服务器文件夹同步到本地
+    download = "download"
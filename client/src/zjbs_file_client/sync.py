@@ -0,0 +1,137 @@
+import hashlib
+import os
+import posixpath
+import shutil
+import stat
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, NamedTuple
+
+from .model import FileTreeInfo, FileType, SyncPlan
+
+# 比较修改时间时允许的误差，单位为秒
+MTIME_TOLERANCE = 0.001
+
+
+class FileState(NamedTuple):
+    size: int
+    mtime: float
+
+
+class TreeState(NamedTuple):
+    # 以/分隔的相对路径
+    files: dict[str, FileState]
+    directories: set[str]
+
+
+def scan_local(directory: Path) -> TreeState:
+    """符号链接不参与同步，与remote_tree一样跳过"""
+    files, directories = {}, set()
+    for dir_path, dir_names, file_names in os.walk(directory):
+        prefix = Path(dir_path).relative_to(directory).as_posix()
+        prefix = "" if prefix == "." else prefix + "/"
+        for name in list(dir_names):
+            if os.path.islink(os.path.join(dir_path, name)):
+                dir_names.remove(name)
+            else:
+                directories.add(prefix + name)
+        for name in file_names:
+            stat_result = os.lstat(os.path.join(dir_path, name))
+            if stat.S_ISREG(stat_result.st_mode):
+                files[prefix + name] = FileState(stat_result.st_size, stat_result.st_mtime)
+    return TreeState(files, directories)
+
+
+def remote_tree(infos: Iterable[FileTreeInfo]) -> TreeState:
+    files, directories = {}, set()
+    for info in infos:
+        if info.type == FileType.symlink:
+            continue
+        if info.type == FileType.directory:
+            directories.add(info.path)
+            continue
+        last_modified = info.last_modified
+        if isinstance(last_modified, str):
+            last_modified = datetime.fromisoformat(last_modified)
+        # 服务器返回带时区的UTC时间，转换为时间戳后与本地时区无关；旧版服务器不带时区，按本地时间处理
+        files[info.path] = FileState(info.size or 0, last_modified.timestamp())
+    return TreeState(files, directories)
+
+
+def _top_level(paths: Iterable[str]) -> list[str]:
+    """删除文件夹时其中的项随之删除，不需要再列出"""
+    result = []
+    for path in sorted(paths):
+        if not result or not path.startswith(result[-1] + "/"):
+            result.append(path)
+    return result
+
+
+def _is_under(path: str, parents: Iterable[str]) -> bool:
+    return any(path == parent or path.startswith(parent + "/") for parent in parents)
+
+
+def plan_sync(source: TreeState, destination: TreeState, delete: bool, checksum: bool) -> tuple[SyncPlan, list[str]]:
+    """比较源和目标文件树，返回(同步计划, 需要比较sha256的文件)
+
+    目标中没有或大小不同的文件需要传输；大小相同的文件，checksum为True或源文件的修改时间更新时由调用方比较sha256，
+    需要传输的再加入计划，去重后服务器上文件的修改时间可能早于本地，只比较修改时间会反复传输；
+    目标中与源类型不同的项只在delete为True时删除，否则记录在conflicts中，其中的文件不传输；
+    delete为True时源中没有的项也删除
+    """
+    conflicts = _top_level(
+        (destination.files.keys() & source.directories) | (destination.directories & source.files.keys())
+    )
+    if delete:
+        to_delete = set(conflicts)
+        to_delete |= destination.files.keys() - source.files.keys()
+        to_delete |= destination.directories - source.directories
+        conflicts = []
+    else:
+        to_delete = set()
+
+    transfer, same_size = [], []
+    for path, state in sorted(source.files.items()):
+        if conflicts and _is_under(path, conflicts):
+            continue
+        destination_state = destination.files.get(path)
+        if destination_state is None or destination_state.size != state.size:
+            transfer.append(path)
+        elif checksum or state.mtime > destination_state.mtime + MTIME_TOLERANCE:
+            same_size.append(path)
+    return SyncPlan(transfer=transfer, delete=_top_level(to_delete), conflicts=conflicts), same_size
+
+
+def remote_path(remote_dir: str, relative_path: str) -> str:
+    return posixpath.join(remote_dir, relative_path)
+
+
+def file_sha256(path: Path) -> str:
+    with open(path, "rb") as file:
+        return hashlib.file_digest(file, "sha256").hexdigest()
+
+
+def delete_local(local_dir: Path, paths: Iterable[str]) -> None:
+    for path in paths:
+        local_path = local_dir / path
+        if local_path.is_dir() and not local_path.is_symlink():
+            shutil.rmtree(local_path)
+        else:
+            local_path.unlink(missing_ok=True)
+
+
+def prepare_local_target(local_dir: Path, relative_path: str) -> Path:
+    local_path = local_dir / relative_path
+    local_path.parent.mkdir(parents=True, exist_ok=True)
+    return local_path
+
+
+def set_local_mtime(local_path: Path, state: FileState) -> None:
+    """下载后本地文件的修改时间与服务器一致，下次同步时不会再传输"""
+    os.utime(local_path, (state.mtime, state.mtime))
+
+
+def update_local_mtimes(local_dir: Path, paths: Iterable[str], remote: TreeState) -> None:
+    """内容与服务器相同的文件，修改时间改为与服务器一致，下次同步时不需要再比较sha256"""
+    for path in paths:
+        set_local_mtime(local_dir / path, remote.files[path])
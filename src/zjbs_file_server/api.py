@@ -1,68 +1,166 @@
-import os
-import shutil
-import tarfile
 from typing import Annotated
-from zipfile import ZipFile
 
-from fastapi import APIRouter, File, Query, UploadFile
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Query
 from loguru import logger
-from starlette.background import BackgroundTask
-
-from zjbs_file_server import service
-from zjbs_file_server.types import AbsoluteUrlPath, CompressMethod, FileSystemInfo, is_valid_filename
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+
+from zjbs_file_server import delta, listing, service, upload_session
+from zjbs_file_server.archive import ARCHIVE_SUFFIXES
+from zjbs_file_server.file_response import RangeFileResponse
+from zjbs_file_server.multipart_stream import multipart_openapi
+from zjbs_file_server.temp_space import temp_space
+from zjbs_file_server.types import (
+    AbsoluteUrlPath,
+    BatchOperation,
+    BatchOperationResult,
+    CompressMethod,
+    FileChecksum,
+    FileSystemInfo,
+    FileType,
+    ListSortKey,
+    TempSpaceUsage,
+    UploadSessionInfo,
+)
 from zjbs_file_server.util import get_os_path, raise_bad_request, raise_not_found
 
 router = APIRouter(tags=["file"])
 
 
-@router.post("/upload-file", description="上传文件")
-def upload_file(
+@router.post("/upload-file", description="上传文件", openapi_extra=multipart_openapi({"file": "上传的文件"}))
+async def upload_file(
+    request: Request,
     directory: Annotated[AbsoluteUrlPath, Query(description="目标文件夹")],
-    file: Annotated[UploadFile, File(description="上传的文件")],
     mkdir: Annotated[bool, Query(description="是否创建目录")] = False,
     allow_overwrite: Annotated[bool, Query(description="是否允许覆盖已有文件")] = False,
+    expected_sha256: Annotated[str | None, Query(description="文件的sha256，不匹配时拒绝上传")] = None,
 ) -> None:
-    return service.upload_file(directory, file.filename, file.file, mkdir, allow_overwrite)
+    await service.receive_multipart_upload(request, directory, None, mkdir, allow_overwrite, expected_sha256)
+
+
+@router.post("/upload-by-hash", description="服务器已有相同内容的文件时不上传内容，直接创建文件，返回是否已经创建")
+def upload_by_hash(
+    directory: Annotated[AbsoluteUrlPath, Query(description="目标文件夹")],
+    filename: Annotated[str, Query(description="文件名")],
+    sha256: Annotated[str, Query(description="文件内容的sha256")],
+    mkdir: Annotated[bool, Query(description="是否创建目录")] = False,
+    allow_overwrite: Annotated[bool, Query(description="是否允许覆盖已有文件")] = False,
+) -> bool:
+    return service.upload_by_hash(directory, filename, sha256, mkdir, allow_overwrite)
+
+
+@router.post(
+    "/upload-files",
+    description="在一个请求中上传多个文件，返回每个文件的结果",
+    openapi_extra=multipart_openapi({"files": "上传的文件，可以有多个"}),
+)
+async def upload_files(
+    request: Request,
+    directory: Annotated[AbsoluteUrlPath, Query(description="目标文件夹")],
+    mkdir: Annotated[bool, Query(description="是否创建目录")] = False,
+    allow_overwrite: Annotated[bool, Query(description="是否允许覆盖已有文件")] = False,
+) -> list[BatchOperationResult]:
+    return await service.receive_multipart_files(request, directory, mkdir, allow_overwrite)
 
 
-@router.post("/upload-directory", description="以压缩包上传文件夹")
-def upload_directory(
+@router.post(
+    "/upload-directory",
+    description="以压缩包上传文件夹，tar包边接收边解压",
+    openapi_extra=multipart_openapi({"compressed_dir": "上传的文件"}),
+)
+async def upload_directory(
+    request: Request,
     parent_dir: Annotated[AbsoluteUrlPath, Query(description="目标文件夹")],
-    compressed_dir: Annotated[UploadFile, File(description="上传的文件")],
-    compress_method: Annotated[CompressMethod, Query(description="压缩方法")],
+    compress_method: Annotated[CompressMethod, Query(description="压缩方法，not_compressed表示不压缩的tar包")],
     mkdir: Annotated[bool, Query(description="是否创建目录")] = True,
     zip_metadata_encoding: Annotated[str, Query(description="zip文件元数据编码")] = "GB18030",
 ) -> None:
-    destination_parent_dir = get_os_path(parent_dir)
-    if mkdir:
-        destination_parent_dir.mkdir(parents=True, exist_ok=True)
-    elif not destination_parent_dir.is_dir():
-        logger.error(f"upload_directory fail: directory not exists or not directory: {destination_parent_dir}")
-        raise_bad_request(f"directory {parent_dir} not exists or not directory")
-
-    match compress_method:
-        case CompressMethod.zip:
-            with ZipFile(compressed_dir.file, mode="r", metadata_encoding=zip_metadata_encoding) as zip_file:
-                zip_file.extractall(destination_parent_dir)
-        case CompressMethod.tgz | CompressMethod.txz:
-            with tarfile.open(
-                fileobj=compressed_dir.file, mode="r:gz" if compress_method == CompressMethod.tgz else "r:xz"
-            ) as tar_file:
-                tar_file.extractall(destination_parent_dir)
-        case _:
-            logger.error(f"upload_directory fail: unsupported compress method: {compress_method}")
-            raise_bad_request(f"unsupported compress method: {compress_method}")
-    logger.info(f"upload_zip success: {destination_parent_dir}")
+    await service.receive_multipart_directory(request, parent_dir, compress_method, mkdir, zip_metadata_encoding)
+
+
+@router.post("/upload-session/create", description="创建分块上传会话")
+def create_upload_session(
+    directory: Annotated[AbsoluteUrlPath, Query(description="目标文件夹")],
+    filename: Annotated[str, Query(description="文件名")],
+    size: Annotated[int, Query(description="文件大小")],
+    mkdir: Annotated[bool, Query(description="是否创建目录")] = False,
+    allow_overwrite: Annotated[bool, Query(description="是否允许覆盖已有文件")] = False,
+) -> UploadSessionInfo:
+    return upload_session.create_session(directory, filename, size, mkdir, allow_overwrite)
+
+
+@router.put("/upload-session/chunk", description="上传一个分块，请求体为分块内容")
+async def upload_session_chunk(
+    request: Request,
+    session_id: Annotated[str, Query(description="上传会话ID")],
+    offset: Annotated[int, Query(description="分块在文件中的偏移量")],
+) -> None:
+    await upload_session.write_chunk(session_id, offset, request.stream())
+
+
+@router.post("/upload-session/status", description="查询上传会话已接收的范围")
+def get_upload_session(session_id: Annotated[str, Query(description="上传会话ID")]) -> UploadSessionInfo:
+    return upload_session.get_session_info(session_id)
+
+
+@router.post("/upload-session/commit", description="完成上传会话，替换为目标文件")
+def commit_upload_session(session_id: Annotated[str, Query(description="上传会话ID")]) -> None:
+    upload_session.commit_session(session_id)
+
+
+@router.post("/upload-session/abort", description="放弃上传会话")
+def abort_upload_session(session_id: Annotated[str, Query(description="上传会话ID")]) -> None:
+    upload_session.abort_session(session_id)
+
+
+@router.post("/temp-space", description="临时空间的配额、预留、空闲空间、上传会话数和清理情况")
+def get_temp_space_usage() -> TempSpaceUsage:
+    return temp_space.usage()
+
+
+@router.post(
+    "/delta/signature",
+    description="获取文件的分块签名，用于增量上传；响应头X-Block-Size为块大小，ETag用于上传增量时确认文件没有变化",
+)
+def get_delta_signature(
+    path: Annotated[AbsoluteUrlPath, Query(description="文件路径")],
+    block_size: Annotated[int | None, Query(description="块大小，默认按文件大小选择")] = None,
+) -> StreamingResponse:
+    return delta.signature_response(path, block_size)
+
+
+@router.post("/delta/upload", description="按分块签名上传增量，重建文件后替换原文件，请求体为增量指令")
+async def upload_delta(
+    request: Request,
+    path: Annotated[AbsoluteUrlPath, Query(description="文件路径")],
+    base_etag: Annotated[str, Query(description="获取签名时文件的ETag")],
+    block_size: Annotated[int, Query(description="签名的块大小")],
+) -> None:
+    await delta.upload_delta(path, request.stream(), base_etag, block_size)
 
 
 @router.post("/download-file", description="下载文件")
-def download_file(path: Annotated[AbsoluteUrlPath, Query(description="文件路径")]) -> FileResponse:
+def download_file(path: Annotated[AbsoluteUrlPath, Query(description="文件路径")]) -> RangeFileResponse:
     return service.download_file(path)
 
 
-@router.post("/download-directory", description="下载文件夹")
-def download_directory(path: Annotated[AbsoluteUrlPath, Query(description="文件路径")]) -> FileResponse:
+@router.post("/checksum", description="获取文件的sha256和crc32")
+def get_checksum(path: Annotated[AbsoluteUrlPath, Query(description="文件路径")]) -> FileChecksum:
+    return service.get_checksum(path)
+
+
+@router.post("/download-directory", description="下载文件夹", response_model=None)
+def download_directory(
+    path: Annotated[AbsoluteUrlPath, Query(description="文件路径")],
+    compress_method: Annotated[
+        CompressMethod, Query(description="压缩方法，not_compressed表示不压缩的tar包")
+    ] = CompressMethod.txz,
+    compress_level: Annotated[int | None, Query(description="压缩级别，默认使用压缩方法的默认级别")] = None,
+    compress_threads: Annotated[
+        int | None, Query(description="压缩线程数，只对tzst和ptgz有效，默认使用全部CPU")
+    ] = None,
+    adaptive: Annotated[bool, Query(description="自适应压缩，已经压缩过的文件只存储不压缩")] = False,
+) -> StreamingResponse | RangeFileResponse:
     dir_path = get_os_path(path)
     if not dir_path.exists():
         logger.error(f"download_directory fail: file not exists: {dir_path}")
@@ -71,12 +169,9 @@ def download_directory(path: Annotated[AbsoluteUrlPath, Query(description="文
         logger.error(f"download_file fail: not a file: {dir_path}")
         raise_bad_request(f"not a file: {path}")
 
-    compressed = dir_path.with_suffix(".tar.xz")
-    with tarfile.open(compressed, "w:xz") as tar_file:
-        tar_file.add(dir_path, arcname=dir_path.name)
-
-    logger.info(f"download_directory success: {dir_path}")
-    return FileResponse(compressed, filename=compressed.name, background=BackgroundTask(os.unlink, compressed))
+    logger.info(f"download_directory start: {dir_path}")
+    filename = f"{dir_path.name}.{ARCHIVE_SUFFIXES.get(compress_method, compress_method.value)}"
+    return service.compress(dir_path, compress_method, False, filename, compress_level, compress_threads, adaptive)
 
 
 @router.post("/delete", description="删除文件")
@@ -84,32 +179,51 @@ def delete_file(
     path: Annotated[AbsoluteUrlPath, Query(description="文件路径")],
     recursive: Annotated[bool, Query(description="是否递归删除")] = False,
 ) -> bool:
-    file_path = get_os_path(path)
-    if not file_path.exists():
-        logger.error(f"delete file fail: file not exists: {file_path}")
-        return False
-    if file_path.is_file():
-        file_path.unlink()
-        logger.info(f"delete file success: {file_path}")
-        return True
-    if file_path.is_dir():
-        if recursive:
-            shutil.rmtree(file_path)
-            logger.info(f"delete directory success: {file_path}")
-            return True
-        else:
-            try:
-                file_path.rmdir()
-                logger.info(f"delete empty directory success: {file_path}")
-                return True
-            except OSError:
-                logger.error(f"delete empty directory fail: {file_path}")
-                return False
-
-
-@router.post("/list-directory", description="获取文件列表")
-def list_directory(directory: Annotated[AbsoluteUrlPath, Query(description="文件路径")]) -> list[FileSystemInfo]:
-    return service.list_directory_by_path(directory, True)
+    return service.delete_path(path, recursive)
+
+
+@router.post("/batch-operations", description="批量删除、重命名，返回每一项的结果")
+def batch_operations(operations: list[BatchOperation]) -> list[BatchOperationResult]:
+    return service.run_batch_operations(operations)
+
+
+@router.post("/list-directory", description="获取文件列表", response_model=list[FileSystemInfo])
+def list_directory(
+    response: Response,
+    directory: Annotated[AbsoluteUrlPath, Query(description="文件路径")],
+    sort: Annotated[ListSortKey | None, Query(description="排序字段，默认不排序；分页时默认按文件名排序")] = None,
+    reverse: Annotated[bool, Query(description="是否倒序")] = False,
+    name_pattern: Annotated[str | None, Query(description="文件名通配符，如*.edf")] = None,
+    file_type: Annotated[FileType | None, Query(description="只列出文件或文件夹")] = None,
+    limit: Annotated[int | None, Query(ge=1, description="每页数量，下一页的游标在X-Next-Cursor响应头中")] = None,
+    cursor: Annotated[str | None, Query(description="上一页返回的游标")] = None,
+    stream: Annotated[bool, Query(description="以NDJSON流式返回，每行一项")] = False,
+) -> list[FileSystemInfo] | StreamingResponse:
+    infos, next_cursor = service.list_directory(directory, True, sort, reverse, name_pattern, file_type, limit, cursor)
+    if stream:
+        return listing.ndjson_response(infos, next_cursor)
+    if next_cursor is not None:
+        response.headers[listing.NEXT_CURSOR_HEADER] = next_cursor
+    return list(infos)
+
+
+@router.post(
+    "/walk-directory",
+    description="递归遍历文件树，以NDJSON流式返回，每行一项",
+    response_class=StreamingResponse,
+    responses={200: {"content": {listing.NDJSON_MEDIA_TYPE: {}}}},
+)
+def walk_directory(
+    directory: Annotated[AbsoluteUrlPath, Query(description="文件夹路径")],
+    max_depth: Annotated[int | None, Query(ge=1, description="最大深度，文件夹中的项深度为1，默认不限制")] = None,
+    include: Annotated[list[str] | None, Query(description="只返回文件名或相对路径匹配任一通配符的项")] = None,
+    exclude: Annotated[
+        list[str] | None, Query(description="跳过文件名或相对路径匹配任一通配符的项，不进入匹配的文件夹")
+    ] = None,
+    follow_symlinks: Annotated[bool, Query(description="是否跟随符号链接")] = False,
+) -> StreamingResponse:
+    infos = service.walk_directory(directory, max_depth, include or [], exclude or [], follow_symlinks)
+    return listing.ndjson_response(infos, None)
 
 
 @router.post("/rename", description="重命名文件")
@@ -117,16 +231,4 @@ def rename(
     path: Annotated[AbsoluteUrlPath, Query(description="文件路径")],
     new_name: Annotated[str, Query(description="新文件名")],
 ) -> None:
-    file_path = get_os_path(path)
-    if not file_path.exists():
-        logger.error(f"rename fail: file not exists: {path}")
-        raise_not_found(path)
-    if not is_valid_filename(new_name):
-        logger.error(f"rename fail: invalid filename: {new_name}")
-        raise_bad_request(f"invalid filename: {new_name}")
-    new_path = file_path.parent / new_name
-    if new_path.exists():
-        logger.error(f"rename fail: target exists: {new_path}")
-        raise_bad_request(f"target exists: {new_name}")
-
-    os.rename(file_path, new_path)
+    service.rename_path(path, new_name)
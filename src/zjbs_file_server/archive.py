@@ -0,0 +1,194 @@
+import os
+import queue
+import tarfile
+import threading
+import zipfile
+from pathlib import Path
+from typing import BinaryIO, Iterator
+from urllib.parse import quote
+from zipfile import ZipFile
+
+from loguru import logger
+
+from zjbs_file_server.codec import (
+    COMPRESS_LEVEL_RANGES,
+    DEFAULT_COMPRESS_LEVELS,
+    TAR_COMPRESS_METHODS,
+    is_incompressible,
+    open_compress_writer,
+)
+from zjbs_file_server.file_response import ConditionalStreamingResponse
+from zjbs_file_server.types import CompressMethod
+from zjbs_file_server.util import raise_bad_request
+
+# 流式压缩时每个响应块的大小
+STREAM_CHUNK_SIZE: int = 256 * 1024
+# 压缩线程最多领先发送的块数，限制内存占用
+STREAM_QUEUE_SIZE: int = 16
+
+ARCHIVE_MEDIA_TYPES: dict[CompressMethod, str] = {
+    CompressMethod.not_compressed: "application/x-tar",
+    CompressMethod.zip: "application/zip",
+    CompressMethod.tgz: "application/gzip",
+    CompressMethod.txz: "application/x-xz",
+    CompressMethod.tzst: "application/zstd",
+    CompressMethod.ptgz: "application/gzip",
+}
+# 下载时的文件扩展名
+ARCHIVE_SUFFIXES: dict[CompressMethod, str] = {
+    CompressMethod.not_compressed: "tar",
+    CompressMethod.zip: "zip",
+    CompressMethod.tgz: "tgz",
+    CompressMethod.txz: "txz",
+    CompressMethod.tzst: "tzst",
+    CompressMethod.ptgz: "tgz",
+}
+
+
+class ArchiveStreamClosed(Exception):
+    """消费者已经停止读取，压缩线程应当退出"""
+
+
+def write_archive(
+    path: Path,
+    compress_method: CompressMethod,
+    follow_symlinks: bool,
+    fileobj: BinaryIO,
+    compress_level: int | None = None,
+    compress_threads: int | None = None,
+    adaptive: bool = False,
+) -> None:
+    """把文件或文件夹压缩写入fileobj，fileobj只需要支持write，不要求可以seek
+
+    adaptive为True时，已经压缩过的文件在压缩包中只存储不压缩
+    """
+    match compress_method:
+        case CompressMethod.zip:
+            if compress_level is None:
+                compress_level = DEFAULT_COMPRESS_LEVELS[compress_method]
+            with ZipFile(fileobj, mode="w", compression=zipfile.ZIP_DEFLATED, compresslevel=compress_level) as zip_file:
+
+                def write_zip_member(file_path: str, arcname: str) -> None:
+                    compress_type = zipfile.ZIP_DEFLATED
+                    if adaptive and is_incompressible(file_path, os.path.getsize(file_path)):
+                        compress_type = zipfile.ZIP_STORED
+                    zip_file.write(file_path, arcname, compress_type=compress_type)
+
+                if path.is_file():
+                    write_zip_member(str(path), path.name)
+                elif path.is_dir():
+                    parent_path = path.parent
+                    for root, _, files in os.walk(path, followlinks=follow_symlinks):
+                        for file in files:
+                            file_path = os.path.join(root, file)
+                            write_zip_member(file_path, os.path.relpath(file_path, parent_path))
+                else:
+                    raise ValueError(f"not a file or directory: {path}")
+        case method if method in TAR_COMPRESS_METHODS:
+            with open_compress_writer(fileobj, compress_method, compress_level, compress_threads, adaptive) as writer:
+
+                def switch_compression(tar_info: tarfile.TarInfo) -> tarfile.TarInfo:
+                    # tarfile在调用filter之后才写出成员的头和内容，此时切换对整个成员生效
+                    if tar_info.isreg():
+                        writer.set_incompressible(is_incompressible(path.parent / tar_info.name, tar_info.size))
+                    return tar_info
+
+                with tarfile.open(fileobj=writer, mode="w|", dereference=follow_symlinks) as tar_file:
+                    tar_file.add(path, path.name, filter=switch_compression if adaptive else None)
+        case _:
+            raise ValueError(f"unsupported compress method: {compress_method}")
+
+
+class _QueueWriter:
+    """把写入的数据攒成块放入有界队列，队列满时阻塞写入方"""
+
+    def __init__(self, chunk_queue: queue.Queue, closed: threading.Event):
+        self.chunk_queue = chunk_queue
+        self.closed = closed
+        self.buffer = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        if len(self.buffer) >= STREAM_CHUNK_SIZE:
+            self.flush()
+        return len(data)
+
+    def flush(self) -> None:
+        if self.buffer:
+            self.put(bytes(self.buffer))
+            self.buffer.clear()
+
+    def put(self, item: bytes | BaseException | None) -> None:
+        while True:
+            if self.closed.is_set():
+                raise ArchiveStreamClosed()
+            try:
+                self.chunk_queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+
+def iter_archive(
+    path: Path,
+    compress_method: CompressMethod,
+    follow_symlinks: bool,
+    compress_level: int | None = None,
+    compress_threads: int | None = None,
+    adaptive: bool = False,
+) -> Iterator[bytes]:
+    """在后台线程中遍历并压缩，边压缩边产出压缩数据块"""
+    chunk_queue: queue.Queue[bytes | BaseException | None] = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    closed = threading.Event()
+    writer = _QueueWriter(chunk_queue, closed)
+
+    def produce() -> None:
+        try:
+            write_archive(path, compress_method, follow_symlinks, writer, compress_level, compress_threads, adaptive)
+            writer.flush()
+            writer.put(None)
+        except ArchiveStreamClosed:
+            logger.info(f"compress aborted by client: {path}")
+        except BaseException as e:
+            logger.exception(f"compress fail: {path}")
+            try:
+                writer.put(e)
+            except ArchiveStreamClosed:
+                pass
+
+    producer = threading.Thread(target=produce, name=f"compress-{path.name}", daemon=True)
+    producer.start()
+    try:
+        while (item := chunk_queue.get()) is not None:
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        closed.set()
+
+
+def check_archive_source(path: Path, compress_method: CompressMethod, compress_level: int | None = None) -> None:
+    if compress_method not in ARCHIVE_MEDIA_TYPES:
+        logger.error(f"compress fail: unsupported compress method: {compress_method}")
+        raise_bad_request(f"unsupported compress method: {compress_method}")
+    if compress_level is not None and compress_level not in COMPRESS_LEVEL_RANGES[compress_method]:
+        logger.error(f"compress fail: invalid compress level: {compress_method}, {compress_level}")
+        raise_bad_request(f"invalid compress level for {compress_method}: {compress_level}")
+    if not path.is_file() and not path.is_dir():
+        logger.error(f"compress fail: not a file or directory: {path}")
+        raise_bad_request("not a file or directory")
+
+
+def archive_response(
+    chunks: Iterator[bytes], compress_method: CompressMethod, filename: str, headers: dict[str, str] | None = None
+) -> ConditionalStreamingResponse:
+    quoted_filename = quote(filename)
+    if quoted_filename != filename:
+        content_disposition = f"attachment; filename*=utf-8''{quoted_filename}"
+    else:
+        content_disposition = f'attachment; filename="{filename}"'
+    return ConditionalStreamingResponse(
+        chunks,
+        media_type=ARCHIVE_MEDIA_TYPES[compress_method],
+        headers={**(headers or {}), "content-disposition": content_disposition},
+    )
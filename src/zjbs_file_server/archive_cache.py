@@ -0,0 +1,156 @@
+import hashlib
+import os
+import threading
+import uuid
+from pathlib import Path
+from typing import Iterator
+
+from loguru import logger
+
+from zjbs_file_server.settings import settings
+from zjbs_file_server.temp_space import temp_space
+from zjbs_file_server.types import CompressMethod
+
+
+def tree_stat(path: Path, follow_symlinks: bool) -> tuple[str, float]:
+    """根据文件树中所有条目的相对路径、大小和修改时间计算指纹，文件内容变化时修改时间必然变化
+
+    同时返回文件树中最晚的修改时间
+    """
+    digest = hashlib.sha256()
+    latest_mtime = 0.0
+
+    def update(relative_path: str, stat_result: os.stat_result) -> None:
+        nonlocal latest_mtime
+        digest.update(
+            f"{relative_path}\0{stat_result.st_mode}\0{stat_result.st_size}\0{stat_result.st_mtime_ns}\n".encode()
+        )
+        latest_mtime = max(latest_mtime, stat_result.st_mtime)
+
+    def walk(dir_path: str, relative_dir: str) -> None:
+        with os.scandir(dir_path) as entries:
+            sorted_entries = sorted(entries, key=lambda entry: entry.name)
+        for entry in sorted_entries:
+            relative_path = f"{relative_dir}/{entry.name}"
+            update(relative_path, entry.stat(follow_symlinks=follow_symlinks))
+            if entry.is_dir(follow_symlinks=follow_symlinks):
+                walk(entry.path, relative_path)
+
+    update("", path.stat() if follow_symlinks else path.lstat())
+    if path.is_dir():
+        walk(str(path), "")
+    return digest.hexdigest(), latest_mtime
+
+
+def tree_fingerprint(path: Path, follow_symlinks: bool) -> str:
+    return tree_stat(path, follow_symlinks)[0]
+
+
+class ArchiveCache:
+    """TEMP_DIR中的压缩包缓存，以(路径, 压缩方法, 文件树指纹)为键，按最近使用时间淘汰"""
+
+    def __init__(self, cache_dir: Path, max_size: int):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    @staticmethod
+    def cache_key(
+        path: Path,
+        compress_method: CompressMethod,
+        compress_level: int | None,
+        follow_symlinks: bool,
+        fingerprint: str,
+        adaptive: bool = False,
+    ) -> str:
+        key_base = f"{path}\0{compress_method}\0{compress_level}\0{follow_symlinks}\0{fingerprint}"
+        if adaptive:
+            key_base += "\0adaptive"
+        return hashlib.sha256(key_base.encode()).hexdigest()
+
+    def entry_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.archive"
+
+    def get(self, key: str) -> Path | None:
+        """命中时在锁内为缓存文件创建一个临时硬链接并返回，发送完成后由调用方删除
+
+        淘汰只删除缓存文件的链接，不影响正在发送的响应；调用方没有删除的临时链接由temp_space按.tmp文件清理
+        """
+        cached_path = self.entry_path(key)
+        pinned_path = self.cache_dir / f"{uuid.uuid4()}.tmp"
+        with self.lock:
+            try:
+                # 用修改时间记录最近使用时间
+                os.utime(cached_path)
+                os.link(cached_path, pinned_path)
+            except FileNotFoundError:
+                return None
+        logger.info(f"archive cache hit: {cached_path}")
+        return pinned_path
+
+    def iter_and_store(
+        self, chunks: Iterator[bytes], key: str, path: Path, follow_symlinks: bool, fingerprint: str
+    ) -> Iterator[bytes]:
+        """原样产出压缩数据块，同时写入缓存；压缩完成且文件树没有变化时才发布缓存
+
+        写入的临时文件在TEMP_DIR中预留空间，临时空间不足时放弃缓存，不影响压缩包的发送
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.cache_dir / f"{uuid.uuid4()}.tmp"
+        reservation = temp_space.reserve(tmp_path)
+        written = 0
+        tmp_file = open(tmp_path, "wb")
+        try:
+            for chunk in chunks:
+                if tmp_file is not None:
+                    written += len(chunk)
+                    # 超过缓存上限或临时空间不足时不缓存
+                    if written > self.max_size or not reservation.record(len(chunk)):
+                        tmp_file.close()
+                        tmp_file = None
+                        tmp_path.unlink(missing_ok=True)
+                        reservation.release()
+                    else:
+                        tmp_file.write(chunk)
+                yield chunk
+            if tmp_file is not None:
+                tmp_file.close()
+                tmp_file = None
+                if tree_fingerprint(path, follow_symlinks) == fingerprint:
+                    os.replace(tmp_path, self.entry_path(key))
+                    logger.info(f"archive cache store: {self.entry_path(key)}")
+                    self.evict()
+        finally:
+            if tmp_file is not None:
+                tmp_file.close()
+            tmp_path.unlink(missing_ok=True)
+            reservation.release()
+
+    def evict(self) -> None:
+        with self.lock:
+            entries = []
+            with os.scandir(self.cache_dir) as dir_entries:
+                for entry in dir_entries:
+                    if entry.name.endswith(".archive"):
+                        try:
+                            stat_result = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        entries.append((stat_result.st_mtime_ns, stat_result.st_size, entry.path))
+            total_size = sum(size for _, size, _ in entries)
+            for _, size, entry_path in sorted(entries):
+                if total_size <= self.max_size:
+                    break
+                try:
+                    os.unlink(entry_path)
+                    logger.info(f"archive cache evict: {entry_path}")
+                except FileNotFoundError:
+                    pass
+                total_size -= size
+
+
+archive_cache = ArchiveCache(settings.TEMP_DIR / "archive_cache", settings.ARCHIVE_CACHE_MAX_SIZE)
@@ -0,0 +1,248 @@
+import hashlib
+import os
+import sqlite3
+import tarfile
+import threading
+import zlib
+from pathlib import Path
+from typing import BinaryIO, Iterable, NamedTuple
+from zipfile import ZipFile
+
+from loguru import logger
+
+from zjbs_file_server.settings import settings
+
+# 计算校验值时每次读取的字节数
+CHECKSUM_READ_SIZE: int = 1024 * 1024
+
+
+class FileIdentity(NamedTuple):
+    """文件被修改或替换时至少有一项会变化"""
+
+    device: int
+    inode: int
+    size: int
+    mtime_ns: int
+
+    @classmethod
+    def from_stat(cls, stat_result: os.stat_result) -> "FileIdentity":
+        return cls(stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns)
+
+
+class Checksums(NamedTuple):
+    sha256: str
+    # 8位十六进制
+    crc32: str
+
+
+class _ChecksumState:
+    def __init__(self):
+        self.sha256 = hashlib.sha256()
+        self.crc32 = 0
+
+    def update(self, data: bytes) -> None:
+        self.sha256.update(data)
+        self.crc32 = zlib.crc32(data, self.crc32)
+
+    def checksums(self) -> Checksums:
+        return Checksums(self.sha256.hexdigest(), f"{self.crc32:08x}")
+
+
+class ChecksumWriter(_ChecksumState):
+    """写入的同时计算sha256和crc32，不需要再读一遍文件"""
+
+    def __init__(self, fileobj: BinaryIO):
+        super().__init__()
+        self.fileobj = fileobj
+
+    def write(self, data: bytes) -> int:
+        self.update(data)
+        return self.fileobj.write(data)
+
+    def close(self) -> None:
+        self.fileobj.close()
+
+
+class ChecksumReader(_ChecksumState):
+    """读取的同时计算sha256和crc32"""
+
+    def __init__(self, fileobj: BinaryIO):
+        super().__init__()
+        self.fileobj = fileobj
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fileobj.read(size)
+        self.update(data)
+        return data
+
+    def __enter__(self) -> "ChecksumReader":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.fileobj.close()
+
+
+def compute_checksums(path: Path | str) -> Checksums:
+    state = _ChecksumState()
+    with open(path, "rb") as file:
+        while chunk := file.read(CHECKSUM_READ_SIZE):
+            state.update(chunk)
+    return state.checksums()
+
+
+class ChecksumTarFile(tarfile.TarFile):
+    """解压时计算每个普通文件的校验值，以解压后的路径为键记录在checksums中"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checksums: dict[str, Checksums] = {}
+
+    def makefile(self, tarinfo: tarfile.TarInfo, targetpath: str) -> None:
+        if tarinfo.sparse is not None:
+            super().makefile(tarinfo, targetpath)
+            return
+        self.fileobj.seek(tarinfo.offset_data)
+        with open(targetpath, "wb") as target:
+            writer = ChecksumWriter(target)
+            tarfile.copyfileobj(self.fileobj, writer, tarinfo.size, tarfile.ReadError, self.copybufsize)
+        self.checksums[targetpath] = writer.checksums()
+
+
+class ChecksumZipFile(ZipFile):
+    """解压时计算每个文件的校验值，以解压后的路径为键记录在checksums中
+
+    ZipFile.extract通过open读取成员内容，包装open返回的文件即可在复制时计算
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checksums: dict[str, Checksums] = {}
+        self._reader: ChecksumReader | None = None
+
+    def open(self, name, mode="r", pwd=None, **kwargs):
+        fileobj = super().open(name, mode, pwd, **kwargs)
+        if mode != "r":
+            return fileobj
+        self._reader = ChecksumReader(fileobj)
+        return self._reader
+
+    def _extract_member(self, member, targetpath, pwd):
+        self._reader = None
+        targetpath = super()._extract_member(member, targetpath, pwd)
+        if self._reader is not None:
+            self.checksums[targetpath] = self._reader.checksums()
+        return targetpath
+
+
+class ChecksumStore:
+    """保存在SQLite中的文件校验值，文件的FileIdentity变化后记录失效
+
+    校验值只是为了避免重复读取文件，数据库出错时记录日志后忽略
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.connection: sqlite3.Connection | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.connection is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS checksums ("
+                "path TEXT PRIMARY KEY, device INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER, "
+                "sha256 TEXT, crc32 TEXT)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS checksums_inode ON checksums (device, inode)")
+            self.connection = connection
+        return self.connection
+
+    def get(self, path: Path, stat_result: os.stat_result) -> Checksums | None:
+        try:
+            with self.lock:
+                row = (
+                    self._connect()
+                    .execute(
+                        "SELECT device, inode, size, mtime_ns, sha256, crc32 FROM checksums WHERE path = ?",
+                        (str(path),),
+                    )
+                    .fetchone()
+                )
+        except sqlite3.Error:
+            logger.exception(f"checksum store: query error: {path}")
+            return None
+        if row is None or FileIdentity(*row[:4]) != FileIdentity.from_stat(stat_result):
+            return None
+        return Checksums(*row[4:])
+
+    def put_many(self, items: Iterable[tuple[Path | str, Checksums]]) -> None:
+        """记录刚写入的文件的校验值，文件已经不存在时跳过"""
+        rows = []
+        for path, checksums in items:
+            try:
+                identity = FileIdentity.from_stat(os.stat(path))
+            except FileNotFoundError:
+                continue
+            rows.append((str(path), *identity, *checksums))
+        if not rows:
+            return
+        try:
+            with self.lock:
+                self._connect().executemany("INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        except sqlite3.Error:
+            logger.exception(f"checksum store: insert error: {rows[0][0]}")
+
+    def put(self, path: Path | str, checksums: Checksums) -> None:
+        self.put_many([(path, checksums)])
+
+    def remove_tree(self, path: Path | str) -> None:
+        """删除文件或文件夹中所有文件的记录"""
+        try:
+            with self.lock:
+                self._delete_tree(self._connect(), str(path))
+        except sqlite3.Error:
+            logger.exception(f"checksum store: delete error: {path}")
+
+    @staticmethod
+    def _delete_tree(connection: sqlite3.Connection, path: str) -> None:
+        prefix = path.rstrip(os.sep) + os.sep
+        # LIKE不区分大小写，用substr比较前缀
+        connection.execute(
+            "DELETE FROM checksums WHERE path = ? OR substr(path, 1, ?) = ?", (path, len(prefix), prefix)
+        )
+
+    def rename_tree(self, path: Path | str, new_path: Path | str) -> None:
+        """文件或文件夹被重命名，记录随之移动，重命名不改变文件的FileIdentity"""
+        path, new_path = str(path), str(new_path)
+        prefix = path.rstrip(os.sep) + os.sep
+        try:
+            with self.lock:
+                connection = self._connect()
+                connection.execute("BEGIN")
+                try:
+                    self._delete_tree(connection, new_path)
+                    connection.execute(
+                        "UPDATE checksums SET path = ? || substr(path, ?) WHERE path = ? OR substr(path, 1, ?) = ?",
+                        (new_path, len(path) + 1, path, len(prefix), prefix),
+                    )
+                    connection.execute("COMMIT")
+                except BaseException:
+                    connection.execute("ROLLBACK")
+                    raise
+        except sqlite3.Error:
+            logger.exception(f"checksum store: rename error: {path}")
+
+    def get_or_compute(self, path: Path, stat_result: os.stat_result) -> Checksums | None:
+        """没有记录或记录失效时读取文件计算；计算期间文件被修改时返回None"""
+        if (checksums := self.get(path, stat_result)) is not None:
+            return checksums
+        checksums = compute_checksums(path)
+        if FileIdentity.from_stat(os.stat(path)) != FileIdentity.from_stat(stat_result):
+            return None
+        self.put(path, checksums)
+        return checksums
+
+
+checksum_store = ChecksumStore(settings.CHECKSUM_DB_PATH)
@@ -0,0 +1,327 @@
+import gzip
+import lzma
+import os
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import BinaryIO, Callable, ContextManager, Iterator
+
+import zstandard
+
+from zjbs_file_server.types import CompressMethod
+
+# 使用tar打包的压缩方法
+TAR_COMPRESS_METHODS: tuple[CompressMethod, ...] = (
+    CompressMethod.not_compressed,
+    CompressMethod.tgz,
+    CompressMethod.txz,
+    CompressMethod.tzst,
+    CompressMethod.ptgz,
+)
+# 各压缩方法的默认压缩级别
+DEFAULT_COMPRESS_LEVELS: dict[CompressMethod, int] = {
+    CompressMethod.not_compressed: 0,
+    CompressMethod.zip: 9,
+    CompressMethod.tgz: 9,
+    CompressMethod.txz: 6,
+    CompressMethod.tzst: 3,
+    CompressMethod.ptgz: 6,
+}
+# 各压缩方法允许的压缩级别范围
+COMPRESS_LEVEL_RANGES: dict[CompressMethod, range] = {
+    CompressMethod.not_compressed: range(0, 1),
+    CompressMethod.zip: range(0, 10),
+    CompressMethod.tgz: range(0, 10),
+    CompressMethod.txz: range(0, 10),
+    CompressMethod.tzst: range(1, 23),
+    CompressMethod.ptgz: range(0, 10),
+}
+# 块并行gzip每个块的大小
+PARALLEL_GZIP_BLOCK_SIZE: int = 1024 * 1024
+# 自适应压缩：扩展名表明内容已经压缩过的文件
+INCOMPRESSIBLE_SUFFIXES: frozenset[str] = frozenset(
+    {
+        ".gz", ".tgz", ".bz2", ".xz", ".txz", ".zst", ".lz4", ".zip", ".7z", ".rar",
+        ".jpg", ".jpeg", ".png", ".gif", ".webp", ".jp2",
+        ".mp3", ".m4a", ".ogg", ".flac", ".mp4", ".m4v", ".mkv", ".mov", ".avi", ".webm",
+        ".npz",
+    }
+)  # fmt: skip
+# 自适应压缩：小于此大小的文件总是压缩，不值得采样
+ADAPTIVE_MIN_SIZE: int = 64 * 1024
+# 自适应压缩：从文件中间采样的字节数，用zlib最快级别试压缩
+ADAPTIVE_SAMPLE_SIZE: int = 64 * 1024
+# 自适应压缩：试压缩后大小超过原大小的这个比例，认为不可压缩
+ADAPTIVE_RATIO_THRESHOLD: float = 0.9
+# 不可压缩成员使用的压缩级别，gzip的0级只做存储；zstd会自动把不可压缩的数据存为原始块，1级最快
+STORE_COMPRESS_LEVELS: dict[CompressMethod, int] = {
+    CompressMethod.tgz: 0,
+    CompressMethod.ptgz: 0,
+    CompressMethod.tzst: 1,
+}
+
+
+def resolve_compress_threads(compress_threads: int | None) -> int:
+    cpu_count = os.cpu_count() or 1
+    return cpu_count if compress_threads is None else max(1, min(compress_threads, cpu_count))
+
+
+def is_incompressible(path: str | Path, size: int) -> bool:
+    """根据扩展名和采样试压缩判断文件是否已经压缩过"""
+    if os.path.splitext(path)[1].lower() in INCOMPRESSIBLE_SUFFIXES:
+        return True
+    if size < ADAPTIVE_MIN_SIZE:
+        return False
+    try:
+        with open(path, "rb") as file:
+            # 文件开头通常是可压缩的文件头，从中间采样
+            file.seek(max(0, size // 2 - ADAPTIVE_SAMPLE_SIZE // 2))
+            sample = file.read(ADAPTIVE_SAMPLE_SIZE)
+    except OSError:
+        return False
+    return len(zlib.compress(sample, 1)) > len(sample) * ADAPTIVE_RATIO_THRESHOLD
+
+
+class StoredXzWriter:
+    """写出不做压缩的xz流：LZMA2的未压缩块，加上xz的块头、索引和流尾
+
+    xz格式没有存储级别，lzma在不可压缩的数据上即使用0级也只有每秒几MB；多个xz流首尾相接仍然是合法的xz文件
+    """
+
+    # LZMA2未压缩块的最大长度
+    CHUNK_SIZE = 64 * 1024
+    # 流标志：校验方式为CRC32
+    STREAM_FLAGS = b"\x00\x01"
+
+    def __init__(self, fileobj: BinaryIO):
+        self.fileobj = fileobj
+        self.uncompressed_size = 0
+        self.compressed_size = 0
+        self.crc = 0
+        self.buffer = bytearray()
+        header_flags = self.STREAM_FLAGS + struct.pack("<I", zlib.crc32(self.STREAM_FLAGS))
+        self.fileobj.write(b"\xfd7zXZ\x00" + header_flags)
+        # 块头：头长度(12 / 4 - 1)、块标志(1个过滤器，不记录大小)、LZMA2过滤器(ID 0x21，属性1字节，字典4KiB)、填充
+        block_header = b"\x02\x00\x21\x01\x00\x00\x00\x00"
+        self.block_header = block_header + struct.pack("<I", zlib.crc32(block_header))
+        self.fileobj.write(self.block_header)
+
+    def write(self, data: bytes) -> int:
+        self.uncompressed_size += len(data)
+        self.crc = zlib.crc32(data, self.crc)
+        self.buffer += data
+        while len(self.buffer) >= self.CHUNK_SIZE:
+            self._write_chunk(bytes(self.buffer[: self.CHUNK_SIZE]))
+            del self.buffer[: self.CHUNK_SIZE]
+        return len(data)
+
+    def _write_chunk(self, chunk: bytes) -> None:
+        # 第一个块重置字典，之后的块不重置
+        control = b"\x01" if self.compressed_size == 0 else b"\x02"
+        self.fileobj.write(control + struct.pack(">H", len(chunk) - 1))
+        self.fileobj.write(chunk)
+        self.compressed_size += 3 + len(chunk)
+
+    def close(self) -> None:
+        if self.buffer:
+            self._write_chunk(bytes(self.buffer))
+            self.buffer.clear()
+        # LZMA2结束标记
+        self.fileobj.write(b"\x00")
+        self.compressed_size += 1
+        self.fileobj.write(b"\x00" * (-self.compressed_size % 4))
+        self.fileobj.write(struct.pack("<I", self.crc))
+
+        unpadded_size = len(self.block_header) + self.compressed_size + 4
+        index = b"\x00" + _encode_varint(1) + _encode_varint(unpadded_size) + _encode_varint(self.uncompressed_size)
+        index += b"\x00" * (-len(index) % 4)
+        index += struct.pack("<I", zlib.crc32(index))
+        self.fileobj.write(index)
+        footer = struct.pack("<I", len(index) // 4 - 1) + self.STREAM_FLAGS
+        self.fileobj.write(struct.pack("<I", zlib.crc32(footer)) + footer + b"YZ")
+
+
+def _encode_varint(value: int) -> bytes:
+    result = bytearray()
+    while value >= 0x80:
+        result.append(value & 0x7F | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+
+class AdaptiveWriter:
+    """按成员切换压缩方式：不可压缩的成员写成单独的存储流，可压缩的成员写成单独的压缩流
+
+    gzip的多个成员、xz和zstd的多个流/帧首尾相接都是合法的文件，解压时不需要任何特殊处理
+    """
+
+    def __init__(self, open_stream: Callable[[bool], ContextManager[BinaryIO]]):
+        self.open_stream = open_stream
+        self.exit_stack: ExitStack | None = None
+        self.writer: BinaryIO | None = None
+        self.incompressible = False
+
+    def set_incompressible(self, incompressible: bool) -> None:
+        if incompressible != self.incompressible:
+            self._close_stream()
+            self.incompressible = incompressible
+
+    def write(self, data: bytes) -> int:
+        if self.writer is None:
+            self.exit_stack = ExitStack()
+            self.writer = self.exit_stack.enter_context(self.open_stream(self.incompressible))
+        return self.writer.write(data)
+
+    def _close_stream(self) -> None:
+        if self.exit_stack is not None:
+            self.exit_stack.close()
+            self.exit_stack = None
+            self.writer = None
+
+    def close(self) -> None:
+        self._close_stream()
+
+
+class ParallelGzipWriter:
+    """块并行gzip：把输入切成固定大小的块，在线程池中分别压缩成独立的gzip成员，再按顺序写出
+
+    多个gzip成员首尾相接仍然是合法的gzip文件，zlib压缩时会释放GIL，所以可以利用多个CPU核
+    """
+
+    def __init__(self, fileobj: BinaryIO, compress_level: int, compress_threads: int):
+        self.fileobj = fileobj
+        self.compress_level = compress_level
+        self.default_level = compress_level
+        self.executor = ThreadPoolExecutor(max_workers=compress_threads, thread_name_prefix="gzip")
+        self.max_pending = compress_threads * 2
+        self.pending: deque[Future[bytes]] = deque()
+        self.buffer = bytearray()
+        self.written_blocks = 0
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        while len(self.buffer) >= PARALLEL_GZIP_BLOCK_SIZE:
+            self._submit(bytes(self.buffer[:PARALLEL_GZIP_BLOCK_SIZE]))
+            del self.buffer[:PARALLEL_GZIP_BLOCK_SIZE]
+        return len(data)
+
+    def set_incompressible(self, incompressible: bool) -> None:
+        """之后写入的数据使用0级（只存储）或原来的级别，切换前先把已有数据作为一个块提交"""
+        level = STORE_COMPRESS_LEVELS[CompressMethod.ptgz] if incompressible else self.default_level
+        if level != self.compress_level:
+            if self.buffer:
+                self._submit(bytes(self.buffer))
+                self.buffer.clear()
+            self.compress_level = level
+
+    def _submit(self, block: bytes) -> None:
+        self.pending.append(self.executor.submit(gzip.compress, block, self.compress_level, mtime=0))
+        self.written_blocks += 1
+        while len(self.pending) > self.max_pending:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def close(self) -> None:
+        try:
+            if self.buffer or self.written_blocks == 0:
+                self._submit(bytes(self.buffer))
+                self.buffer.clear()
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().result())
+        finally:
+            self.executor.shutdown(cancel_futures=True)
+
+
+@contextmanager
+def _open_single_writer(
+    fileobj: BinaryIO, compress_method: CompressMethod, compress_level: int, compress_threads: int | None
+) -> Iterator[BinaryIO]:
+    match compress_method:
+        case CompressMethod.not_compressed:
+            yield fileobj
+        case CompressMethod.tgz:
+            with gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=compress_level, mtime=0) as writer:
+                yield writer
+        case CompressMethod.txz:
+            with lzma.LZMAFile(fileobj, mode="wb", preset=compress_level) as writer:
+                yield writer
+        case CompressMethod.tzst:
+            compressor = zstandard.ZstdCompressor(
+                level=compress_level, threads=resolve_compress_threads(compress_threads)
+            )
+            with compressor.stream_writer(fileobj, closefd=False) as writer:
+                yield writer
+        case CompressMethod.ptgz:
+            writer = ParallelGzipWriter(fileobj, compress_level, resolve_compress_threads(compress_threads))
+            try:
+                yield writer
+            except BaseException:
+                writer.executor.shutdown(cancel_futures=True)
+                raise
+            writer.close()
+        case _:
+            raise ValueError(f"unsupported compress method: {compress_method}")
+
+
+@contextmanager
+def _open_stored_xz_writer(fileobj: BinaryIO) -> Iterator[BinaryIO]:
+    writer = StoredXzWriter(fileobj)
+    yield writer
+    writer.close()
+
+
+@contextmanager
+def open_compress_writer(
+    fileobj: BinaryIO,
+    compress_method: CompressMethod,
+    compress_level: int | None,
+    compress_threads: int | None,
+    adaptive: bool = False,
+) -> Iterator[BinaryIO]:
+    """返回写入时压缩的文件对象，tar包写入它之后需要退出上下文，才会写出压缩流的结尾
+
+    adaptive为True时，返回的对象有set_incompressible方法，用来在写入每个成员前切换是否压缩
+    """
+    if compress_level is None:
+        compress_level = DEFAULT_COMPRESS_LEVELS[compress_method]
+    if not adaptive or compress_method == CompressMethod.ptgz:
+        # 块并行gzip自己在块之间切换压缩级别
+        with _open_single_writer(fileobj, compress_method, compress_level, compress_threads) as writer:
+            yield writer
+        return
+
+    def open_stream(incompressible: bool) -> ContextManager[BinaryIO]:
+        if not incompressible:
+            return _open_single_writer(fileobj, compress_method, compress_level, compress_threads)
+        if compress_method == CompressMethod.txz:
+            return _open_stored_xz_writer(fileobj)
+        store_level = STORE_COMPRESS_LEVELS.get(compress_method, compress_level)
+        return _open_single_writer(fileobj, compress_method, store_level, compress_threads)
+
+    writer = AdaptiveWriter(open_stream)
+    yield writer
+    writer.close()
+
+
+@contextmanager
+def open_decompress_reader(fileobj: BinaryIO, compress_method: CompressMethod) -> Iterator[BinaryIO]:
+    """返回读取时解压的文件对象，只会顺序读取fileobj"""
+    match compress_method:
+        case CompressMethod.not_compressed:
+            yield fileobj
+        case CompressMethod.tgz | CompressMethod.ptgz:
+            # GzipFile可以读取多个成员组成的gzip文件
+            with gzip.GzipFile(fileobj=fileobj, mode="rb") as reader:
+                yield reader
+        case CompressMethod.txz:
+            with lzma.LZMAFile(fileobj, mode="rb") as reader:
+                yield reader
+        case CompressMethod.tzst:
+            decompressor = zstandard.ZstdDecompressor()
+            with decompressor.stream_reader(fileobj, read_across_frames=True, closefd=False) as reader:
+                yield reader
+        case _:
+            raise ValueError(f"unsupported compress method: {compress_method}")
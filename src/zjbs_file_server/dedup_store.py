@@ -0,0 +1,139 @@
+import os
+import stat
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from loguru import logger
+
+from zjbs_file_server.checksum import Checksums, checksum_store
+from zjbs_file_server.settings import settings
+
+
+class DedupStore:
+    """按内容的sha256保存文件的存储，用户可见的文件是指向存储中blob的硬链接
+
+    写入文件总是先写临时文件再os.replace，删除只是删除一个链接，所以覆盖和删除不会影响内容相同的其他文件；
+    链接不修改共享的inode，去重得到的文件的修改时间是内容第一次写入存储的时间；
+    只剩存储中一个链接的blob由后台线程定期删除
+    """
+
+    def __init__(self, store_dir: Path, enabled: bool, gc_interval: float):
+        self.store_dir = store_dir
+        self.enabled = enabled
+        self.gc_interval = gc_interval
+        self.lock = threading.Lock()
+        self.gc_started = False
+
+    def blob_path(self, sha256: str) -> Path:
+        return self.store_dir / sha256[:2] / sha256
+
+    def link_into(
+        self, file_path: Path | str, checksums: Checksums, target_path: Path | None = None, keep_mtime: bool = False
+    ) -> None:
+        """file_path是刚写入、还没有发布的文件；存储中没有相同内容时它成为blob，否则换成指向已有blob的链接
+
+        硬链接共享inode的权限和修改时间，只在共享不会改变文件应有的元数据时才换成链接：
+        keep_mtime为True时（解压得到的文件）要求blob的修改时间与文件相同；
+        否则文件将发布到target_path，要求不会让target_path已有文件的修改时间倒退
+        """
+        if not self.enabled:
+            return
+        self._start_gc()
+        file_path = Path(file_path)
+        blob_path = self.blob_path(checksums.sha256)
+        try:
+            blob_path.parent.mkdir(parents=True, exist_ok=True)
+            for _ in range(3):
+                try:
+                    with self.lock:
+                        os.link(file_path, blob_path)
+                    checksum_store.put(blob_path, checksums)
+                    return
+                except FileExistsError:
+                    pass
+                if (link_path := self.link_blob(checksums.sha256, file_path.parent)) is None:
+                    # blob刚好被回收，重新把文件存为blob
+                    continue
+                try:
+                    if self._can_share(file_path.stat(), link_path.stat(), target_path, keep_mtime):
+                        os.replace(link_path, file_path)
+                        logger.info(f"dedup store: reuse blob {checksums.sha256} for {file_path}")
+                finally:
+                    link_path.unlink(missing_ok=True)
+                return
+        except OSError as e:
+            # 通常是存储目录和文件目录不在同一个文件系统上，保留原文件
+            logger.warning(f"dedup store: link fail, keep file as is: {file_path}: {e}")
+
+    @staticmethod
+    def _can_share(
+        file_stat: os.stat_result, blob_stat: os.stat_result, target_path: Path | None, keep_mtime: bool
+    ) -> bool:
+        if stat.S_IMODE(file_stat.st_mode) != stat.S_IMODE(blob_stat.st_mode):
+            return False
+        if keep_mtime:
+            return file_stat.st_mtime_ns == blob_stat.st_mtime_ns
+        return target_path is None or DedupStore.keeps_target_mtime(blob_stat, target_path)
+
+    @staticmethod
+    def keeps_target_mtime(blob_stat: os.stat_result, target_path: Path) -> bool:
+        """覆盖已有文件时目标的修改时间不能倒退，否则按If-Modified-Since或修改时间判断的客户端会认为内容没有变化"""
+        try:
+            return blob_stat.st_mtime_ns >= os.stat(target_path).st_mtime_ns
+        except FileNotFoundError:
+            return True
+
+    def link_blob(self, sha256: str, directory: Path) -> Path | None:
+        """在directory中创建指向blob的临时链接，由调用方替换为目标文件；blob不存在时返回None
+
+        不修改blob的修改时间，那会同时改变所有内容相同的文件；与回收共用一个锁，回收检查链接数和删除之间不会新增链接
+        """
+        link_path = directory / f".{sha256}.{uuid.uuid4().hex}.link"
+        try:
+            with self.lock:
+                os.link(self.blob_path(sha256), link_path)
+        except FileNotFoundError:
+            return None
+        return link_path
+
+    def collect_garbage(self) -> int:
+        """删除没有其他链接的blob，返回删除的个数"""
+        removed = 0
+        if not self.store_dir.is_dir():
+            return removed
+        with self.lock, os.scandir(self.store_dir) as prefix_entries:
+            for prefix_entry in prefix_entries:
+                if not prefix_entry.is_dir(follow_symlinks=False):
+                    continue
+                with os.scandir(prefix_entry.path) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.stat(follow_symlinks=False).st_nlink == 1:
+                                os.unlink(entry.path)
+                                checksum_store.remove_tree(entry.path)
+                                removed += 1
+                        except FileNotFoundError:
+                            continue
+        if removed:
+            logger.info(f"dedup store: removed {removed} unreferenced blobs")
+        return removed
+
+    def _start_gc(self) -> None:
+        with self.lock:
+            if self.gc_started or self.gc_interval <= 0:
+                return
+            self.gc_started = True
+        threading.Thread(target=self._gc_loop, name="dedup-store-gc", daemon=True).start()
+
+    def _gc_loop(self) -> None:
+        while True:
+            time.sleep(self.gc_interval)
+            try:
+                self.collect_garbage()
+            except OSError:
+                logger.exception("dedup store: collect garbage error")
+
+
+dedup_store = DedupStore(settings.DEDUP_STORE_DIR, settings.DEDUP_ENABLED, settings.DEDUP_GC_INTERVAL)
@@ -0,0 +1,170 @@
+"""rsync式的增量上传
+
+1. 客户端获取服务器上旧文件的分块签名：每块的adler32弱校验值和16字节blake2b强校验值，最后一块可能不满一块
+2. 客户端用可滚动的adler32在新文件中逐字节查找与旧文件相同的块，发送增量指令：
+   b"C" + <QI>(起始块号, 块数)：复制旧文件中连续的块
+   b"L" + <I>(长度) + 数据：新数据
+   b"E" + 新文件的sha256（32字节）：结束
+3. 服务器按指令重建新文件到临时文件，校验sha256后替换旧文件
+"""
+
+import hashlib
+import math
+import os
+import struct
+import zlib
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import AsyncIterator, BinaryIO, Iterator
+
+from loguru import logger
+from starlette.responses import StreamingResponse
+
+from zjbs_file_server import stream_extract
+from zjbs_file_server.checksum import ChecksumWriter, checksum_store
+from zjbs_file_server.dedup_store import dedup_store
+from zjbs_file_server.file_response import file_etag
+from zjbs_file_server.listing_cache import listing_cache
+from zjbs_file_server.service import check_expected_sha256, remove_temp_file
+from zjbs_file_server.temp_space import temp_space
+from zjbs_file_server.types import AbsoluteUrlPath
+from zjbs_file_server.util import get_os_path, raise_bad_request, raise_not_found
+
+# 签名中每块的格式：adler32、blake2b
+SIGNATURE_STRUCT = struct.Struct("<I16s")
+STRONG_DIGEST_SIZE: int = 16
+MIN_BLOCK_SIZE: int = 4 * 1024
+MAX_BLOCK_SIZE: int = 16 * 1024 * 1024
+# 签名响应每次发送的块数
+SIGNATURE_BATCH: int = 4096
+# 复制旧文件时每次读取的最大字节数
+COPY_READ_SIZE: int = 4 * 1024 * 1024
+
+BLOCK_SIZE_HEADER: str = "X-Block-Size"
+FILE_SIZE_HEADER: str = "X-File-Size"
+
+_COPY_STRUCT = struct.Struct("<QI")
+_LITERAL_STRUCT = struct.Struct("<I")
+
+
+def choose_block_size(file_size: int) -> int:
+    """与rsync相同，块大小约为文件大小的平方根，取2的幂"""
+    block_size = 1 << max(0, math.ceil(math.log2(max(1.0, math.sqrt(file_size)))))
+    return min(max(block_size, MIN_BLOCK_SIZE), MAX_BLOCK_SIZE)
+
+
+def block_signature(block: bytes) -> bytes:
+    return SIGNATURE_STRUCT.pack(zlib.adler32(block), hashlib.blake2b(block, digest_size=STRONG_DIGEST_SIZE).digest())
+
+
+def iter_signature(file: BinaryIO, block_size: int) -> Iterator[bytes]:
+    with file:
+        batch = []
+        while block := file.read(block_size):
+            batch.append(block_signature(block))
+            if len(batch) >= SIGNATURE_BATCH:
+                yield b"".join(batch)
+                batch.clear()
+        if batch:
+            yield b"".join(batch)
+
+
+def signature_response(path: AbsoluteUrlPath, block_size: int | None) -> StreamingResponse:
+    file_path = get_os_path(path)
+    if not file_path.is_file():
+        logger.error(f"delta signature fail: not a file: {file_path}")
+        raise_not_found(path)
+    if block_size is not None and not MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE:
+        logger.error(f"delta signature fail: invalid block size: {block_size}")
+        raise_bad_request(f"block_size must be between {MIN_BLOCK_SIZE} and {MAX_BLOCK_SIZE}")
+
+    file = open(file_path, "rb")
+    stat_result = os.fstat(file.fileno())
+    block_size = block_size or choose_block_size(stat_result.st_size)
+    headers = {
+        BLOCK_SIZE_HEADER: str(block_size),
+        FILE_SIZE_HEADER: str(stat_result.st_size),
+        # 上传增量时用ETag确认旧文件没有变化
+        "etag": file_etag(stat_result),
+    }
+    logger.info(f"delta signature: {file_path}, {block_size=}")
+    return StreamingResponse(iter_signature(file, block_size), media_type="application/octet-stream", headers=headers)
+
+
+def _read_exact(reader: BinaryIO, size: int) -> bytes:
+    data = reader.read(size)
+    if len(data) != size:
+        logger.error("delta upload fail: truncated delta")
+        raise_bad_request("truncated delta")
+    return data
+
+
+def apply_delta(reader: BinaryIO, base_file: BinaryIO, block_size: int, writer: ChecksumWriter) -> str:
+    """按增量指令把新文件写入writer，返回客户端计算的新文件的sha256"""
+    base_fd = base_file.fileno()
+    base_size = os.fstat(base_fd).st_size
+    while True:
+        match reader.read(1):
+            case b"C":
+                start, count = _COPY_STRUCT.unpack(_read_exact(reader, _COPY_STRUCT.size))
+                offset, end = start * block_size, min((start + count) * block_size, base_size)
+                if count == 0 or offset >= base_size:
+                    logger.error(f"delta upload fail: invalid block reference: {start}, {count}")
+                    raise_bad_request(f"invalid block reference: {start}, {count}")
+                while offset < end:
+                    data = os.pread(base_fd, min(COPY_READ_SIZE, end - offset), offset)
+                    if not data:
+                        raise_bad_request("base file changed")
+                    writer.write(data)
+                    offset += len(data)
+            case b"L":
+                (remaining,) = _LITERAL_STRUCT.unpack(_read_exact(reader, _LITERAL_STRUCT.size))
+                while remaining > 0:
+                    data = _read_exact(reader, min(COPY_READ_SIZE, remaining))
+                    writer.write(data)
+                    remaining -= len(data)
+            case b"E":
+                return _read_exact(reader, 32).hex()
+            case _:
+                logger.error("delta upload fail: invalid instruction")
+                raise_bad_request("invalid delta instruction")
+
+
+def apply_delta_upload(reader: BinaryIO, target_path: Path, base_etag: str, block_size: int) -> None:
+    """旧文件在获取签名之后被修改时拒绝上传；重建的文件写入同一文件夹中的临时文件，校验后替换旧文件"""
+    tmp_path = None
+    record_path = None
+    try:
+        with open(target_path, "rb") as base_file:
+            if file_etag(os.fstat(base_file.fileno())) != base_etag:
+                logger.error(f"delta upload fail: base file changed: {target_path}")
+                raise_bad_request("base file changed since signature")
+            with NamedTemporaryFile(delete=False, dir=target_path.parent, prefix=target_path.name) as tmp_file:
+                tmp_path = tmp_file.name
+                record_path = temp_space.track(Path(tmp_path))
+                writer = ChecksumWriter(tmp_file)
+                expected_sha256 = apply_delta(reader, base_file, block_size, writer)
+        checksums = writer.checksums()
+        check_expected_sha256(target_path, checksums, expected_sha256)
+        dedup_store.link_into(tmp_path, checksums, target_path)
+        os.replace(tmp_path, target_path)
+        checksum_store.put(target_path, checksums)
+        listing_cache.invalidate(target_path.parent)
+        logger.info(f"delta upload success: {target_path}")
+    except OSError:
+        logger.exception(f"delta upload fail: system error: {target_path}")
+        raise
+    finally:
+        remove_temp_file(tmp_path)
+        temp_space.untrack(record_path)
+
+
+async def upload_delta(path: AbsoluteUrlPath, chunks: AsyncIterator[bytes], base_etag: str, block_size: int) -> None:
+    target_path = get_os_path(path)
+    if not target_path.is_file():
+        logger.error(f"delta upload fail: not a file: {target_path}")
+        raise_not_found(path)
+    if not MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE:
+        logger.error(f"delta upload fail: invalid block size: {block_size}")
+        raise_bad_request(f"block_size must be between {MIN_BLOCK_SIZE} and {MAX_BLOCK_SIZE}")
+    await stream_extract.consume_in_thread(chunks, apply_delta_upload, target_path, base_etag, block_size)
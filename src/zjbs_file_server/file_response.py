@@ -0,0 +1,291 @@
+import os
+import re
+import stat
+import uuid
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+
+import anyio
+from fastapi.responses import FileResponse
+from starlette.datastructures import Headers
+from starlette.responses import StreamingResponse
+from starlette.status import HTTP_206_PARTIAL_CONTENT, HTTP_304_NOT_MODIFIED, HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+from starlette.types import Receive, Scope, Send
+
+from zjbs_file_server.response_compression import choose_encoding
+from zjbs_file_server.settings import settings
+
+# 单个请求最多允许的范围数，超过则忽略Range头，返回完整文件
+MAX_RANGES: int = 64
+
+# 服务器支持时由服务器直接发送文件的ASGI扩展，服务器可以用sendfile发送，内容不经过Python
+PATHSEND_EXTENSION: str = "http.response.pathsend"
+
+# 304响应中保留的响应头
+NOT_MODIFIED_HEADERS: tuple[str, ...] = ("etag", "last-modified", "cache-control", "expires", "vary")
+
+_RANGE_SPEC_PATTERN = re.compile(r"^(\d*)-(\d*)$")
+
+
+def file_etag(stat_result: os.stat_result) -> str:
+    """由inode、大小和修改时间组成的强ETag，文件被修改或替换时必然变化"""
+    return f'"{stat_result.st_ino:x}-{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+def is_not_modified(request_headers: Headers, etag: str | None, last_modified: str | None) -> bool:
+    """检查If-None-Match和If-Modified-Since，两者都有时只看If-None-Match
+
+    If-None-Match使用弱比较；下载接口虽然是POST，但不修改文件，同样按GET处理条件请求
+    """
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        if etag is None:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return etag.removeprefix("W/") in tags
+
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        # 无法解析的日期忽略
+        return False
+
+
+async def send_not_modified(send: Send, response_headers: Headers) -> None:
+    headers = [(key, value) for key, value in response_headers.raw if key.decode("latin-1") in NOT_MODIFIED_HEADERS]
+    await send({"type": "http.response.start", "status": HTTP_304_NOT_MODIFIED, "headers": headers})
+    await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def parse_range_header(range_header: str, file_size: int) -> list[tuple[int, int]] | None:
+    """解析Range头，返回合并后的[start, end)范围列表
+
+    格式错误或单位不是bytes时返回None，表示忽略该头；所有范围都无法满足时返回空列表
+    """
+    unit, _, range_set = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or not range_set.strip():
+        return None
+
+    ranges = []
+    for spec in range_set.split(","):
+        match = _RANGE_SPEC_PATTERN.match(spec.strip())
+        if match is None:
+            return None
+        first, last = match.groups()
+        if not first and not last:
+            return None
+        if not first:
+            # 后缀范围：最后N个字节
+            suffix_length = int(last)
+            if suffix_length > 0 and file_size > 0:
+                ranges.append((max(file_size - suffix_length, 0), file_size))
+            continue
+        start = int(first)
+        end = file_size if not last else int(last) + 1
+        if last and end <= start:
+            return None
+        if start < file_size:
+            ranges.append((start, min(end, file_size)))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+    ranges.sort()
+    merged: list[tuple[int, int]] = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class RangeFileResponse(FileResponse):
+    """支持Range、If-Range和multipart/byteranges的文件响应
+
+    precompressed为各个编码的预压缩文件路径，没有Range头的请求如果接受对应编码，发送存在且不早于原文件的预压缩文件；
+    服务器支持http.response.pathsend扩展时，整个文件由服务器发送，否则按块读取后发送。
+    有background的响应（如发送后删除的缓存硬链接）按块发送，保证background执行时服务器已经读完文件
+    """
+
+    # 较大的块可以减少读文件和发送消息的次数
+    chunk_size = 1024 * 1024
+
+    def __init__(self, *args, precompressed: dict[str, Path] | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.precompressed = precompressed or {}
+
+    def set_stat_headers(self, stat_result: os.stat_result) -> None:
+        # 调用方可以通过headers传入内容哈希等其他ETag
+        self.headers.setdefault("etag", file_etag(stat_result))
+        self.headers.setdefault("last-modified", formatdate(stat_result.st_mtime, usegmt=True))
+        self.headers.setdefault("content-length", str(stat_result.st_size))
+        self.headers["accept-ranges"] = "bytes"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if self.stat_result is None:
+            try:
+                self.stat_result = await anyio.to_thread.run_sync(os.stat, self.path)
+            except FileNotFoundError:
+                raise RuntimeError(f"File at path {self.path} does not exist.")
+            if not stat.S_ISREG(self.stat_result.st_mode):
+                raise RuntimeError(f"File at path {self.path} is not a file.")
+            self.set_stat_headers(self.stat_result)
+        if scope.get("method") == "HEAD":
+            self.send_header_only = True
+
+        request_headers = Headers(scope=scope)
+        if self.precompressed and self.status_code == 200 and "range" not in request_headers:
+            await self._select_precompressed(request_headers.get("accept-encoding"))
+
+        file_size = self.stat_result.st_size
+        if self.status_code == 200 and is_not_modified(
+            request_headers, self.headers.get("etag"), self.headers.get("last-modified")
+        ):
+            await send_not_modified(send, self.headers)
+            if self.background is not None:
+                await self.background()
+            return
+
+        ranges = None
+        if self.status_code == 200 and "range" in request_headers and self._if_range_matches(request_headers):
+            ranges = parse_range_header(request_headers["range"], file_size)
+
+        if ranges is None:
+            pathsend = (
+                settings.FILE_PATHSEND
+                and PATHSEND_EXTENSION in (scope.get("extensions") or {})
+                and self.background is None
+            )
+            await self._send_ranges(send, None, file_size, pathsend)
+        elif not ranges:
+            await self._send_not_satisfiable(send, file_size)
+        else:
+            await self._send_ranges(send, ranges, file_size)
+
+        if self.background is not None:
+            await self.background()
+
+    def _stat_precompressed(self) -> dict[str, tuple[Path, os.stat_result]]:
+        """修改时间不早于原文件的预压缩文件，过期的预压缩文件不使用"""
+        variants = {}
+        for encoding, path in self.precompressed.items():
+            try:
+                stat_result = os.stat(path)
+            except OSError:
+                continue
+            if stat.S_ISREG(stat_result.st_mode) and stat_result.st_mtime_ns >= self.stat_result.st_mtime_ns:
+                variants[encoding] = (path, stat_result)
+        return variants
+
+    async def _select_precompressed(self, accept_encoding: str | None) -> None:
+        variants = await anyio.to_thread.run_sync(self._stat_precompressed)
+        if not variants:
+            return
+        self.headers.add_vary_header("Accept-Encoding")
+        if (encoding := choose_encoding(accept_encoding, variants)) is None:
+            return
+        self.path, self.stat_result = variants[encoding]
+        self.headers["content-length"] = str(self.stat_result.st_size)
+        self.headers["content-encoding"] = encoding
+        # 不同编码的内容不同，ETag也要不同；Repr-Digest描述的是未压缩的内容
+        if (etag := self.headers.get("etag")) is not None and etag.endswith('"'):
+            self.headers["etag"] = f'{etag[:-1]}-{encoding}"'
+        del self.headers["repr-digest"]
+
+    def _if_range_matches(self, request_headers: Headers) -> bool:
+        if_range = request_headers.get("if-range")
+        if if_range is None:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith(("W/", '"')):
+            # If-Range要求强比较，弱ETag永远不匹配
+            return if_range == self.headers.get("etag")
+        return if_range == self.headers.get("last-modified")
+
+    async def _send_not_satisfiable(self, send: Send, file_size: int) -> None:
+        headers = Headers(raw=self.raw_headers).mutablecopy()
+        headers["content-range"] = f"bytes */{file_size}"
+        headers["content-length"] = "0"
+        del headers["content-disposition"]
+        await send(
+            {"type": "http.response.start", "status": HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, "headers": headers.raw}
+        )
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def _send_ranges(
+        self, send: Send, ranges: list[tuple[int, int]] | None, file_size: int, pathsend: bool = False
+    ) -> None:
+        headers = Headers(raw=self.raw_headers).mutablecopy()
+        status_code = self.status_code
+        parts: list[tuple[bytes, int, int]] = []
+        closing = b""
+        if ranges is None:
+            parts.append((b"", 0, file_size))
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            status_code = HTTP_206_PARTIAL_CONTENT
+            headers["content-range"] = f"bytes {start}-{end - 1}/{file_size}"
+            headers["content-length"] = str(end - start)
+            parts.append((b"", start, end))
+        else:
+            status_code = HTTP_206_PARTIAL_CONTENT
+            boundary = uuid.uuid4().hex
+            headers["content-type"] = f"multipart/byteranges; boundary={boundary}"
+            for start, end in ranges:
+                part_header = (
+                    f"--{boundary}\r\n"
+                    f"Content-Type: {self.media_type}\r\n"
+                    f"Content-Range: bytes {start}-{end - 1}/{file_size}\r\n\r\n"
+                ).encode("latin-1")
+                # 除第一个分段外，每个分段前都要有CRLF
+                parts.append(((b"\r\n" if parts else b"") + part_header, start, end))
+            closing = f"\r\n--{boundary}--\r\n".encode("latin-1")
+            content_length = sum(len(header) + end - start for header, start, end in parts) + len(closing)
+            headers["content-length"] = str(content_length)
+
+        await send({"type": "http.response.start", "status": status_code, "headers": headers.raw})
+        if self.send_header_only:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        if pathsend:
+            await send({"type": PATHSEND_EXTENSION, "path": os.path.abspath(self.path)})
+            return
+        await self._send_chunks(send, parts, closing)
+
+    async def _send_chunks(self, send: Send, parts: list[tuple[bytes, int, int]], closing: bytes) -> None:
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            for part_header, start, end in parts:
+                if part_header:
+                    await send({"type": "http.response.body", "body": part_header, "more_body": True})
+                await file.seek(start)
+                remaining = end - start
+                while remaining > 0:
+                    chunk = await file.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": closing, "more_body": False})
+
+
+class ConditionalStreamingResponse(StreamingResponse):
+    """支持If-None-Match和If-Modified-Since的流式响应，ETag和Last-Modified由调用方设置
+
+    返回304时不会开始迭代body_iterator，生成数据的工作不会执行
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if self.status_code == 200 and is_not_modified(
+            Headers(scope=scope), self.headers.get("etag"), self.headers.get("last-modified")
+        ):
+            await send_not_modified(send, self.headers)
+            if self.background is not None:
+                await self.background()
+            return
+        await super().__call__(scope, receive, send)
@@ -0,0 +1,205 @@
+import base64
+import heapq
+import json
+import os
+from datetime import datetime, timezone
+from fnmatch import fnmatchcase
+from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple
+
+from loguru import logger
+from starlette.responses import StreamingResponse
+
+from zjbs_file_server.types import FileSystemInfo, FileTreeInfo, FileType, ListSortKey
+from zjbs_file_server.util import raise_bad_request
+
+# 流式列表的响应类型，每行一个FileSystemInfo的JSON
+NDJSON_MEDIA_TYPE: str = "application/x-ndjson"
+# 下一页游标所在的响应头，没有下一页时不返回
+NEXT_CURSOR_HEADER: str = "X-Next-Cursor"
+
+
+class ListEntry(NamedTuple):
+    """文件夹中的一项，比FileSystemInfo轻量，排序和分页时只保存这些字段"""
+
+    name: str
+    type: FileType
+    mtime: float
+    size: int | None
+
+    @property
+    def last_modified(self) -> datetime:
+        """带时区的UTC时间，客户端不需要与服务器使用相同的时区"""
+        return datetime.fromtimestamp(self.mtime, timezone.utc)
+
+    def to_info(self) -> FileSystemInfo:
+        return FileSystemInfo(type=self.type, name=self.name, last_modified=self.last_modified, size=self.size)
+
+    def to_tree_info(self, path: str) -> FileTreeInfo:
+        return FileTreeInfo(path=path, type=self.type, name=self.name, last_modified=self.last_modified, size=self.size)
+
+
+def entry_info(entry: os.DirEntry, follow_symlinks: bool, name: str) -> tuple[ListEntry, os.stat_result] | None:
+    """目录项的类型来自d_type，只在需要时stat一次；不跟随时符号链接本身作为symlink列出，修改时间来自lstat；
+    跟随时失效的符号链接，以及特殊文件等返回None
+    """
+    try:
+        if not follow_symlinks and entry.is_symlink():
+            stat_result = entry.stat(follow_symlinks=False)
+            return ListEntry(name, FileType.symlink, stat_result.st_mtime, None), stat_result
+        if entry.is_dir(follow_symlinks=follow_symlinks):
+            file_type = FileType.directory
+        elif entry.is_file(follow_symlinks=follow_symlinks):
+            file_type = FileType.file
+        else:
+            return None
+        stat_result = entry.stat(follow_symlinks=follow_symlinks)
+    except FileNotFoundError:
+        # 遍历期间被删除的文件或失效的符号链接
+        return None
+    size = stat_result.st_size if file_type == FileType.file else None
+    return ListEntry(name, file_type, stat_result.st_mtime, size), stat_result
+
+
+def scan_directory(directory: Path, follow_symlinks: bool) -> Iterator[ListEntry]:
+    """用os.scandir遍历文件夹，文件类型来自目录项自带的d_type，每项最多一次stat"""
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            # 跟随符号链接时显示链接目标的名字
+            is_symlink = entry.is_symlink()
+            name = os.path.basename(os.path.realpath(entry.path)) if is_symlink and follow_symlinks else entry.name
+            if (info := entry_info(entry, follow_symlinks, name)) is not None:
+                yield info[0]
+
+
+def match_any(name: str, relative_path: str, patterns: list[str]) -> bool:
+    """通配符可以匹配文件名，也可以匹配相对路径"""
+    return any(fnmatchcase(name, pattern) or fnmatchcase(relative_path, pattern) for pattern in patterns)
+
+
+def walk_directory(
+    root: Path, max_depth: int | None, include: list[str], exclude: list[str], follow_symlinks: bool
+) -> Iterator[tuple[str, ListEntry]]:
+    """深度优先遍历文件树，边遍历边产出(相对路径, 文件信息)
+
+    根文件夹中的项深度为1；被exclude匹配的文件夹不会进入；指定include时只产出匹配的项，但仍会进入所有文件夹；
+    跟随符号链接时记录已进入文件夹的(st_dev, st_ino)，避免循环
+    """
+    root_stat = os.stat(root)
+    visited = {(root_stat.st_dev, root_stat.st_ino)}
+    stack: list[tuple[str, str, int]] = [(str(root), "", 1)]
+    while stack:
+        directory, prefix, depth = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                sub_directories = []
+                for entry in entries:
+                    relative_path = prefix + entry.name
+                    if exclude and match_any(entry.name, relative_path, exclude):
+                        continue
+                    if (info := entry_info(entry, follow_symlinks, entry.name)) is None:
+                        continue
+                    list_entry, stat_result = info
+                    if not include or match_any(entry.name, relative_path, include):
+                        yield relative_path, list_entry
+                    if list_entry.type == FileType.directory and (max_depth is None or depth < max_depth):
+                        if follow_symlinks:
+                            if (stat_result.st_dev, stat_result.st_ino) in visited:
+                                continue
+                            visited.add((stat_result.st_dev, stat_result.st_ino))
+                        sub_directories.append((entry.path, relative_path + "/", depth + 1))
+        except (PermissionError, FileNotFoundError, NotADirectoryError) as e:
+            logger.warning(f"walk_directory: skip directory {directory}: {e}")
+            continue
+        # 逆序入栈，按扫描顺序进入子文件夹
+        stack.extend(reversed(sub_directories))
+
+
+def filter_entries(
+    entries: Iterable[ListEntry], name_pattern: str | None, file_type: FileType | None
+) -> Iterator[ListEntry]:
+    for entry in entries:
+        if file_type is not None and entry.type != file_type:
+            continue
+        if name_pattern is not None and not fnmatchcase(entry.name, name_pattern):
+            continue
+        yield entry
+
+
+def sort_value(entry: ListEntry, sort: ListSortKey) -> tuple:
+    """排序键，值相同时按文件名排序，保证分页游标唯一"""
+    match sort:
+        case ListSortKey.name:
+            return (entry.name,)
+        case ListSortKey.last_modified:
+            return entry.mtime, entry.name
+        case ListSortKey.size:
+            # 文件夹没有大小，排在所有文件之前
+            return -1 if entry.size is None else entry.size, entry.name
+        case ListSortKey.type:
+            return entry.type.value, entry.name
+
+
+# 各排序字段的排序键中每个元素的类型，用来校验游标
+SORT_VALUE_TYPES: dict[ListSortKey, tuple[type | tuple[type, ...], ...]] = {
+    ListSortKey.name: (str,),
+    ListSortKey.last_modified: ((int, float), str),
+    ListSortKey.size: (int, str),
+    ListSortKey.type: (str, str),
+}
+
+
+def encode_cursor(sort: ListSortKey, reverse: bool, value: tuple) -> str:
+    data = json.dumps([sort.value, reverse, list(value)], ensure_ascii=False)
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_cursor(cursor: str, sort: ListSortKey, reverse: bool) -> tuple:
+    try:
+        cursor_sort, cursor_reverse, value = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        logger.error(f"list_directory fail: invalid cursor: {cursor}")
+        raise_bad_request("invalid cursor")
+    if cursor_sort != sort.value or cursor_reverse != reverse:
+        logger.error(f"list_directory fail: cursor does not match sort: {cursor}")
+        raise_bad_request("cursor does not match sort and reverse")
+    value_types = SORT_VALUE_TYPES[sort]
+    if (
+        not isinstance(value, list)
+        or len(value) != len(value_types)
+        or not all(isinstance(item, item_type) for item, item_type in zip(value, value_types))
+    ):
+        logger.error(f"list_directory fail: invalid cursor: {cursor}")
+        raise_bad_request("invalid cursor")
+    return tuple(value)
+
+
+def page_entries(
+    entries: Iterable[ListEntry], sort: ListSortKey, reverse: bool, limit: int | None, cursor: str | None
+) -> tuple[list[ListEntry], str | None]:
+    """按排序键取游标之后的一页，返回这一页和下一页的游标
+
+    有limit时用堆只保留limit + 1项，内存占用与文件夹大小无关
+    """
+
+    def key(entry: ListEntry) -> tuple:
+        return sort_value(entry, sort)
+
+    if cursor is not None:
+        after = decode_cursor(cursor, sort, reverse)
+        entries = (entry for entry in entries if (key(entry) < after if reverse else key(entry) > after))
+    if limit is None:
+        return sorted(entries, key=key, reverse=reverse), None
+
+    select = heapq.nlargest if reverse else heapq.nsmallest
+    page = select(limit + 1, entries, key=key)
+    if len(page) <= limit:
+        return page, None
+    page = page[:limit]
+    return page, encode_cursor(sort, reverse, key(page[-1]))
+
+
+def ndjson_response(infos: Iterable[FileSystemInfo], next_cursor: str | None) -> StreamingResponse:
+    lines = (info.model_dump_json() + "\n" for info in infos)
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor is not None else None
+    return StreamingResponse(lines, media_type=NDJSON_MEDIA_TYPE, headers=headers)
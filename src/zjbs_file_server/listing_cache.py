@@ -0,0 +1,292 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from loguru import logger
+
+from zjbs_file_server.listing import ListEntry
+from zjbs_file_server.settings import settings
+
+# inotify事件掩码，见<sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MODIFY = 0x00000002
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+WATCH_MASK = (
+    IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MODIFY
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+)
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """通过ctypes调用libc的inotify，只在Linux上可用"""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path: str) -> int:
+        wd = self._add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed: {path}")
+        return wd
+
+    def rm_watch(self, wd: int) -> None:
+        self._rm_watch(self.fd, wd)
+
+    def read_events(self, timeout: float) -> list[tuple[int, int]]:
+        """等待并读取事件，返回(wd, mask)列表"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _, name_length = _EVENT_HEADER.unpack_from(data, offset)
+            events.append((wd, mask))
+            offset += _EVENT_HEADER.size + name_length
+        return events
+
+
+def open_inotify() -> Inotify | None:
+    try:
+        return Inotify()
+    except (OSError, AttributeError, TypeError):
+        logger.warning("listing cache: inotify not available, fall back to mtime check")
+        return None
+
+
+class CachedListing:
+    def __init__(self, entries: tuple[ListEntry, ...], mtime_ns: int, wd: int | None):
+        self.entries = entries
+        self.mtime_ns = mtime_ns
+        self.wd = wd
+        self.cached_at = time.monotonic()
+
+
+class ListingCache:
+    """进程内的文件夹列表缓存，按解析后的路径和是否跟随符号链接区分，按总项数做LRU淘汰
+
+    有inotify时由监视事件失效；没有inotify或添加监视失败时，文件夹的mtime不变且缓存未超过ttl秒才有效，
+    因为文件夹的mtime不反映其中文件大小和修改时间的变化
+    """
+
+    def __init__(self, max_entries: int, ttl: float, use_inotify: bool = True):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.use_inotify = use_inotify
+        self.lock = threading.Lock()
+        self.listings: OrderedDict[tuple[str, bool], CachedListing] = OrderedDict()
+        self.total_entries = 0
+        # 正在扫描的路径的失效次数和扫描数，扫描前后失效次数不一致说明扫描期间发生了变化，结果不能缓存
+        self.generations: dict[str, int] = {}
+        self.scan_counts: dict[str, int] = {}
+        self.inotify: Inotify | None = None
+        self.inotify_started = False
+        self.watches: dict[int, str] = {}
+        self.watch_paths: dict[str, int] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, directory: Path, follow_symlinks: bool) -> tuple[ListEntry, ...] | None:
+        path = str(directory)
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        with self.lock:
+            listing = self.listings.get((path, follow_symlinks))
+            if listing is None:
+                return None
+            expired = listing.wd is None and time.monotonic() - listing.cached_at > self.ttl
+            if listing.mtime_ns != mtime_ns or expired:
+                self._remove((path, follow_symlinks))
+                return None
+            self.listings.move_to_end((path, follow_symlinks))
+            return listing.entries
+
+    def iter_and_store(
+        self, directory: Path, follow_symlinks: bool, entries: Iterable[ListEntry]
+    ) -> Iterator[ListEntry]:
+        """边产出边收集，全部产出且扫描期间文件夹没有变化时存入缓存"""
+        path = str(directory)
+        with self.lock:
+            self.scan_counts[path] = self.scan_counts.get(path, 0) + 1
+            generation = self.generations.setdefault(path, 0)
+        stored = False
+        try:
+            # 先添加监视再扫描，扫描期间的变化会使generation增加
+            wd = self._watch(path)
+            mtime_ns = os.stat(path).st_mtime_ns
+            collected: list[ListEntry] | None = []
+            for entry in entries:
+                if collected is not None:
+                    collected.append(entry)
+                    if len(collected) > self.max_entries:
+                        collected = None
+                yield entry
+            if collected is not None:
+                stored = self._store(path, follow_symlinks, collected, mtime_ns, wd, generation)
+        finally:
+            with self.lock:
+                self.scan_counts[path] -= 1
+                if self.scan_counts[path] == 0:
+                    del self.scan_counts[path]
+                    del self.generations[path]
+                if not stored:
+                    self._release_watch(path)
+
+    def _store(
+        self, path: str, follow_symlinks: bool, entries: list[ListEntry], mtime_ns: int, wd: int | None, generation: int
+    ) -> bool:
+        with self.lock:
+            if self.generations[path] != generation:
+                return False
+            key = (path, follow_symlinks)
+            self._remove(key)
+            self.listings[key] = CachedListing(tuple(entries), mtime_ns, wd)
+            self.total_entries += len(entries)
+            while self.total_entries > self.max_entries:
+                self._remove(next(iter(self.listings)))
+            return key in self.listings
+
+    def invalidate(self, path: Path | str) -> None:
+        """文件夹中的内容发生变化：使文件夹和它的上级文件夹的列表失效"""
+        path = os.path.realpath(path)
+        with self.lock:
+            self._invalidate_path(path)
+            self._invalidate_path(os.path.dirname(path))
+
+    def invalidate_tree(self, path: Path | str) -> None:
+        """文件夹被删除、移动或批量写入：使它自己、所有子文件夹和上级文件夹的列表失效"""
+        path = os.path.realpath(path)
+        prefix = path.rstrip(os.sep) + os.sep
+        with self.lock:
+            for cached_path in {key[0] for key in self.listings} | set(self.generations):
+                if cached_path == path or cached_path.startswith(prefix):
+                    self._invalidate_path(cached_path)
+            self._invalidate_path(path)
+            self._invalidate_path(os.path.dirname(path))
+
+    def clear(self) -> None:
+        with self.lock:
+            for path in {key[0] for key in self.listings}:
+                self._invalidate_path(path)
+
+    def _invalidate_path(self, path: str) -> None:
+        if path in self.generations:
+            self.generations[path] += 1
+        for follow_symlinks in (True, False):
+            self._remove((path, follow_symlinks))
+
+    def _remove(self, key: tuple[str, bool]) -> None:
+        listing = self.listings.pop(key, None)
+        if listing is None:
+            return
+        self.total_entries -= len(listing.entries)
+        self._release_watch(key[0])
+
+    def _release_watch(self, path: str) -> None:
+        """没有缓存再使用文件夹的监视时移除监视"""
+        if path in self.scan_counts or any((path, follow) in self.listings for follow in (True, False)):
+            return
+        if (wd := self.watch_paths.pop(path, None)) is not None:
+            self.watches.pop(wd, None)
+            self.inotify.rm_watch(wd)
+
+    def _watch(self, path: str) -> int | None:
+        inotify = self._get_inotify()
+        if inotify is None:
+            return None
+        with self.lock:
+            if (wd := self.watch_paths.get(path)) is not None:
+                return wd
+        try:
+            wd = inotify.add_watch(path)
+        except OSError as e:
+            # 通常是超过了fs.inotify.max_user_watches
+            logger.warning(f"listing cache: add inotify watch fail: {e}")
+            return None
+        with self.lock:
+            self.watches[wd] = path
+            self.watch_paths[path] = wd
+        return wd
+
+    def _get_inotify(self) -> Inotify | None:
+        if not self.use_inotify:
+            return None
+        with self.lock:
+            if not self.inotify_started:
+                self.inotify_started = True
+                self.inotify = open_inotify()
+                if self.inotify is not None:
+                    threading.Thread(target=self._watch_events, name="listing-cache-inotify", daemon=True).start()
+            return self.inotify
+
+    def _watch_events(self) -> None:
+        while True:
+            try:
+                events = self.inotify.read_events(timeout=1)
+            except OSError:
+                logger.exception("listing cache: read inotify events error")
+                time.sleep(1)
+                continue
+            if not events:
+                continue
+            with self.lock:
+                for wd, mask in events:
+                    if mask & IN_Q_OVERFLOW:
+                        # 事件队列溢出，丢失了事件，清空缓存
+                        for path in {key[0] for key in self.listings}:
+                            self._invalidate_path(path)
+                        continue
+                    path = self.watches.get(wd)
+                    if path is None:
+                        continue
+                    if mask & IN_IGNORED:
+                        # 监视已被内核移除，例如文件夹被删除
+                        self.watches.pop(wd, None)
+                        self.watch_paths.pop(path, None)
+                    self._invalidate_path(path)
+
+
+listing_cache = ListingCache(settings.LISTING_CACHE_MAX_ENTRIES, settings.LISTING_CACHE_TTL)
@@ -2,14 +2,16 @@ import sys
 from typing import Never
 
 from fastapi import FastAPI, HTTPException
-from fastapi.middleware.gzip import GZipMiddleware
 from loguru import logger
 from starlette.requests import Request
-from starlette.responses import RedirectResponse
+from starlette.responses import RedirectResponse, Response
 
+from zjbs_file_server import metrics
 from zjbs_file_server.api import router as api_router
+from zjbs_file_server.response_compression import CompressionMiddleware
 from zjbs_file_server.restful_api import router as restful_api_router
 from zjbs_file_server.settings import settings
+from zjbs_file_server.temp_space import temp_space
 from zjbs_file_server.util import raise_internal_server_error, raise_not_found
 
 # 配置日志
@@ -28,9 +30,15 @@ logger.add(settings.LOG_DIR / "error.log", **(log_config | {"level": "ERROR", "b
 if settings.DEBUG_MODE:
     logger.add(sys.stderr, level="TRACE", backtrace=True, diagnose=True, enqueue=True, format=LOG_FORMAT)
 
+
 # 配置服务器
 app = FastAPI(title="Zhejiang Brain Science Platform File Service", description="之江实验室 Brain Science 平台文件服务")
-app.add_middleware(GZipMiddleware, minimum_size=1024)
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=settings.RESPONSE_COMPRESSION_MIN_SIZE,
+    encodings=settings.RESPONSE_COMPRESSION_ENCODINGS,
+)
+app.add_middleware(metrics.MetricsMiddleware)
 
 
 app.include_router(api_router)
@@ -51,6 +59,16 @@ async def mkdirs() -> None:
         dir_path.mkdir(parents=True, exist_ok=True)
 
 
+@app.on_event("startup")
+async def start_temp_space_sweeper() -> None:
+    temp_space.start_sweeper()
+
+
+@app.get("/metrics", description="Prometheus格式的指标", include_in_schema=False)
+def get_metrics() -> Response:
+    return Response(metrics.registry.render(), media_type=metrics.PROMETHEUS_MEDIA_TYPE)
+
+
 @app.get("/")
 def index():
     if settings.DEBUG_MODE:
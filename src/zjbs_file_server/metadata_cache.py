@@ -0,0 +1,51 @@
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from zjbs_file_server.checksum import Checksums, FileIdentity, checksum_store
+from zjbs_file_server.settings import settings
+
+
+class FileMetadataCache:
+    """进程内的文件校验值缓存，以路径为键，文件的FileIdentity变化时缓存失效，按条目数做LRU淘汰
+
+    缓存未命中时查询checksum_store
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.checksums: OrderedDict[str, tuple[FileIdentity, Checksums]] = OrderedDict()
+
+    def get_checksums(self, path: Path, stat_result: os.stat_result, compute: bool) -> Checksums | None:
+        """compute为True时，没有记录的文件读取并计算；计算期间文件被修改时返回None"""
+        key = str(path)
+        identity = FileIdentity.from_stat(stat_result)
+        with self.lock:
+            cached = self.checksums.get(key)
+            if cached is not None and cached[0] == identity:
+                self.checksums.move_to_end(key)
+                return cached[1]
+
+        if compute:
+            checksums = checksum_store.get_or_compute(path, stat_result)
+        else:
+            checksums = checksum_store.get(path, stat_result)
+        if checksums is None:
+            return None
+        if self.max_entries <= 0:
+            return checksums
+        with self.lock:
+            self.checksums[key] = (identity, checksums)
+            self.checksums.move_to_end(key)
+            while len(self.checksums) > self.max_entries:
+                self.checksums.popitem(last=False)
+        return checksums
+
+    def clear(self) -> None:
+        with self.lock:
+            self.checksums.clear()
+
+
+metadata_cache = FileMetadataCache(settings.METADATA_CACHE_MAX_ENTRIES)
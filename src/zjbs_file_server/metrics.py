@@ -0,0 +1,310 @@
+"""进程内的Prometheus指标，/metrics以文本格式输出
+
+更新指标只是在锁内做字典查找和加法；目录空间等需要系统调用的指标在抓取时计算
+"""
+
+import shutil
+import threading
+import time
+from bisect import bisect_left
+from typing import AsyncIterator, Callable, Iterable, Iterator, TypeVar
+
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from zjbs_file_server.settings import settings
+from zjbs_file_server.temp_space import temp_space
+from zjbs_file_server.util import directory_size
+
+PROMETHEUS_MEDIA_TYPE: str = "text/plain; version=0.0.4; charset=utf-8"
+# 请求耗时的分桶上界，单位为秒
+LATENCY_BUCKETS: tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+# 文件夹列表项数的分桶上界
+SIZE_BUCKETS: tuple[float, ...] = (10, 100, 1_000, 10_000, 100_000, 1_000_000)
+# 没有匹配到路由的请求使用的route标签，避免原始路径造成标签过多
+UNMATCHED_ROUTE: str = "<unmatched>"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind: str = ""
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.lock = threading.Lock()
+
+    def header(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+
+    def render(self) -> Iterator[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = ()):
+        super().__init__(name, documentation, label_names)
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, *label_values: str) -> None:
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self) -> Iterator[str]:
+        yield from self.header()
+        with self.lock:
+            items = list(self.values.items())
+        for label_values, value in items:
+            yield f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, *label_values: str) -> None:
+        self.inc(-amount, *label_values)
+
+    def set(self, value: float, *label_values: str) -> None:
+        with self.lock:
+            self.values[label_values] = value
+
+
+class CallbackGauge(_Metric):
+    """抓取时调用callback得到[(标签值, 值)]"""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: tuple[str, ...],
+        callback: Callable[[], Iterable[tuple[tuple[str, ...], float]]],
+    ):
+        super().__init__(name, documentation, label_names)
+        self.callback = callback
+
+    def render(self) -> Iterator[str]:
+        yield from self.header()
+        for label_values, value in self.callback():
+            yield f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...], buckets: tuple[float, ...]):
+        super().__init__(name, documentation, label_names)
+        self.buckets = (*buckets, float("inf"))
+        # 每组标签：各桶的计数（不累加）、总和、次数
+        self.values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            if (state := self.values.get(label_values)) is None:
+                state = self.values[label_values] = ([0] * len(self.buckets), [0.0, 0])
+            state[0][index] += 1
+            state[1][0] += value
+            state[1][1] += 1
+
+    def render(self) -> Iterator[str]:
+        yield from self.header()
+        with self.lock:
+            items = [(label_values, list(counts), list(total)) for label_values, (counts, total) in self.values.items()]
+        for label_values, counts, (total, count) in items:
+            cumulative = 0
+            for upper_bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, label_values, f'le="{_format_value(upper_bound)}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.label_names, label_values)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {_format_value(count)}"
+
+
+MetricT = TypeVar("MetricT", bound=_Metric)
+ItemT = TypeVar("ItemT")
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: list[_Metric] = []
+
+    def register(self, metric: MetricT) -> MetricT:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "".join(line + "\n" for metric in self.metrics for line in metric.render())
+
+
+def _disk_usage() -> Iterator[tuple[tuple[str, ...], float]]:
+    for directory, path in (("file", settings.FILE_DIR), ("temp", settings.TEMP_DIR)):
+        try:
+            usage = shutil.disk_usage(path)
+        except OSError:
+            continue
+        yield (directory, "total"), usage.total
+        yield (directory, "free"), usage.free
+
+
+def _temp_dir_size() -> Iterator[tuple[tuple[str, ...], float]]:
+    # 临时目录中只有正在传输或缓存的文件，可以在抓取时遍历；FILE_DIR太大，只报告所在文件系统的空间
+    yield (), directory_size(str(settings.TEMP_DIR))
+
+
+registry = MetricsRegistry()
+http_requests = registry.register(Counter("zjbs_http_requests_total", "HTTP请求数", ("method", "route", "status")))
+http_request_duration = registry.register(
+    Histogram(
+        "zjbs_http_request_duration_seconds", "HTTP请求从开始到响应发送完毕的耗时", ("method", "route"), LATENCY_BUCKETS
+    )
+)
+http_request_bytes = registry.register(Counter("zjbs_http_request_bytes_total", "接收的请求体字节数", ("route",)))
+http_response_bytes = registry.register(Counter("zjbs_http_response_bytes_total", "发送的响应体字节数", ("route",)))
+http_requests_in_progress = registry.register(
+    Gauge("zjbs_http_requests_in_progress", "正在处理的请求数，包括正在传输的上传和下载", ("method",))
+)
+archive_bytes = registry.register(
+    Counter("zjbs_archive_bytes_total", "压缩时产出、解压时读取的压缩包字节数", ("operation", "compress_method"))
+)
+archive_seconds = registry.register(
+    Counter(
+        "zjbs_archive_seconds_total",
+        "压缩、解压耗时，与zjbs_archive_bytes_total相除得到吞吐量；压缩只计生成压缩包的时间，解压包含接收上传的时间",
+        ("operation", "compress_method"),
+    )
+)
+listing_entries = registry.register(
+    Histogram("zjbs_listing_entries", "列出文件夹、遍历文件树返回的项数", ("operation",), SIZE_BUCKETS)
+)
+registry.register(
+    CallbackGauge("zjbs_disk_bytes", "FILE_DIR和TEMP_DIR所在文件系统的空间", ("directory", "kind"), _disk_usage)
+)
+registry.register(CallbackGauge("zjbs_temp_dir_bytes", "TEMP_DIR中文件的总字节数", (), _temp_dir_size))
+registry.register(
+    CallbackGauge("zjbs_temp_reserved_bytes", "正在写入的临时文件预留的字节数", (), lambda: [((), temp_space.reserved)])
+)
+
+
+async def measure_archive(chunks: AsyncIterator[bytes], operation: str, compress_method: str) -> AsyncIterator[bytes]:
+    """统计经过的压缩包字节数和从开始到结束的耗时，包括等待数据到达的时间"""
+    start = time.perf_counter()
+    size = 0
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+    finally:
+        archive_bytes.inc(size, operation, compress_method)
+        archive_seconds.inc(time.perf_counter() - start, operation, compress_method)
+
+
+def measure_archive_sync(chunks: Iterator[bytes], operation: str, compress_method: str) -> Iterator[bytes]:
+    """只统计生成每块数据的耗时，不包括等待客户端接收的时间"""
+    size = 0
+    elapsed = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - start
+            size += len(chunk)
+            yield chunk
+    finally:
+        archive_bytes.inc(size, operation, compress_method)
+        archive_seconds.inc(elapsed, operation, compress_method)
+
+
+def count_listing(items: Iterator[ItemT], operation: str) -> Iterator[ItemT]:
+    """迭代结束时记录产出的项数"""
+    count = 0
+    try:
+        for item in items:
+            count += 1
+            yield item
+    finally:
+        listing_entries.observe(count, operation)
+
+
+def _response_body_size(message: Message, content_length: int) -> int:
+    """http.response.pathsend由服务器发送整个文件，按响应头的Content-Length统计"""
+    match message["type"]:
+        case "http.response.body":
+            return len(message.get("body", b""))
+        case "http.response.pathsend":
+            return content_length
+    return 0
+
+
+class MetricsMiddleware:
+    """记录每个路由的请求数、耗时和收发字节数，route标签使用路由模板而非原始路径"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        request_size = response_size = content_length = 0
+        status = 500
+        route = UNMATCHED_ROUTE
+
+        async def receive_wrapper() -> Message:
+            nonlocal request_size
+            message = await receive()
+            if message["type"] == "http.request":
+                request_size += len(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal response_size, status, content_length
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                content_length = int(Headers(raw=message["headers"]).get("content-length", 0))
+            else:
+                response_size += _response_body_size(message, content_length)
+            await send(message)
+
+        # 路由在进入应用后才匹配，正在处理的请求数只按方法统计
+        http_requests_in_progress.inc(1, scope["method"])
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            http_requests_in_progress.dec(1, scope["method"])
+            if (matched_route := scope.get("route")) is not None:
+                route = getattr(matched_route, "path", UNMATCHED_ROUTE)
+            http_requests.inc(1, scope["method"], route, str(status))
+            http_request_duration.observe(time.perf_counter() - start, scope["method"], route)
+            if request_size:
+                http_request_bytes.inc(request_size, route)
+            if response_size:
+                http_response_bytes.inc(response_size, route)
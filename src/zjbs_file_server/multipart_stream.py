@@ -0,0 +1,173 @@
+from dataclasses import dataclass
+from typing import AsyncIterator, Collection
+
+from loguru import logger
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.requests import Request
+
+from zjbs_file_server.util import raise_bad_request
+
+# 非文件字段的最大字节数
+MAX_FIELD_SIZE: int = 1024 * 1024
+# 请求体在结尾的分隔符之前结束时400响应的detail
+INCOMPLETE_BODY_DETAIL: str = "multipart body is incomplete"
+
+
+@dataclass
+class MultipartField:
+    name: str
+    value: str
+
+
+@dataclass
+class MultipartFileStart:
+    name: str
+    filename: str
+
+
+@dataclass
+class MultipartFileData:
+    data: bytes
+
+
+@dataclass
+class MultipartFileEnd:
+    pass
+
+
+MultipartEvent = MultipartField | MultipartFileStart | MultipartFileData | MultipartFileEnd
+
+
+def multipart_openapi(
+    files: dict[str, str], bool_fields: dict[str, str] | None = None, string_fields: dict[str, str] | None = None
+) -> dict:
+    """流式解析的接口不声明File参数，用openapi_extra在文档中描述请求体"""
+    properties = {name: {"type": "string", "format": "binary", "description": desc} for name, desc in files.items()}
+    for name, description in (bool_fields or {}).items():
+        properties[name] = {"type": "boolean", "description": description}
+    for name, description in (string_fields or {}).items():
+        properties[name] = {"type": "string", "description": description}
+    schema = {"type": "object", "properties": properties, "required": list(files)}
+    return {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": schema}}}}
+
+
+class _EventCollector:
+    """python-multipart解析器的回调，把解析结果转换成事件"""
+
+    def __init__(self, charset: str):
+        self.charset = charset
+        self.events: list[MultipartEvent] = []
+        self.header_name = b""
+        self.header_value = b""
+        self.content_disposition = b""
+        self.field_name: str | None = None
+        self.field_data = bytearray()
+        self.is_file = False
+        # 收到结尾的分隔符后为True
+        self.ended = False
+
+    def on_part_begin(self) -> None:
+        self.content_disposition = b""
+        self.field_data.clear()
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self.header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self.header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        if self.header_name.lower() == b"content-disposition":
+            self.content_disposition = self.header_value
+        self.header_name = b""
+        self.header_value = b""
+
+    def on_headers_finished(self) -> None:
+        _, options = parse_options_header(self.content_disposition)
+        if b"name" not in options:
+            raise_bad_request('the Content-Disposition header field "name" must be provided')
+        self.field_name = options[b"name"].decode(self.charset, errors="replace")
+        self.is_file = b"filename" in options
+        if self.is_file:
+            filename = options[b"filename"].decode(self.charset, errors="replace")
+            self.events.append(MultipartFileStart(name=self.field_name, filename=filename))
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self.is_file:
+            self.events.append(MultipartFileData(data=data[start:end]))
+            return
+        self.field_data += data[start:end]
+        if len(self.field_data) > MAX_FIELD_SIZE:
+            raise_bad_request(f"form field {self.field_name} is too large")
+
+    def on_part_end(self) -> None:
+        if self.is_file:
+            self.events.append(MultipartFileEnd())
+        else:
+            value = self.field_data.decode(self.charset, errors="replace")
+            self.events.append(MultipartField(name=self.field_name, value=value))
+
+    def on_end(self) -> None:
+        self.ended = True
+
+
+async def iter_multipart(request: Request) -> AsyncIterator[MultipartEvent]:
+    """边接收请求体边解析multipart表单，文件内容以数据块事件的形式产出，不会先缓存到临时文件"""
+    content_type, params = parse_options_header(request.headers.get("Content-Type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        logger.error(f"parse multipart fail: invalid content type: {request.headers.get('Content-Type')}")
+        raise_bad_request("request body must be multipart/form-data")
+    charset = params.get(b"charset", b"utf-8").decode("latin-1")
+
+    collector = _EventCollector(charset)
+    callbacks = {
+        name: getattr(collector, name)
+        for name in [
+            "on_part_begin",
+            "on_header_field",
+            "on_header_value",
+            "on_header_end",
+            "on_headers_finished",
+            "on_part_data",
+            "on_part_end",
+            "on_end",
+        ]
+    }
+    parser = MultipartParser(params[b"boundary"], callbacks)
+    async for chunk in request.stream():
+        parser.write(chunk)
+        for event in collector.events:
+            yield event
+        collector.events.clear()
+    parser.finalize()
+    for event in collector.events:
+        yield event
+    if not collector.ended:
+        # 请求体被截断，没有收到结尾的分隔符
+        logger.error("parse multipart fail: request body ended before the closing boundary")
+        raise_bad_request(INCOMPLETE_BODY_DETAIL)
+
+
+async def iter_file_part(events: AsyncIterator[MultipartEvent]) -> AsyncIterator[bytes]:
+    """在MultipartFileStart之后调用，产出文件字段的数据块，收到字段结尾时结束"""
+    async for event in events:
+        if isinstance(event, MultipartFileEnd):
+            return
+        yield event.data
+    # 请求体不完整时iter_multipart已经返回400，不会执行到这里
+    raise_bad_request("multipart file part is incomplete")
+
+
+async def iter_file_and_rest(
+    events: AsyncIterator[MultipartEvent], file_field: str, control_fields: Collection[str]
+) -> AsyncIterator[bytes]:
+    """产出文件字段的数据块，之后读完请求体的其余部分才结束，调用方在数据块结束后提交文件，截断的请求体不会提交
+
+    文件之后出现control_fields中的字段时返回400，文件已经按之前的值处理，不能再改变
+    """
+    async for chunk in iter_file_part(events):
+        yield chunk
+    async for event in events:
+        if isinstance(event, MultipartField) and event.name in control_fields:
+            logger.error(f"parse multipart fail: field {event.name} after {file_field}")
+            raise_bad_request(f"form field {event.name} must come before {file_field}")
@@ -0,0 +1,247 @@
+"""按内容类型压缩响应，代替对所有响应使用的GZipMiddleware
+
+只压缩JSON、NDJSON、文本等可压缩的动态响应，支持zstd、br、gzip协商；流式响应每块数据都同步刷新，客户端可以逐块解压；
+可压缩类型的响应不论是否压缩都带Vary: Accept-Encoding；
+支持Range的文件响应（带Accept-Ranges头）不压缩，保留Content-Length和范围请求，文件可以发送PRECOMPRESSED_DIR中的预压缩文件
+"""
+
+import os
+import stat
+import zlib
+from pathlib import Path
+from typing import Iterable
+
+import zstandard
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from zjbs_file_server.settings import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 可压缩的媒体类型前缀，以及+json、+xml结尾的类型
+COMPRESSIBLE_MEDIA_TYPES: tuple[str, ...] = (
+    "text/",
+    "application/json",
+    "application/x-ndjson",
+    "application/xml",
+    "application/javascript",
+)
+# 编码及预压缩文件的扩展名
+PRECOMPRESSED_SUFFIXES: dict[str, str] = {"zstd": ".zst", "br": ".br", "gzip": ".gz"}
+
+ZSTD_LEVEL: int = 3
+BROTLI_QUALITY: int = 4
+GZIP_LEVEL: int = 6
+
+
+def supported_encodings(encodings: Iterable[str]) -> list[str]:
+    """没有安装brotli时不使用br"""
+    return [encoding for encoding in encodings if encoding in PRECOMPRESSED_SUFFIXES and (encoding != "br" or brotli)]
+
+
+def precompressed_paths(file_path: Path, stat_result: os.stat_result) -> dict[str, Path]:
+    """文件在PRECOMPRESSED_DIR中各个编码的预压缩文件路径，文件名包含原文件的大小和修改时间，原文件修改后不再匹配"""
+    if settings.PRECOMPRESSED_DIR is None:
+        return {}
+    try:
+        relative_path = file_path.relative_to(settings.FILE_DIR)
+    except ValueError:
+        return {}
+    key = f"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"
+    base_path = settings.PRECOMPRESSED_DIR / relative_path.parent / f"{relative_path.name}.{key}"
+    return {encoding: Path(f"{base_path}{suffix}") for encoding, suffix in PRECOMPRESSED_SUFFIXES.items()}
+
+
+def write_precompressed(file_path: Path, encoding: str) -> Path:
+    """生成文件的预压缩文件，先写临时文件再替换，供运维脚本预先压缩常用的大文本文件"""
+    stat_result = file_path.stat()
+    if (
+        not stat.S_ISREG(stat_result.st_mode)
+        or (target_path := precompressed_paths(file_path, stat_result).get(encoding)) is None
+    ):
+        raise ValueError(f"cannot precompress {file_path} with {encoding}")
+    target_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = target_path.with_name(f"{target_path.name}.tmp")
+    compressor = _Compressor(encoding)
+    with open(file_path, "rb") as reader, open(tmp_path, "wb") as writer:
+        while chunk := reader.read(1024 * 1024):
+            writer.write(compressor.compress(chunk))
+        writer.write(compressor.finish())
+    os.replace(tmp_path, target_path)
+    return target_path
+
+
+def parse_accept_encoding(value: str) -> dict[str, float]:
+    result = {}
+    for item in value.split(","):
+        coding, *params = item.strip().split(";")
+        if not (coding := coding.strip().lower()):
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, param_value = param.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(param_value)
+                except ValueError:
+                    quality = 0.0
+        result[coding] = quality
+    return result
+
+
+def choose_encoding(accept_encoding: str | None, encodings: Iterable[str]) -> str | None:
+    """在服务器支持的编码中选客户端q值最高的，相同时按服务器的顺序；没有可用的编码时返回None"""
+    if not accept_encoding:
+        return None
+    accepted = parse_accept_encoding(accept_encoding)
+    default_quality = accepted.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for encoding in encodings:
+        quality = accepted.get(encoding, default_quality)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def is_compressible(content_type: str | None) -> bool:
+    if not content_type:
+        return False
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    return media_type.startswith(COMPRESSIBLE_MEDIA_TYPES) or media_type.endswith(("+json", "+xml"))
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        match encoding:
+            case "zstd":
+                self.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+                self.compress = self.compressor.compress
+                self.flush = lambda: self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+                self.finish = lambda: self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+            case "br":
+                self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+                self.compress = self.compressor.process
+                self.flush = self.compressor.flush
+                self.finish = self.compressor.finish
+            case "gzip":
+                self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+                self.compress = self.compressor.compress
+                self.flush = lambda: self.compressor.flush(zlib.Z_SYNC_FLUSH)
+                self.finish = self.compressor.flush
+            case _:
+                raise ValueError(f"unsupported encoding: {encoding}")
+
+
+def weaken_etag(headers: MutableHeaders) -> None:
+    """压缩后的字节与原响应不同，强ETag改为弱ETag"""
+    etag = headers.get("etag")
+    if etag is not None and not etag.startswith("W/"):
+        headers["etag"] = f"W/{etag}"
+
+
+def add_vary_accept_encoding(headers: MutableHeaders) -> None:
+    """已经带有Accept-Encoding时不重复添加"""
+    if "accept-encoding" not in headers.get("vary", "").lower():
+        headers.add_vary_header("Accept-Encoding")
+
+
+def vary_start_message(message: Message) -> Message:
+    """可压缩类型的响应即使这次没有压缩，内容也随Accept-Encoding变化，共享缓存不能把它发给所有客户端"""
+    if not is_compressible(Headers(raw=message["headers"]).get("content-type")):
+        return message
+    headers = MutableHeaders(raw=list(message["headers"]))
+    add_vary_accept_encoding(headers)
+    return message | {"headers": headers.raw}
+
+
+class _CompressionResponder:
+    def __init__(self, send: Send, encoding: str, minimum_size: int):
+        self.send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start_message: Message | None = None
+        self.passthrough = False
+        self.compressor: _Compressor | None = None
+
+    async def __call__(self, message: Message) -> None:
+        if self.passthrough:
+            await self.send(message)
+            return
+        if message["type"] == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            if (
+                message["status"] in (204, 206, 304)
+                or "content-encoding" in headers
+                or "accept-ranges" in headers
+                or not is_compressible(headers.get("content-type"))
+            ):
+                self.passthrough = True
+                await self.send(vary_start_message(message))
+            else:
+                # 等到第一块响应体再决定是否压缩
+                self.start_message = message
+            return
+        if message["type"] != "http.response.body":
+            # 其他类型的消息无法压缩，原样发送
+            await self._start_passthrough(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.compressor is None:
+            if not more_body and len(body) < self.minimum_size:
+                await self._start_passthrough(message)
+                return
+            self.compressor = _Compressor(self.encoding)
+            headers = MutableHeaders(raw=list(self.start_message["headers"]))
+            headers["content-encoding"] = self.encoding
+            add_vary_accept_encoding(headers)
+            weaken_etag(headers)
+            if not more_body:
+                data = self.compressor.compress(body) + self.compressor.finish()
+                headers["content-length"] = str(len(data))
+                await self.send(self.start_message | {"headers": headers.raw})
+                await self.send({"type": "http.response.body", "body": data, "more_body": False})
+                return
+            del headers["content-length"]
+            await self.send(self.start_message | {"headers": headers.raw})
+
+        # 流式响应（如NDJSON列表）每块都刷新，否则压缩器缓存数据，客户端要等很久才能收到
+        data = self.compressor.compress(body) + (self.compressor.flush() if more_body else self.compressor.finish())
+        if data or not more_body:
+            await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+    async def _start_passthrough(self, message: Message) -> None:
+        self.passthrough = True
+        await self.send(vary_start_message(self.start_message))
+        await self.send(message)
+
+
+class CompressionMiddleware:
+    """按Accept-Encoding选择编码压缩可压缩的响应；带Range头的请求不压缩"""
+
+    def __init__(self, app: ASGIApp, minimum_size: int, encodings: Iterable[str]):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encodings = supported_encodings(encodings)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        encoding = None if "range" in headers else choose_encoding(headers.get("accept-encoding"), self.encodings)
+        if encoding is None:
+
+            async def send_with_vary(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    message = vary_start_message(message)
+                await send(message)
+
+            await self.app(scope, receive, send_with_vary)
+            return
+        await self.app(scope, receive, _CompressionResponder(send, encoding, self.minimum_size))
@@ -1,12 +1,16 @@
 from pathlib import PurePosixPath
 from typing import Annotated
 
-from fastapi import APIRouter, File, Form, Path, Query, UploadFile
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Path, Query
 from loguru import logger
-from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import StreamingResponse
 
 from zjbs_file_server import service
+from zjbs_file_server.archive import ARCHIVE_SUFFIXES
+from zjbs_file_server.file_response import RangeFileResponse
+from zjbs_file_server.multipart_stream import multipart_openapi
 from zjbs_file_server.types import CompressMethod, FileSystemInfo, RelativeUrlPath
 from zjbs_file_server.util import get_os_path, raise_bad_request, raise_not_found
 
@@ -16,10 +20,17 @@ router = APIRouter(tags=["restful"])
 @router.get("/restful/{server_path:path}", response_model=None)
 async def download_or_list_file(
     server_path: Annotated[RelativeUrlPath, Path(description="文件路径")],
-    compress: Annotated[CompressMethod | None, Query(description="压缩方法，文件夹默认txz，文件默认不压缩")] = None,
+    compress: Annotated[
+        CompressMethod | None, Query(description="压缩方法，文件夹默认txz，not_compressed时下载tar包；文件默认不压缩")
+    ] = None,
+    compress_level: Annotated[int | None, Query(description="压缩级别，默认使用压缩方法的默认级别")] = None,
+    compress_threads: Annotated[
+        int | None, Query(description="压缩线程数，只对tzst和ptgz有效，默认使用全部CPU")
+    ] = None,
+    adaptive: Annotated[bool, Query(description="自适应压缩，已经压缩过的文件只存储不压缩")] = False,
     follow_symlinks: Annotated[bool, Query(description="是否跟随符号链接")] = True,
     list_: Annotated[bool, Query(alias="list", description="列出文件夹，而非下载文件夹")] = False,
-) -> list[FileSystemInfo] | FileResponse:
+) -> list[FileSystemInfo] | RangeFileResponse | StreamingResponse:
     file_path = get_os_path(server_path)
     if not file_path.exists():
         logger.error(f"download_file fail: file not exists: {file_path}")
@@ -28,31 +39,36 @@ async def download_or_list_file(
         file_path = file_path.resolve()
 
     if list_ and file_path.is_dir():
-        return service.list_directory_by_path(server_path, follow_symlinks)
+        return await run_in_threadpool(service.list_directory_by_path, server_path, follow_symlinks)
 
-    if compress is None:
+    if compress is None or compress == CompressMethod.not_compressed:
         if file_path.is_file():
-            return FileResponse(file_path)
+            return await run_in_threadpool(service.file_response, file_path)
         elif file_path.is_dir():
-            compress = CompressMethod.txz
+            # 文件夹不压缩时下载tar包
+            compress = compress or CompressMethod.txz
         else:
             logger.error(f"download_file fail: unknown file type: {file_path}")
             raise_bad_request(f"unknown file type: {server_path}")
 
-    compressed_file = service.compress(file_path, compress, follow_symlinks)
-    return FileResponse(
-        compressed_file,
-        background=BackgroundTask(compressed_file.unlink, missing_ok=True),
-        filename=f"{file_path.stem}.{compress.value}",
+    # 计算文件树指纹需要遍历文件夹，不能阻塞事件循环
+    filename = f"{file_path.stem}.{ARCHIVE_SUFFIXES.get(compress, compress.value)}"
+    return await run_in_threadpool(
+        service.compress, file_path, compress, follow_symlinks, filename, compress_level, compress_threads, adaptive
     )
 
 
-@router.post("/restful/{server_path:path}")
+@router.post(
+    "/restful/{server_path:path}",
+    openapi_extra=multipart_openapi(
+        {"file": "上传的文件，忽略文件名"},
+        {"mkdir": "是否创建目录，默认为true", "allow_overwrite": "是否允许覆盖已有文件，默认为false"},
+        {"expected_sha256": "文件的sha256，不匹配时拒绝上传"},
+    ),
+)
 async def upload_file(
-    server_path: Annotated[RelativeUrlPath, Path(description="目标文件路径")],
-    file: Annotated[UploadFile, File(description="上传的文件，忽略文件名")],
-    mkdir: Annotated[bool, Form(description="是否创建目录，默认为true")] = True,
-    allow_overwrite: Annotated[bool, Form(description="是否允许覆盖已有文件，默认为false")] = False,
-):
+    request: Request, server_path: Annotated[RelativeUrlPath, Path(description="目标文件路径")]
+) -> None:
+    """mkdir、allow_overwrite和expected_sha256字段需要位于file字段之前"""
     pure_path = PurePosixPath(server_path)
-    return service.upload_file(str(pure_path.parent), pure_path.name, file.file, mkdir, allow_overwrite)
+    await service.receive_multipart_upload(request, str(pure_path.parent), pure_path.name, True, False)
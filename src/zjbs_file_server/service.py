@@ -1,28 +1,74 @@
+import base64
+import gzip
+import lzma
 import os
+import re
 import shutil
 import tarfile
 import zipfile
-from datetime import datetime
+from email.utils import formatdate
+from functools import partial
+from io import BytesIO
 from pathlib import Path
-from tempfile import NamedTemporaryFile
-from typing import BinaryIO
-from zipfile import ZipFile
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile
+from typing import AsyncIterator, BinaryIO, Iterator
 
-from fastapi.responses import FileResponse
+import anyio
+import zstandard
+from fastapi import HTTPException
 from loguru import logger
+from starlette.background import BackgroundTask
+from starlette.requests import Request
+from starlette.responses import StreamingResponse
 
+from zjbs_file_server import listing, metrics, stream_extract
+from zjbs_file_server.archive import ARCHIVE_MEDIA_TYPES, archive_response, check_archive_source, iter_archive
+from zjbs_file_server.archive_cache import archive_cache, tree_stat
+from zjbs_file_server.checksum import Checksums, ChecksumTarFile, ChecksumWriter, ChecksumZipFile, checksum_store
+from zjbs_file_server.codec import TAR_COMPRESS_METHODS, open_decompress_reader
+from zjbs_file_server.dedup_store import dedup_store
+from zjbs_file_server.file_response import RangeFileResponse
+from zjbs_file_server.listing_cache import listing_cache
+from zjbs_file_server.metadata_cache import metadata_cache
+from zjbs_file_server.multipart_stream import (
+    INCOMPLETE_BODY_DETAIL,
+    MultipartField,
+    MultipartFileStart,
+    iter_file_and_rest,
+    iter_file_part,
+    iter_multipart,
+)
+from zjbs_file_server.response_compression import precompressed_paths
+from zjbs_file_server.settings import settings
+from zjbs_file_server.temp_space import temp_space
 from zjbs_file_server.types import (
     AbsoluteUrlPath,
+    BatchOperation,
+    BatchOperationResult,
+    BatchOperationType,
     CompressMethod,
+    FileChecksum,
     FileSystemInfo,
+    FileTreeInfo,
     FileType,
+    ListSortKey,
     RelativeUrlPath,
     is_valid_filename,
 )
-from zjbs_file_server.util import get_os_path, new_temp_file, raise_bad_request, raise_not_found
+from zjbs_file_server.util import (
+    get_os_path,
+    parse_form_bool,
+    raise_bad_request,
+    raise_insufficient_storage,
+    raise_not_found,
+)
 
+# 流式上传时攒够这么多数据再写入磁盘
+UPLOAD_WRITE_BUFFER_SIZE: int = 1024 * 1024
+SHA256_PATTERN: re.Pattern = re.compile(r"[0-9a-f]{64}")
 
-def download_file(path: RelativeUrlPath | AbsoluteUrlPath) -> FileResponse:
+
+def download_file(path: RelativeUrlPath | AbsoluteUrlPath) -> RangeFileResponse:
     file_path = get_os_path(path)
     if not file_path.exists():
         logger.error(f"download_file fail: file not exists: {file_path}")
@@ -32,51 +78,111 @@ def download_file(path: RelativeUrlPath | AbsoluteUrlPath) -> FileResponse:
         raise_bad_request(f"not a file: {path}")
 
     logger.info(f"download_file success: {file_path}")
-    return FileResponse(file_path, filename=file_path.name)
+    return file_response(file_path, file_path.name)
+
 
+def file_response(file_path: Path, filename: str | None = None) -> RangeFileResponse:
+    """ETag默认由inode、大小和修改时间生成，开启FILE_ETAG_CONTENT_HASH时使用内容的sha256
 
-def compress(path: Path, compress_method: CompressMethod, follow_symlinks: bool) -> Path:
+    已经记录了校验值时通过Repr-Digest头返回sha256，客户端可以边下载边校验
+    """
+    stat_result = file_path.stat()
+    headers = {}
+    checksums = metadata_cache.get_checksums(file_path, stat_result, settings.FILE_ETAG_CONTENT_HASH)
+    if checksums is not None:
+        headers["repr-digest"] = f"sha-256=:{base64.b64encode(bytes.fromhex(checksums.sha256)).decode()}:"
+        if settings.FILE_ETAG_CONTENT_HASH:
+            headers["etag"] = f'"{checksums.sha256}"'
+    return RangeFileResponse(
+        file_path,
+        filename=filename,
+        stat_result=stat_result,
+        headers=headers,
+        precompressed=precompressed_paths(file_path, stat_result),
+    )
+
+
+def get_checksum(path: AbsoluteUrlPath) -> FileChecksum:
+    """优先使用上传时计算的校验值，没有记录时读取文件计算"""
+    file_path = get_os_path(path)
+    if not file_path.is_file():
+        logger.error(f"get_checksum fail: not a file: {file_path}")
+        raise_not_found(path)
+    stat_result = file_path.stat()
+    checksums = metadata_cache.get_checksums(file_path, stat_result, True)
+    if checksums is None:
+        logger.error(f"get_checksum fail: file changed during computing: {file_path}")
+        raise_bad_request(f"file changed during computing checksum: {path}")
+    return FileChecksum(path=path, size=stat_result.st_size, sha256=checksums.sha256, crc32=checksums.crc32)
+
+
+def compress(
+    path: Path,
+    compress_method: CompressMethod,
+    follow_symlinks: bool,
+    filename: str,
+    compress_level: int | None = None,
+    compress_threads: int | None = None,
+    adaptive: bool = False,
+) -> StreamingResponse | RangeFileResponse:
     if follow_symlinks:
         path = path.resolve(strict=True)
+    check_archive_source(path, compress_method, compress_level)
+
+    chunks = iter_archive(path, compress_method, follow_symlinks, compress_level, compress_threads, adaptive)
+    chunks = metrics.measure_archive_sync(chunks, "compress", compress_method)
+    # 遍历整个文件树计算指纹会推迟第一个字节，只在启用缓存时计算；不缓存时不带ETag和Last-Modified，直接开始压缩
+    if not archive_cache.enabled:
+        return archive_response(chunks, compress_method, filename)
 
-    compressed_path = new_temp_file()
+    # 压缩包的字节不保证每次相同，使用由文件树指纹和压缩参数生成的弱ETag
+    fingerprint, latest_mtime = tree_stat(path, follow_symlinks)
+    key = archive_cache.cache_key(path, compress_method, compress_level, follow_symlinks, fingerprint, adaptive)
+    headers = {"etag": f'W/"{key}"', "last-modified": formatdate(latest_mtime, usegmt=True)}
+    if (cached_path := archive_cache.get(key)) is not None:
+        return RangeFileResponse(
+            cached_path,
+            filename=filename,
+            media_type=ARCHIVE_MEDIA_TYPES[compress_method],
+            headers=headers,
+            background=BackgroundTask(cached_path.unlink, missing_ok=True),
+        )
+    chunks = archive_cache.iter_and_store(chunks, key, path, follow_symlinks, fingerprint)
+    return archive_response(chunks, compress_method, filename, headers)
+
+
+def extract_archive(
+    fileobj: BinaryIO,
+    compress_method: CompressMethod,
+    staging_dir: Path,
+    zip_metadata_encoding: str,
+    checksums: dict[str, Checksums],
+) -> None:
+    """解压到暂存文件夹，解压时计算的校验值写入checksums"""
     match compress_method:
         case CompressMethod.zip:
-            with ZipFile(compressed_path, mode="x", compression=zipfile.ZIP_DEFLATED, compresslevel=9) as zip_file:
-                if path.is_file():
-                    zip_file.write(path, path.name)
-                elif path.is_dir():
-                    parent_path = path.parent
-                    for root, _, files in os.walk(path, followlinks=follow_symlinks):
-                        for file in files:
-                            file_path = os.path.join(root, file)
-                            file_relative_path = os.path.relpath(file_path, parent_path)
-                            zip_file.write(file_path, file_relative_path)
-                else:
-                    logger.error(f"compress fail: not a file or directory: {path}")
-                    raise_bad_request("not a file or directory")
-        case CompressMethod.tgz | CompressMethod.txz:
-            mode = "x:gz" if compress_method == CompressMethod.tgz else "x:xz"
-            with tarfile.open(compressed_path, mode=mode, dereference=follow_symlinks) as tar_file:
-                tar_file.add(path, path.name)
+            with ChecksumZipFile(fileobj, mode="r", metadata_encoding=zip_metadata_encoding) as zip_file:
+                stream_extract.check_member_paths(zip_file.namelist(), staging_dir)
+                zip_file.extractall(staging_dir)
+            stream_extract.collect_staged_files(zip_file.checksums, staging_dir, checksums)
+        case method if method in TAR_COMPRESS_METHODS:
+            with open_decompress_reader(fileobj, compress_method) as reader:
+                with ChecksumTarFile.open(fileobj=reader, mode="r|") as tar_file:
+                    tar_file.extractall(staging_dir, filter="data")
+            stream_extract.collect_staged_files(tar_file.checksums, staging_dir, checksums)
         case _:
-            logger.error(f"compress fail: unsupported compress method: {compress_method}")
+            logger.error(f"upload_directory fail: unsupported compress method: {compress_method}")
             raise_bad_request(f"unsupported compress method: {compress_method}")
-    return compressed_path
 
 
-def upload_file(
-    target_url_directory: RelativeUrlPath | AbsoluteUrlPath,
-    target_filename: str,
-    reader: BinaryIO,
-    mkdir: bool,
-    allow_overwrite: bool,
-) -> None:
+def check_upload_target(
+    target_url_directory: RelativeUrlPath | AbsoluteUrlPath, target_filename: str, mkdir: bool, allow_overwrite: bool
+) -> Path:
     # 检查文件夹
     target_directory_path = get_os_path(target_url_directory)
     if not target_directory_path.exists():
         if mkdir:
-            target_directory_path.mkdir(parents=True)
+            target_directory_path.mkdir(parents=True, exist_ok=True)
         else:
             logger.error(f"upload_file fail: directory not exists: {target_directory_path}")
             raise_bad_request(f"directory {target_url_directory} not exists")
@@ -91,27 +197,278 @@ def upload_file(
     if target_path.exists() and not allow_overwrite:
         logger.error(f"upload_file fail: file already exists: {target_path}")
         raise_bad_request(f"file {target_url_directory}/{target_filename} already exists")
+    return target_path
+
+
+def remove_temp_file(tmp_path: str | None) -> None:
+    try:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    except OSError:
+        logger.exception(f"upload_file: remove temp file error: {tmp_path}")
+
+
+def check_expected_sha256(target_path: Path, checksums: Checksums, expected_sha256: str | None) -> None:
+    if expected_sha256 is not None and expected_sha256.strip().lower() != checksums.sha256:
+        logger.error(f"upload_file fail: sha256 mismatch: {target_path}, {expected_sha256=}, {checksums.sha256=}")
+        raise_bad_request(f"sha256 mismatch: expected {expected_sha256}, got {checksums.sha256}")
+
+
+def upload_file(
+    target_url_directory: RelativeUrlPath | AbsoluteUrlPath,
+    target_filename: str,
+    reader: BinaryIO,
+    mkdir: bool,
+    allow_overwrite: bool,
+    expected_sha256: str | None = None,
+) -> None:
+    """写入时计算校验值，expected_sha256不匹配时不替换目标文件"""
+    target_path = check_upload_target(target_url_directory, target_filename, mkdir, allow_overwrite)
 
     # 写入临时文件，然后替换为目标文件
     tmp_path = None
+    record_path = None
     try:
-        with NamedTemporaryFile(delete=False, dir=target_directory_path, prefix=target_filename) as tmp_file:
+        with NamedTemporaryFile(delete=False, dir=target_path.parent, prefix=target_filename) as tmp_file:
             tmp_path = tmp_file.name
-            shutil.copyfileobj(reader, tmp_file)
+            record_path = temp_space.track(Path(tmp_path))
+            writer = ChecksumWriter(tmp_file)
+            shutil.copyfileobj(reader, writer)
+        checksums = writer.checksums()
+        check_expected_sha256(target_path, checksums, expected_sha256)
+        dedup_store.link_into(tmp_path, checksums, target_path)
         os.replace(tmp_path, target_path)
+        checksum_store.put(target_path, checksums)
+        listing_cache.invalidate(target_path.parent)
+        logger.info(f"upload_file success: {target_path}")
+    except OSError:
+        logger.exception(f"upload_file fail: system error: {target_path}")
+        raise
+    finally:
+        remove_temp_file(tmp_path)
+        temp_space.untrack(record_path)
+
+
+def upload_by_hash(
+    target_url_directory: AbsoluteUrlPath, target_filename: str, sha256: str, mkdir: bool, allow_overwrite: bool
+) -> bool:
+    """去重存储中已有内容的sha256为sha256的文件时，直接链接到目标路径，不需要上传内容；返回是否已经链接"""
+    sha256 = sha256.strip().lower()
+    if not SHA256_PATTERN.fullmatch(sha256):
+        logger.error(f"upload_by_hash fail: invalid sha256: {sha256}")
+        raise_bad_request(f"invalid sha256: {sha256}")
+    if not dedup_store.enabled:
+        return False
+    target_path = check_upload_target(target_url_directory, target_filename, mkdir, allow_overwrite)
+    link_path = dedup_store.link_blob(sha256, target_path.parent)
+    if link_path is None:
+        return False
+    try:
+        # 链接会让已有文件的修改时间倒退时不去重，由客户端上传内容
+        if not dedup_store.keeps_target_mtime(link_path.stat(), target_path):
+            return False
+        os.replace(link_path, target_path)
+    finally:
+        link_path.unlink(missing_ok=True)
+    blob_path = dedup_store.blob_path(sha256)
+    if (checksums := checksum_store.get(blob_path, blob_path.stat())) is not None:
+        checksum_store.put(target_path, checksums)
+    listing_cache.invalidate(target_path.parent)
+    logger.info(f"upload_by_hash success: {target_path}")
+    return True
+
+
+async def upload_file_stream(
+    target_url_directory: RelativeUrlPath | AbsoluteUrlPath,
+    target_filename: str,
+    chunks: AsyncIterator[bytes],
+    mkdir: bool,
+    allow_overwrite: bool,
+    expected_sha256: str | None = None,
+) -> None:
+    """边接收边写入目标文件夹中的临时文件，所有磁盘操作和校验值计算都在线程池中执行，不阻塞事件循环"""
+    target_path = await anyio.to_thread.run_sync(
+        check_upload_target, target_url_directory, target_filename, mkdir, allow_overwrite
+    )
+
+    tmp_path = None
+    record_path = None
+    try:
+        tmp_file = await anyio.to_thread.run_sync(
+            partial(NamedTemporaryFile, delete=False, dir=target_path.parent, prefix=target_filename)
+        )
+        tmp_path = tmp_file.name
+        record_path = await anyio.to_thread.run_sync(temp_space.track, Path(tmp_path))
+        writer = ChecksumWriter(tmp_file)
+        async with anyio.wrap_file(writer) as async_writer:
+            # 请求体的数据块通常很小，攒够一定大小再写入，减少线程切换
+            buffer = bytearray()
+            async for chunk in chunks:
+                buffer += chunk
+                if len(buffer) >= UPLOAD_WRITE_BUFFER_SIZE:
+                    await async_writer.write(bytes(buffer))
+                    buffer.clear()
+            await async_writer.write(bytes(buffer))
+        checksums = writer.checksums()
+        check_expected_sha256(target_path, checksums, expected_sha256)
+        await anyio.to_thread.run_sync(dedup_store.link_into, tmp_path, checksums, target_path)
+        await anyio.to_thread.run_sync(os.replace, tmp_path, target_path)
+        await anyio.to_thread.run_sync(checksum_store.put, target_path, checksums)
+        await anyio.to_thread.run_sync(listing_cache.invalidate, target_path.parent)
         logger.info(f"upload_file success: {target_path}")
-    except (IOError, OSError):
+    except OSError:
         logger.exception(f"upload_file fail: system error: {target_path}")
         raise
     finally:
+        await anyio.to_thread.run_sync(remove_temp_file, tmp_path)
+        await anyio.to_thread.run_sync(temp_space.untrack, record_path)
+
+
+# 影响文件写入方式的表单字段，必须位于文件之前
+UPLOAD_CONTROL_FIELDS: tuple[str, ...] = ("mkdir", "allow_overwrite", "expected_sha256")
+
+
+async def receive_multipart_upload(
+    request: Request,
+    target_url_directory: RelativeUrlPath | AbsoluteUrlPath,
+    target_filename: str | None,
+    mkdir: bool,
+    allow_overwrite: bool,
+    expected_sha256: str | None = None,
+) -> None:
+    """流式解析multipart请求体并写入file字段的文件，target_filename为None时使用上传的文件名
+
+    表单中位于文件之前的mkdir、allow_overwrite、expected_sha256字段会覆盖参数中的值，位于文件之后时返回400；
+    读完整个请求体后才提交文件
+    """
+    uploaded = False
+    events = iter_multipart(request)
+    async for event in events:
+        match event:
+            case MultipartField(name="mkdir", value=value):
+                mkdir = parse_form_bool(value)
+            case MultipartField(name="allow_overwrite", value=value):
+                allow_overwrite = parse_form_bool(value)
+            case MultipartField(name="expected_sha256", value=value):
+                expected_sha256 = value
+            case MultipartFileStart(name="file", filename=filename) if not uploaded:
+                await upload_file_stream(
+                    target_url_directory,
+                    target_filename or filename,
+                    iter_file_and_rest(events, "file", UPLOAD_CONTROL_FIELDS),
+                    mkdir,
+                    allow_overwrite,
+                    expected_sha256,
+                )
+                uploaded = True
+    if not uploaded:
+        logger.error(f"upload_file fail: no file in request: {target_url_directory}")
+        raise_bad_request("field file is required")
+
+
+# zip需要随机读取，先写入内存，超过此大小后转存到临时文件
+ZIP_SPOOL_MAX_SIZE: int = 16 * 1024 * 1024
+# 压缩包内容损坏时解压抛出的异常
+INVALID_ARCHIVE_ERRORS: tuple[type[Exception], ...] = (
+    tarfile.TarError,
+    EOFError,
+    gzip.BadGzipFile,
+    lzma.LZMAError,
+    zstandard.ZstdError,
+    zipfile.BadZipFile,
+)
+
+
+def check_extract_destination(parent_dir: AbsoluteUrlPath, mkdir: bool) -> Path:
+    destination_parent_dir = get_os_path(parent_dir)
+    if mkdir:
+        destination_parent_dir.mkdir(parents=True, exist_ok=True)
+    elif not destination_parent_dir.is_dir():
+        logger.error(f"upload_directory fail: directory not exists or not directory: {destination_parent_dir}")
+        raise_bad_request(f"directory {parent_dir} not exists or not directory")
+    return destination_parent_dir
+
+
+async def extract_archive_stream(
+    chunks: AsyncIterator[bytes],
+    compress_method: CompressMethod,
+    destination_parent_dir: Path,
+    zip_metadata_encoding: str,
+) -> None:
+    """tar包边接收边解压；zip的目录在文件末尾，只能接收完成后再解压"""
+    chunks = metrics.measure_archive(chunks, "extract", compress_method)
+    if compress_method in TAR_COMPRESS_METHODS:
         try:
-            if tmp_path is not None and os.path.exists(tmp_path):
-                os.remove(tmp_path)
-        except OSError:
-            logger.exception(f"upload_file: remove temp file error: {tmp_path}")
+            await stream_extract.extract_tar_stream(chunks, compress_method, destination_parent_dir)
+        except INVALID_ARCHIVE_ERRORS as e:
+            logger.error(f"upload_directory fail: invalid archive: {e!r}")
+            raise_bad_request(f"invalid {compress_method} archive")
+    elif compress_method == CompressMethod.zip:
+        with (
+            SpooledTemporaryFile(max_size=ZIP_SPOOL_MAX_SIZE, dir=settings.TEMP_DIR) as spool_file,
+            temp_space.reservation() as reservation,
+        ):
 
+            def write_spool(data: bytes) -> None:
+                # 临时空间不足时在线程中排队等待，超时返回507
+                if not reservation.record(len(data), settings.TEMP_SPACE_WAIT_TIMEOUT):
+                    logger.error(f"upload_directory fail: temp space exhausted: {destination_parent_dir}")
+                    raise_insufficient_storage("not enough temp space for zip archive")
+                spool_file.write(data)
 
-def list_directory_by_path(path: AbsoluteUrlPath | RelativeUrlPath, follow_symlinks: bool) -> list[FileSystemInfo]:
+            buffer = bytearray()
+            async for chunk in chunks:
+                buffer += chunk
+                if len(buffer) >= UPLOAD_WRITE_BUFFER_SIZE:
+                    await anyio.to_thread.run_sync(write_spool, bytes(buffer))
+                    buffer.clear()
+            await anyio.to_thread.run_sync(write_spool, bytes(buffer))
+            await anyio.to_thread.run_sync(spool_file.seek, 0)
+            try:
+                async with stream_extract.staging_directory(destination_parent_dir) as (staging_dir, checksums):
+                    await anyio.to_thread.run_sync(
+                        extract_archive, spool_file, compress_method, staging_dir, zip_metadata_encoding, checksums
+                    )
+            except INVALID_ARCHIVE_ERRORS as e:
+                logger.error(f"upload_directory fail: invalid archive: {e!r}")
+                raise_bad_request(f"invalid {compress_method} archive")
+    else:
+        logger.error(f"upload_directory fail: unsupported compress method: {compress_method}")
+        raise_bad_request(f"unsupported compress method: {compress_method}")
+
+
+async def receive_multipart_directory(
+    request: Request,
+    parent_dir: AbsoluteUrlPath,
+    compress_method: CompressMethod,
+    mkdir: bool,
+    zip_metadata_encoding: str,
+) -> None:
+    """流式解析multipart请求体，解压compressed_dir字段的压缩包"""
+    destination_parent_dir = await anyio.to_thread.run_sync(check_extract_destination, parent_dir, mkdir)
+    extracted = False
+    events = iter_multipart(request)
+    async for event in events:
+        match event:
+            case MultipartFileStart(name="compressed_dir") if not extracted:
+                try:
+                    await extract_archive_stream(
+                        iter_file_and_rest(events, "compressed_dir", ()),
+                        compress_method,
+                        destination_parent_dir,
+                        zip_metadata_encoding,
+                    )
+                finally:
+                    # 解压失败时也可能已经移动了部分内容
+                    await anyio.to_thread.run_sync(listing_cache.invalidate_tree, destination_parent_dir)
+                extracted = True
+    if not extracted:
+        logger.error(f"upload_directory fail: no compressed_dir in request: {parent_dir}")
+        raise_bad_request("field compressed_dir is required")
+    logger.info(f"upload_directory success: {destination_parent_dir}")
+
+
+def resolve_list_directory(path: AbsoluteUrlPath | RelativeUrlPath, follow_symlinks: bool) -> Path:
     file_path = get_os_path(path)
     if not file_path.exists():
         logger.error(f"list_directory fail: file not exists: {file_path}")
@@ -121,17 +478,193 @@ def list_directory_by_path(path: AbsoluteUrlPath | RelativeUrlPath, follow_symli
     if not file_path.is_dir():
         logger.error(f"list_directory fail: not directory: {file_path}")
         raise_bad_request(f"{path} is not directory")
+    return file_path
+
+
+def list_directory(
+    path: AbsoluteUrlPath | RelativeUrlPath,
+    follow_symlinks: bool,
+    sort: ListSortKey | None = None,
+    reverse: bool = False,
+    name_pattern: str | None = None,
+    file_type: FileType | None = None,
+    limit: int | None = None,
+    cursor: str | None = None,
+) -> tuple[Iterator[FileSystemInfo], str | None]:
+    """列出文件夹，返回文件信息的迭代器和下一页的游标
+
+    不排序也不分页时边遍历边产出，顺序与os.scandir一致；分页时默认按文件名排序
+    """
+    directory = resolve_list_directory(path, follow_symlinks)
+    entries = None
+    if listing_cache.enabled:
+        directory = Path(os.path.realpath(directory))
+        entries = listing_cache.get(directory, follow_symlinks)
+    if entries is None:
+        entries = listing.scan_directory(directory, follow_symlinks)
+        if listing_cache.enabled:
+            entries = listing_cache.iter_and_store(directory, follow_symlinks, entries)
+    entries = listing.filter_entries(entries, name_pattern, file_type)
+    if sort is None and limit is None and cursor is None:
+        return metrics.count_listing((entry.to_info() for entry in entries), "list"), None
+    page, next_cursor = listing.page_entries(entries, sort or ListSortKey.name, reverse, limit, cursor)
+    return metrics.count_listing((entry.to_info() for entry in page), "list"), next_cursor
+
+
+def walk_directory(
+    path: AbsoluteUrlPath | RelativeUrlPath,
+    max_depth: int | None,
+    include: list[str],
+    exclude: list[str],
+    follow_symlinks: bool,
+) -> Iterator[FileTreeInfo]:
+    """遍历文件树，文件夹不存在时立即报错，遍历本身在迭代时才进行"""
+    directory = resolve_list_directory(path, follow_symlinks)
+    logger.info(f"walk_directory: {directory}, {max_depth=}, {include=}, {exclude=}, {follow_symlinks=}")
+    entries = listing.walk_directory(directory, max_depth, include, exclude, follow_symlinks)
+    return metrics.count_listing((entry.to_tree_info(relative_path) for relative_path, entry in entries), "walk")
+
+
+def list_directory_by_path(path: AbsoluteUrlPath | RelativeUrlPath, follow_symlinks: bool) -> list[FileSystemInfo]:
+    infos, _ = list_directory(path, follow_symlinks)
+    return list(infos)
+
+
+def delete_path(path: AbsoluteUrlPath, recursive: bool) -> bool:
+    file_path = get_os_path(path)
+    if not file_path.exists():
+        logger.error(f"delete file fail: file not exists: {file_path}")
+        return False
+    try:
+        if file_path.is_file():
+            file_path.unlink()
+            logger.info(f"delete file success: {file_path}")
+            return True
+        if file_path.is_dir():
+            if recursive:
+                shutil.rmtree(file_path)
+                logger.info(f"delete directory success: {file_path}")
+                return True
+            else:
+                try:
+                    file_path.rmdir()
+                    logger.info(f"delete empty directory success: {file_path}")
+                    return True
+                except OSError:
+                    logger.error(f"delete empty directory fail: {file_path}")
+                    return False
+        return False
+    finally:
+        listing_cache.invalidate_tree(file_path)
+        checksum_store.remove_tree(file_path)
+
+
+def rename_path(path: AbsoluteUrlPath, new_name: str) -> None:
+    file_path = get_os_path(path)
+    if not file_path.exists():
+        logger.error(f"rename fail: file not exists: {path}")
+        raise_not_found(path)
+    if not is_valid_filename(new_name):
+        logger.error(f"rename fail: invalid filename: {new_name}")
+        raise_bad_request(f"invalid filename: {new_name}")
+    new_path = file_path.parent / new_name
+    if new_path.exists():
+        logger.error(f"rename fail: target exists: {new_path}")
+        raise_bad_request(f"target exists: {new_name}")
+
+    os.rename(file_path, new_path)
+    checksum_store.rename_tree(file_path, new_path)
+    listing_cache.invalidate_tree(file_path)
+    listing_cache.invalidate(new_path)
+
+
+def run_batch_operation(operation: BatchOperation) -> BatchOperationResult:
+    try:
+        match operation.type:
+            case BatchOperationType.delete:
+                if not delete_path(operation.path, operation.recursive):
+                    return BatchOperationResult(path=operation.path, success=False, error="not deleted")
+            case BatchOperationType.rename:
+                if operation.new_name is None:
+                    return BatchOperationResult(path=operation.path, success=False, error="new_name is required")
+                rename_path(operation.path, operation.new_name)
+    except HTTPException as e:
+        return BatchOperationResult(path=operation.path, success=False, error=e.detail)
+    except OSError as e:
+        logger.exception(f"batch operation fail: system error: {operation}")
+        return BatchOperationResult(path=operation.path, success=False, error=str(e))
+    return BatchOperationResult(path=operation.path, success=True)
+
+
+def run_batch_operations(operations: list[BatchOperation]) -> list[BatchOperationResult]:
+    """按顺序执行，某一项失败不影响其他项"""
+    results = [run_batch_operation(operation) for operation in operations]
+    failed = sum(not result.success for result in results)
+    logger.info(f"batch_operations success: {len(results) - failed} succeeded, {failed} failed")
+    return results
+
+
+async def store_batch_file(
+    target_url_directory: AbsoluteUrlPath,
+    target_filename: str,
+    chunks: AsyncIterator[bytes],
+    mkdir: bool,
+    allow_overwrite: bool,
+) -> None:
+    """不超过UPLOAD_WRITE_BUFFER_SIZE的小文件先收集到内存，在一次线程切换中完成检查、写入和替换，大文件流式写入"""
+    buffer = bytearray()
+    async for chunk in chunks:
+        buffer += chunk
+        if len(buffer) > UPLOAD_WRITE_BUFFER_SIZE:
+            break
+    else:
+        await anyio.to_thread.run_sync(
+            upload_file, target_url_directory, target_filename, BytesIO(buffer), mkdir, allow_overwrite
+        )
+        return
+
+    async def large_file_chunks() -> AsyncIterator[bytes]:
+        yield bytes(buffer)
+        async for chunk in chunks:
+            yield chunk
+
+    await upload_file_stream(target_url_directory, target_filename, large_file_chunks(), mkdir, allow_overwrite)
+
+
+async def receive_multipart_files(
+    request: Request, target_url_directory: AbsoluteUrlPath, mkdir: bool, allow_overwrite: bool
+) -> list[BatchOperationResult]:
+    """流式解析multipart请求体，写入所有files字段的文件，某个文件失败不影响其他文件
 
-    result = []
-    for fs_item in file_path.iterdir():
-        if fs_item.is_symlink() and follow_symlinks:
-            fs_item = fs_item.resolve()
-        name = fs_item.name
-        last_modified = datetime.fromtimestamp(fs_item.stat().st_mtime)
-        if fs_item.is_dir():
-            result.append(FileSystemInfo(type=FileType.directory, name=name, last_modified=last_modified))
-        elif fs_item.is_file():
-            result.append(
-                FileSystemInfo(type=FileType.file, name=name, last_modified=last_modified, size=fs_item.stat().st_size)
-            )
-    return result
+    mkdir、allow_overwrite字段必须位于所有文件之前；收到文件字段的结尾后才写入该文件
+    """
+    results = []
+    events = iter_multipart(request)
+    async for event in events:
+        match event:
+            case MultipartField(name="mkdir" | "allow_overwrite" as name) if results:
+                logger.error(f"upload_files fail: field {name} after files: {target_url_directory}")
+                raise_bad_request(f"form field {name} must come before files")
+            case MultipartField(name="mkdir", value=value):
+                mkdir = parse_form_bool(value)
+            case MultipartField(name="allow_overwrite", value=value):
+                allow_overwrite = parse_form_bool(value)
+            case MultipartFileStart(name="files", filename=filename):
+                chunks = iter_file_part(events)
+                result_path = f"{target_url_directory.rstrip('/')}/{filename}"
+                try:
+                    await store_batch_file(target_url_directory, filename, chunks, mkdir, allow_overwrite)
+                    results.append(BatchOperationResult(path=result_path, success=True))
+                except HTTPException as e:
+                    if e.detail == INCOMPLETE_BODY_DETAIL:
+                        # 请求体被截断时整个请求返回400，之前完整的文件已经写入
+                        raise
+                    results.append(BatchOperationResult(path=result_path, success=False, error=e.detail))
+                except OSError as e:
+                    results.append(BatchOperationResult(path=result_path, success=False, error=str(e)))
+                # 跳过失败文件的剩余内容
+                async for _ in chunks:
+                    pass
+    failed = sum(not result.success for result in results)
+    logger.info(f"upload_files success: {target_url_directory}, {len(results) - failed} succeeded, {failed} failed")
+    return results
@@ -13,6 +13,54 @@ class Settings(BaseSettings):
     # 临时文件目录
     TEMP_DIR: Path = Path(__file__).parent.parent.parent / ".data" / "temp"
 
+    # TEMP_DIR中正在写入的临时文件的总字节数上限，0表示不限制；写完的压缩包缓存由ARCHIVE_CACHE_MAX_SIZE限制
+    TEMP_SPACE_QUOTA: int = 0
+    # 写入临时文件或创建上传会话后，所在文件系统至少保留的空闲字节数，0表示只要求放得下
+    MIN_FREE_SPACE: int = 0
+    # 临时空间不足时排队等待的最长秒数，超时返回507
+    TEMP_SPACE_WAIT_TIMEOUT: float = 30.0
+    # 清理遗留临时文件和过期上传会话的间隔秒数，0表示只在启动时清理
+    TEMP_SWEEP_INTERVAL: float = 600.0
+    # 超过这么多秒没有修改的临时文件视为进程崩溃或请求中断后遗留的文件
+    TEMP_ORPHAN_AGE: float = 3600.0
+    # 超过这么多秒没有写入的上传会话视为已放弃，删除会话和已经写入的部分文件
+    UPLOAD_SESSION_TTL: float = 7 * 24 * 3600.0
+
+    # 按内容去重存储上传的文件，用户可见的文件是指向存储中blob的硬链接；
+    # 只在共享inode不会改变文件应有的权限和修改时间时去重
+    DEDUP_ENABLED: bool = False
+    # 去重存储目录，必须和FILE_DIR在同一个文件系统上
+    DEDUP_STORE_DIR: Path = Path(__file__).parent.parent.parent / ".data" / "blob"
+    # 回收没有引用的blob的间隔秒数，0表示不自动回收
+    DEDUP_GC_INTERVAL: float = 600.0
+
+    # 文件校验值数据库
+    CHECKSUM_DB_PATH: Path = Path(__file__).parent.parent.parent / ".data" / "checksum.sqlite3"
+
+    # 压缩包缓存的最大字节数，0表示不缓存
+    ARCHIVE_CACHE_MAX_SIZE: int = 10 * 1024 * 1024 * 1024
+
+    # 文件夹列表缓存的最大总项数，0表示不缓存
+    LISTING_CACHE_MAX_ENTRIES: int = 1_000_000
+    # 无法使用inotify时，文件夹列表缓存的有效秒数
+    LISTING_CACHE_TTL: float = 2.0
+
+    # 文件的ETag使用内容的sha256，而非inode、大小和修改时间；首次下载时需要读取整个文件
+    FILE_ETAG_CONTENT_HASH: bool = False
+    # 文件内容哈希缓存的最大条目数，0表示不缓存
+    METADATA_CACHE_MAX_ENTRIES: int = 100_000
+    # 服务器支持http.response.pathsend扩展（如granian）时由服务器发送完整文件；uvicorn不支持，总是按块发送
+    FILE_PATHSEND: bool = True
+
+    # 压缩响应的最小字节数，更小的响应不压缩
+    RESPONSE_COMPRESSION_MIN_SIZE: int = 1024
+    # 按优先顺序使用的响应压缩编码，可选zstd、br、gzip，br需要安装brotli
+    RESPONSE_COMPRESSION_ENCODINGS: list[str] = ["zstd", "br", "gzip"]
+    # 预压缩文件目录，None表示不使用；下载文件时客户端接受对应编码，
+    # 则发送其中与文件路径、大小和修改时间都匹配的预压缩文件；
+    # FILE_DIR中文件旁的同名.gz等文件是用户的数据，不作为预压缩文件
+    PRECOMPRESSED_DIR: Path | None = None
+
     # 调试模式
     DEBUG_MODE: bool = False
 
@@ -0,0 +1,213 @@
+import os
+import queue
+import shutil
+import threading
+import uuid
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Callable, Iterable
+
+import anyio
+from loguru import logger
+
+from zjbs_file_server.checksum import Checksums, ChecksumTarFile, checksum_store
+from zjbs_file_server.codec import open_decompress_reader
+from zjbs_file_server.dedup_store import dedup_store
+from zjbs_file_server.temp_space import temp_space
+from zjbs_file_server.types import CompressMethod
+from zjbs_file_server.util import raise_bad_request
+
+# 接收方攒够这么多数据再交给解压线程
+PIPE_CHUNK_SIZE: int = 1024 * 1024
+# 解压线程最多落后接收方的块数
+PIPE_QUEUE_SIZE: int = 16
+
+
+class ChunkPipeClosed(Exception):
+    """读取方已经退出，写入方不需要再写入"""
+
+
+class ChunkPipeAborted(OSError):
+    """写入方出错，数据不完整"""
+
+
+class ChunkPipe:
+    """把异步接收到的数据块交给同步的读取线程，队列有界，读取方跟不上时写入方等待"""
+
+    _ABORT = object()
+
+    def __init__(self):
+        self.chunk_queue: queue.Queue[bytes | object | None] = queue.Queue(maxsize=PIPE_QUEUE_SIZE)
+        self.reader_closed = threading.Event()
+        self.current = b""
+        self.position = 0
+        self.eof = False
+
+    def put(self, chunk: bytes | None) -> None:
+        """chunk为None表示数据已经全部写入"""
+        while True:
+            if self.reader_closed.is_set():
+                raise ChunkPipeClosed()
+            try:
+                self.chunk_queue.put(chunk, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def abort(self) -> None:
+        try:
+            self.put(self._ABORT)
+        except ChunkPipeClosed:
+            pass
+
+    def read(self, size: int = -1) -> bytes:
+        parts = []
+        while size != 0:
+            if self.position >= len(self.current):
+                if self.eof:
+                    break
+                chunk = self.chunk_queue.get()
+                if chunk is None:
+                    self.eof = True
+                    break
+                if chunk is self._ABORT:
+                    raise ChunkPipeAborted("upload aborted")
+                self.current, self.position = chunk, 0
+                continue
+            end = len(self.current) if size < 0 else min(len(self.current), self.position + size)
+            parts.append(self.current[self.position : end])
+            if size > 0:
+                size -= end - self.position
+            self.position = end
+        return b"".join(parts)
+
+    def close_reader(self) -> None:
+        self.reader_closed.set()
+
+
+def find_conflicts(staging_dir: Path, destination_dir: Path) -> list[Path]:
+    """目标文件夹中与暂存内容类型不同的已有条目：文件夹对应已有的文件或符号链接，文件对应已有的文件夹"""
+    conflicts = []
+    with os.scandir(staging_dir) as entries:
+        for entry in entries:
+            target_path = destination_dir / entry.name
+            if not os.path.lexists(target_path):
+                continue
+            target_is_dir = target_path.is_dir() and not target_path.is_symlink()
+            if entry.is_dir(follow_symlinks=False):
+                if target_is_dir:
+                    conflicts += find_conflicts(Path(entry.path), target_path)
+                else:
+                    conflicts.append(target_path)
+            elif target_is_dir:
+                conflicts.append(target_path)
+    return conflicts
+
+
+def move_staged(staging_dir: Path, destination_dir: Path) -> None:
+    """不存在的条目整体重命名，已存在的文件夹逐层合并"""
+    with os.scandir(staging_dir) as entries:
+        for entry in entries:
+            target_path = destination_dir / entry.name
+            if entry.is_dir(follow_symlinks=False) and target_path.is_dir() and not target_path.is_symlink():
+                move_staged(Path(entry.path), target_path)
+            else:
+                os.replace(entry.path, target_path)
+
+
+def publish_staging(staging_dir: Path, destination_dir: Path) -> None:
+    """把暂存文件夹中的内容移动到目标文件夹；先检查类型冲突，有冲突时不移动任何条目"""
+    if conflicts := find_conflicts(staging_dir, destination_dir):
+        relative_paths = [conflict.relative_to(destination_dir).as_posix() for conflict in conflicts]
+        logger.error(f"upload_directory fail: conflicts with existing entries: {destination_dir}, {relative_paths}")
+        raise_bad_request(f"conflicts with existing entries: {', '.join(relative_paths)}")
+    move_staged(staging_dir, destination_dir)
+
+
+def check_member_paths(names: Iterable[str], staging_dir: Path) -> None:
+    """压缩包中的路径解析后必须在暂存文件夹中"""
+    staging_root = os.path.realpath(staging_dir)
+    for name in names:
+        target_path = os.path.realpath(os.path.join(staging_root, name))
+        if os.path.commonpath([staging_root, target_path]) != staging_root:
+            logger.error(f"upload_directory fail: member outside destination: {name}")
+            raise_bad_request(f"archive member outside destination: {name}")
+
+
+def collect_staged_files(extracted: dict[str, Checksums], staging_dir: Path, checksums: dict[str, Checksums]) -> None:
+    """解压时计算的校验值以相对于暂存文件夹的路径为键写入checksums；开启去重时把文件换成指向blob的链接"""
+    for path, file_checksums in extracted.items():
+        # 解压的文件保留压缩包中的修改时间和权限
+        dedup_store.link_into(path, file_checksums, keep_mtime=True)
+        checksums[os.path.relpath(path, staging_dir)] = file_checksums
+
+
+def extract_tar_to_staging(
+    pipe: ChunkPipe, compress_method: CompressMethod, staging_dir: Path, checksums: dict[str, Checksums]
+) -> None:
+    with open_decompress_reader(pipe, compress_method) as reader:
+        with ChecksumTarFile.open(fileobj=reader, mode="r|") as tar_file:
+            # data过滤器拒绝绝对路径、..、指向暂存文件夹外的链接和设备文件，并去掉setuid等权限位
+            tar_file.extractall(staging_dir, filter="data")
+    collect_staged_files(tar_file.checksums, staging_dir, checksums)
+
+
+def publish_checksums(checksums: dict[str, Checksums], destination_parent_dir: Path) -> None:
+    checksum_store.put_many(
+        (destination_parent_dir / relative_path, file_checksums) for relative_path, file_checksums in checksums.items()
+    )
+
+
+@asynccontextmanager
+async def staging_directory(destination_parent_dir: Path) -> AsyncIterator[tuple[Path, dict[str, Checksums]]]:
+    """在目标文件夹中创建暂存文件夹，解压成功后把内容和校验值发布到目标文件夹；解压时不会修改已有的文件"""
+    staging_dir = destination_parent_dir / f".upload-{uuid.uuid4().hex}"
+    await anyio.to_thread.run_sync(staging_dir.mkdir)
+    record_path = await anyio.to_thread.run_sync(temp_space.track, staging_dir)
+    checksums: dict[str, Checksums] = {}
+    try:
+        yield staging_dir, checksums
+        await anyio.to_thread.run_sync(publish_staging, staging_dir, destination_parent_dir)
+        await anyio.to_thread.run_sync(publish_checksums, checksums, destination_parent_dir)
+    finally:
+        await anyio.to_thread.run_sync(shutil.rmtree, staging_dir, True)
+        await anyio.to_thread.run_sync(temp_space.untrack, record_path)
+
+
+def _consume_pipe(pipe: ChunkPipe, consume: Callable[..., None], *args) -> None:
+    try:
+        consume(pipe, *args)
+    finally:
+        pipe.close_reader()
+
+
+async def consume_in_thread(chunks: AsyncIterator[bytes], consume: Callable[..., None], *args) -> None:
+    """在线程中调用consume(pipe, *args)，边接收边把数据块通过ChunkPipe交给它读取"""
+    pipe = ChunkPipe()
+    async with anyio.create_task_group() as task_group:
+        task_group.start_soon(anyio.to_thread.run_sync, _consume_pipe, pipe, consume, *args)
+        try:
+            buffer = bytearray()
+            async for chunk in chunks:
+                buffer += chunk
+                if len(buffer) >= PIPE_CHUNK_SIZE:
+                    await anyio.to_thread.run_sync(pipe.put, bytes(buffer))
+                    buffer.clear()
+            if buffer:
+                await anyio.to_thread.run_sync(pipe.put, bytes(buffer))
+            await anyio.to_thread.run_sync(pipe.put, None)
+        except ChunkPipeClosed:
+            # 例如tar包结束标记之后的填充数据不需要读取；读取方出错时由任务组抛出读取线程的异常
+            pass
+        except BaseException:
+            # 让读取线程退出，否则任务组会一直等待
+            await anyio.to_thread.run_sync(pipe.abort)
+            raise
+
+
+async def extract_tar_stream(
+    chunks: AsyncIterator[bytes], compress_method: CompressMethod, destination_parent_dir: Path
+) -> None:
+    """边接收边解压到目标文件夹中的暂存文件夹，全部解压成功后再移动到目标文件夹"""
+    async with staging_directory(destination_parent_dir) as (staging_dir, checksums):
+        await consume_in_thread(chunks, extract_tar_to_staging, compress_method, staging_dir, checksums)
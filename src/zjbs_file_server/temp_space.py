@@ -0,0 +1,285 @@
+"""TEMP_DIR的空间管理：登记正在写入的临时文件预留的空间，超过配额或空闲空间不足时排队等待或拒绝；
+定期清理进程崩溃或请求中断后遗留的临时文件和过期的上传会话
+
+TEMP_DIR中只清理本服务命名的临时文件；写在FILE_DIR中的临时文件和暂存文件夹通过track登记在TEMP_DIR/tracked中，
+遗留的按登记记录删除，不需要遍历FILE_DIR
+
+预留按写入的字节数逐步增加，每次至少增加RESERVE_STEP（不超过配额），避免每个数据块都查询文件系统的空闲空间；
+多个进程共用TEMP_DIR时配额只在进程内生效，空闲空间检查对所有进程有效
+"""
+
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator
+
+from loguru import logger
+
+from zjbs_file_server import upload_session
+from zjbs_file_server.settings import settings
+from zjbs_file_server.types import TempSpaceUsage
+
+# 每次增加预留的最小字节数
+RESERVE_STEP: int = 64 * 1024 * 1024
+# 排队等待时重新检查空闲空间的间隔秒数，其他进程释放的空间不会通知本进程
+WAIT_RECHECK_INTERVAL: float = 1.0
+# TEMP_DIR中登记FILE_DIR临时路径的文件夹
+TRACKED_DIR_NAME: str = "tracked"
+
+# new_temp_file、压缩包缓存的临时文件和登记记录的文件名
+_TEMP_FILE_PATTERN = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+_ARCHIVE_CACHE_TEMP_PATTERN = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\.tmp$")
+
+
+class Reservation:
+    """一个临时文件预留的空间，record记录写入的字节数，超出预留时增加预留"""
+
+    def __init__(self, manager: "TempSpaceManager", path: Path | None):
+        self.manager = manager
+        self.path = path
+        self.size = 0
+        self.written = 0
+
+    def record(self, nbytes: int, timeout: float = 0) -> bool:
+        """空间不足时最多等待timeout秒，仍然不足时返回False，不记录这次写入"""
+        if self.written + nbytes > self.size:
+            extra = max(self.written + nbytes - self.size, self.manager.reserve_step)
+            if not self.manager.acquire(self, extra, timeout):
+                return False
+        self.written += nbytes
+        return True
+
+    def release(self) -> None:
+        self.manager.release(self)
+
+
+class TempSpaceManager:
+    def __init__(
+        self,
+        temp_dir: Path,
+        quota: int,
+        min_free_space: int,
+        sweep_interval: float,
+        orphan_age: float,
+        session_ttl: float,
+    ):
+        self.temp_dir = temp_dir
+        self.quota = quota
+        self.min_free_space = min_free_space
+        self.sweep_interval = sweep_interval
+        self.orphan_age = orphan_age
+        self.session_ttl = session_ttl
+        self.condition = threading.Condition()
+        self.reservations: set[Reservation] = set()
+        self.reserved = 0
+        self.sweeper_started = False
+        self.last_sweep: datetime | None = None
+        self.swept_files = 0
+        self.swept_bytes = 0
+        # 本进程正在使用的登记记录
+        self.tracked: set[str] = set()
+
+    @property
+    def reserve_step(self) -> int:
+        """配额小于RESERVE_STEP时按配额预留，否则任何写入都无法预留"""
+        return min(RESERVE_STEP, self.quota) if self.quota > 0 else RESERVE_STEP
+
+    def _admit(self, size: int, free: int) -> bool:
+        if self.quota > 0 and self.reserved + size > self.quota:
+            return False
+        # 已经写入的部分已经从空闲空间中扣除，只需要再扣除预留但还没有写入的部分
+        pending = sum(reservation.size - reservation.written for reservation in self.reservations)
+        return free - pending - size >= self.min_free_space
+
+    def acquire(self, reservation: Reservation, size: int, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while True:
+            # 在锁外查询空闲空间，其他线程预留时不需要等待文件系统调用
+            free = shutil.disk_usage(self.temp_dir).free
+            with self.condition:
+                if self._admit(size, free):
+                    reservation.size += size
+                    self.reserved += size
+                    self.reservations.add(reservation)
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(f"temp space exhausted: {size=}, reserved={self.reserved}, quota={self.quota}")
+                    return False
+                self.condition.wait(min(remaining, WAIT_RECHECK_INTERVAL))
+
+    def release(self, reservation: Reservation) -> None:
+        with self.condition:
+            if reservation in self.reservations:
+                self.reservations.discard(reservation)
+                self.reserved -= reservation.size
+                self.condition.notify_all()
+
+    def reserve(self, path: Path | None = None) -> Reservation:
+        """path为预留空间写入的临时文件，清理时跳过"""
+        return Reservation(self, path)
+
+    @contextmanager
+    def reservation(self, path: Path | None = None) -> Iterator[Reservation]:
+        reservation = self.reserve(path)
+        try:
+            yield reservation
+        finally:
+            reservation.release()
+
+    def _is_reserved(self, path: str) -> bool:
+        with self.condition:
+            return any(str(reservation.path) == path for reservation in self.reservations)
+
+    def _remove_orphans(self, dir_path: Path, pattern: re.Pattern, now: float) -> None:
+        try:
+            with os.scandir(dir_path) as entries:
+                candidates = [entry for entry in entries if pattern.match(entry.name)]
+        except FileNotFoundError:
+            return
+        for entry in candidates:
+            try:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                stat_result = entry.stat(follow_symlinks=False)
+                if now - stat_result.st_mtime <= self.orphan_age or self._is_reserved(entry.path):
+                    continue
+                os.unlink(entry.path)
+            except OSError:
+                continue
+            self.swept_files += 1
+            self.swept_bytes += stat_result.st_size
+            logger.info(f"temp space: removed orphaned temp file: {entry.path}")
+
+    def track(self, path: Path) -> Path:
+        """登记FILE_DIR中的临时文件或暂存文件夹，返回登记记录的路径；正常结束时由调用方删除path后调用untrack"""
+        record_path = self.temp_dir / TRACKED_DIR_NAME / str(uuid.uuid4())
+        record_path.parent.mkdir(parents=True, exist_ok=True)
+        record_path.write_text(str(path), encoding="UTF-8")
+        with self.condition:
+            self.tracked.add(str(record_path))
+        return record_path
+
+    def untrack(self, record_path: Path | None) -> None:
+        if record_path is None:
+            return
+        with self.condition:
+            self.tracked.discard(str(record_path))
+        record_path.unlink(missing_ok=True)
+
+    def _remove_tracked_orphans(self, now: float) -> None:
+        """登记的路径超过orphan_age没有修改，并且不是本进程正在使用的，视为遗留的临时路径"""
+        try:
+            with os.scandir(self.temp_dir / TRACKED_DIR_NAME) as entries:
+                candidates = [entry for entry in entries if _TEMP_FILE_PATTERN.match(entry.name)]
+        except FileNotFoundError:
+            return
+        for entry in candidates:
+            with self.condition:
+                if entry.path in self.tracked:
+                    continue
+            try:
+                if now - entry.stat().st_mtime <= self.orphan_age:
+                    continue
+                path = Path(entry.path).read_text(encoding="UTF-8")
+                latest_mtime, size = _latest_mtime_and_size(path)
+                if latest_mtime is not None and now - latest_mtime <= self.orphan_age:
+                    continue
+                # 只删除FILE_DIR中的路径，记录被篡改时不会删除其他文件
+                if latest_mtime is not None and Path(path).is_relative_to(settings.FILE_DIR):
+                    if os.path.isdir(path) and not os.path.islink(path):
+                        shutil.rmtree(path)
+                    else:
+                        os.unlink(path)
+                    self.swept_files += 1
+                    self.swept_bytes += size
+                    logger.info(f"temp space: removed orphaned temp path: {path}")
+                os.unlink(entry.path)
+            except OSError:
+                continue
+
+    def sweep(self) -> None:
+        """删除超过orphan_age没有修改的临时文件和超过session_ttl没有写入的上传会话"""
+        now = time.time()
+        # TEMP_DIR顶层的临时文件，压缩包缓存中没有写完的.tmp文件，以及登记的FILE_DIR中的临时路径
+        self._remove_orphans(self.temp_dir, _TEMP_FILE_PATTERN, now)
+        self._remove_orphans(self.temp_dir / "archive_cache", _ARCHIVE_CACHE_TEMP_PATTERN, now)
+        self._remove_tracked_orphans(now)
+        sessions, freed = upload_session.expire_sessions(self.session_ttl)
+        self.swept_files += sessions
+        self.swept_bytes += freed
+        self.last_sweep = datetime.now()
+
+    def start_sweeper(self) -> None:
+        """在后台线程中立即清理一次，之后每隔sweep_interval秒清理一次"""
+        with self.condition:
+            if self.sweeper_started:
+                return
+            self.sweeper_started = True
+        threading.Thread(target=self._sweep_loop, name="temp-space-sweeper", daemon=True).start()
+
+    def _sweep_loop(self) -> None:
+        while True:
+            try:
+                self.sweep()
+            except OSError:
+                logger.exception("temp space: sweep error")
+            if self.sweep_interval <= 0:
+                return
+            time.sleep(self.sweep_interval)
+
+    def usage(self) -> TempSpaceUsage:
+        disk_usage = shutil.disk_usage(self.temp_dir)
+        with self.condition:
+            reserved, written = self.reserved, sum(reservation.written for reservation in self.reservations)
+            active = len(self.reservations)
+        return TempSpaceUsage(
+            quota=self.quota,
+            reserved=reserved,
+            written=written,
+            active_reservations=active,
+            disk_total=disk_usage.total,
+            disk_free=disk_usage.free,
+            min_free_space=self.min_free_space,
+            upload_sessions=upload_session.count_sessions(),
+            last_sweep=self.last_sweep,
+            swept_files=self.swept_files,
+            swept_bytes=self.swept_bytes,
+        )
+
+
+def _latest_mtime_and_size(path: str) -> tuple[float | None, int]:
+    """文件或文件夹中所有条目最晚的修改时间和总字节数，路径不存在时修改时间为None"""
+    try:
+        stat_result = os.lstat(path)
+    except FileNotFoundError:
+        return None, 0
+    latest_mtime, size = stat_result.st_mtime, stat_result.st_size
+    if not os.path.isdir(path) or os.path.islink(path):
+        return latest_mtime, size
+    for dir_path, dir_names, file_names in os.walk(path):
+        for name in dir_names + file_names:
+            try:
+                stat_result = os.lstat(os.path.join(dir_path, name))
+            except FileNotFoundError:
+                continue
+            latest_mtime = max(latest_mtime, stat_result.st_mtime)
+            if name in file_names:
+                size += stat_result.st_size
+    return latest_mtime, size
+
+
+temp_space = TempSpaceManager(
+    settings.TEMP_DIR,
+    settings.TEMP_SPACE_QUOTA,
+    settings.MIN_FREE_SPACE,
+    settings.TEMP_SWEEP_INTERVAL,
+    settings.TEMP_ORPHAN_AGE,
+    settings.UPLOAD_SESSION_TTL,
+)
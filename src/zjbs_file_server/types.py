@@ -26,11 +26,24 @@ class CompressMethod(StrEnum):
     zip = "zip"
     tgz = "tgz"
     txz = "txz"
+    # tar + 多线程zstd
+    tzst = "tzst"
+    # tar + 块并行gzip，结果是普通的gzip文件
+    ptgz = "ptgz"
 
 
 class FileType(StrEnum):
     file = "file"
     directory = "directory"
+    # 不跟随符号链接时列出的链接本身
+    symlink = "symlink"
+
+
+class ListSortKey(StrEnum):
+    name = "name"
+    last_modified = "last_modified"
+    size = "size"
+    type = "type"
 
 
 class FileSystemInfo(BaseModel):
@@ -40,6 +53,65 @@ class FileSystemInfo(BaseModel):
     size: int | None = None
 
 
+class FileTreeInfo(FileSystemInfo):
+    # 相对于遍历起点的路径，以/分隔
+    path: str
+
+
+class FileChecksum(BaseModel):
+    path: str
+    size: int
+    sha256: str
+    # 8位十六进制
+    crc32: str
+
+
+class UploadSessionInfo(BaseModel):
+    session_id: str
+    directory: str
+    filename: str
+    size: int
+    received: list[tuple[int, int]]
+
+
+class TempSpaceUsage(BaseModel):
+    # TEMP_DIR中正在写入的临时文件的配额，0表示不限制
+    quota: int
+    # 正在写入的临时文件预留和已经写入的字节数
+    reserved: int
+    written: int
+    active_reservations: int
+    # TEMP_DIR所在文件系统的空间
+    disk_total: int
+    disk_free: int
+    min_free_space: int
+    upload_sessions: int
+    # 最近一次清理的时间，以及启动以来清理的文件数和字节数
+    last_sweep: datetime | None
+    swept_files: int
+    swept_bytes: int
+
+
+class BatchOperationType(StrEnum):
+    delete = "delete"
+    rename = "rename"
+
+
+class BatchOperation(BaseModel):
+    type: BatchOperationType
+    path: AbsoluteUrlPath
+    # 删除时是否递归删除
+    recursive: bool = False
+    # 重命名时的新文件名
+    new_name: str | None = None
+
+
+class BatchOperationResult(BaseModel):
+    path: str
+    success: bool
+    error: str | None = None
+
+
 def is_valid_filename(filename: str) -> bool:
     return (
         len(filename) <= 255
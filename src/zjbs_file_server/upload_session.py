@@ -0,0 +1,248 @@
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import AsyncIterator
+
+import anyio
+from loguru import logger
+
+from zjbs_file_server import temp_space
+from zjbs_file_server.checksum import ChecksumWriter, checksum_store, compute_checksums
+from zjbs_file_server.dedup_store import dedup_store
+from zjbs_file_server.listing_cache import listing_cache
+from zjbs_file_server.settings import settings
+from zjbs_file_server.types import AbsoluteUrlPath, UploadSessionInfo, is_valid_filename
+from zjbs_file_server.util import check_free_space, get_os_path, raise_bad_request, raise_not_found
+
+_SESSION_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+# 会话文件夹中正在上传的内容，不放在目标文件夹中，不会出现在列表和压缩包中
+PART_FILENAME: str = "data.part"
+
+
+def get_sessions_dir() -> Path:
+    return settings.TEMP_DIR / "upload_session"
+
+
+def get_session_dir(session_id: str) -> Path:
+    if _SESSION_ID_PATTERN.match(session_id) is None:
+        logger.error(f"upload session fail: invalid session id: {session_id}")
+        raise_bad_request(f"invalid upload session id: {session_id}")
+    return get_sessions_dir() / session_id
+
+
+def get_part_path(session_id: str) -> Path:
+    return get_session_dir(session_id) / PART_FILENAME
+
+
+def load_session(session_id: str) -> dict:
+    session_dir = get_session_dir(session_id)
+    try:
+        with open(session_dir / "session.json", encoding="UTF-8") as session_file:
+            return json.load(session_file)
+    except FileNotFoundError:
+        logger.error(f"upload session fail: session not exists: {session_id}")
+        raise_not_found(f"upload session {session_id}")
+
+
+def load_received_ranges(session_id: str) -> list[tuple[int, int]]:
+    """每个已写完的块在ranges目录下留一个名为"start-end"的空文件，多个进程并发写入时不需要加锁"""
+    ranges = []
+    with os.scandir(get_session_dir(session_id) / "ranges") as entries:
+        for entry in entries:
+            start, end = entry.name.split("-")
+            ranges.append((int(start), int(end)))
+    ranges.sort()
+    merged: list[tuple[int, int]] = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def get_session_info(session_id: str) -> UploadSessionInfo:
+    session = load_session(session_id)
+    return UploadSessionInfo(
+        session_id=session_id,
+        directory=session["directory"],
+        filename=session["filename"],
+        size=session["size"],
+        received=load_received_ranges(session_id),
+    )
+
+
+def create_session(
+    directory: AbsoluteUrlPath, filename: str, size: int, mkdir: bool, allow_overwrite: bool
+) -> UploadSessionInfo:
+    target_directory_path = get_os_path(directory)
+    if not target_directory_path.exists():
+        if mkdir:
+            target_directory_path.mkdir(parents=True)
+        else:
+            logger.error(f"create upload session fail: directory not exists: {target_directory_path}")
+            raise_bad_request(f"directory {directory} not exists")
+    if not is_valid_filename(filename):
+        logger.error(f"create upload session fail: invalid filename: {filename}")
+        raise_bad_request(f"invalid filename: {filename}")
+    if size < 0:
+        logger.error(f"create upload session fail: invalid size: {size}")
+        raise_bad_request(f"invalid size: {size}")
+    target_path = target_directory_path / filename
+    if target_path.exists() and not allow_overwrite:
+        logger.error(f"create upload session fail: file already exists: {target_path}")
+        raise_bad_request(f"file {directory}/{filename} already exists")
+
+    # 预先分配的是稀疏文件，不会占用空间，创建时检查空闲空间是否足够；不在同一文件系统时提交时还要复制到目标文件夹
+    check_free_space(settings.TEMP_DIR, size)
+    check_free_space(target_directory_path, size)
+
+    session_id = uuid.uuid4().hex
+    session_dir = get_session_dir(session_id)
+    (session_dir / "ranges").mkdir(parents=True)
+    # 预先分配目标大小的稀疏文件，各个块可以按偏移量并发写入
+    with open(get_part_path(session_id), "wb") as part_file:
+        part_file.truncate(size)
+    session = {
+        "directory": directory,
+        "filename": filename,
+        "size": size,
+        "allow_overwrite": allow_overwrite,
+        "created": datetime.now().isoformat(),
+    }
+    with open(session_dir / "session.json", "w", encoding="UTF-8") as session_file:
+        json.dump(session, session_file)
+    logger.info(f"create upload session success: {session_id}, {target_path}")
+    return UploadSessionInfo(session_id=session_id, directory=directory, filename=filename, size=size, received=[])
+
+
+async def write_chunk(session_id: str, offset: int, chunks: AsyncIterator[bytes]) -> None:
+    session = await anyio.to_thread.run_sync(load_session, session_id)
+    if offset < 0 or offset > session["size"]:
+        logger.error(f"write upload chunk fail: invalid offset: {session_id}, {offset}")
+        raise_bad_request(f"invalid offset: {offset}")
+
+    part_path = get_part_path(session_id)
+    written = 0
+    try:
+        async with await anyio.open_file(part_path, "r+b") as part_file:
+            await part_file.seek(offset)
+            async for chunk in chunks:
+                if offset + written + len(chunk) > session["size"]:
+                    logger.error(f"write upload chunk fail: chunk exceeds file size: {session_id}, {offset}")
+                    raise_bad_request(f"chunk at offset {offset} exceeds file size {session['size']}")
+                await part_file.write(chunk)
+                written += len(chunk)
+    except FileNotFoundError:
+        logger.error(f"write upload chunk fail: part file not exists: {part_path}")
+        raise_not_found(f"upload session {session_id}")
+    if written > 0:
+        await anyio.Path(get_session_dir(session_id) / "ranges" / f"{offset}-{offset + written}").touch()
+
+
+def commit_session(session_id: str) -> None:
+    session = load_session(session_id)
+    received = load_received_ranges(session_id)
+    if session["size"] > 0 and received != [(0, session["size"])]:
+        logger.error(f"commit upload session fail: incomplete: {session_id}, {received}")
+        raise_bad_request(f"upload session {session_id} is incomplete")
+
+    target_directory_path = get_os_path(session["directory"])
+    target_path = target_directory_path / session["filename"]
+    if target_path.exists() and not session["allow_overwrite"]:
+        logger.error(f"commit upload session fail: file already exists: {target_path}")
+        raise_bad_request(f"file {session['directory']}/{session['filename']} already exists")
+    part_path = get_part_path(session_id)
+    try:
+        publish_part(part_path, target_path)
+    except FileNotFoundError:
+        logger.error(f"commit upload session fail: part file or directory not exists: {part_path}, {target_path}")
+        raise_not_found(f"upload session {session_id}")
+    listing_cache.invalidate(target_directory_path)
+    shutil.rmtree(get_session_dir(session_id), ignore_errors=True)
+    logger.info(f"commit upload session success: {session_id}, {target_path}")
+
+
+def publish_part(part_path: Path, target_path: Path) -> None:
+    """计算校验值，与其他上传方式一样存入去重存储和校验值数据库，再替换为目标文件
+
+    会话文件夹与目标文件夹不在同一文件系统时不能直接重命名，先复制到目标文件夹中的临时文件
+    """
+    if part_path.stat().st_dev == target_path.parent.stat().st_dev:
+        checksums = compute_checksums(part_path)
+        dedup_store.link_into(part_path, checksums, target_path)
+        os.replace(part_path, target_path)
+        checksum_store.put(target_path, checksums)
+        return
+    tmp_path = None
+    record_path = None
+    try:
+        with open(part_path, "rb") as reader:
+            with NamedTemporaryFile(delete=False, dir=target_path.parent, prefix=target_path.name) as tmp_file:
+                tmp_path = tmp_file.name
+                record_path = temp_space.temp_space.track(Path(tmp_path))
+                writer = ChecksumWriter(tmp_file)
+                shutil.copyfileobj(reader, writer)
+        checksums = writer.checksums()
+        dedup_store.link_into(tmp_path, checksums, target_path)
+        os.replace(tmp_path, target_path)
+        checksum_store.put(target_path, checksums)
+    finally:
+        if tmp_path is not None:
+            Path(tmp_path).unlink(missing_ok=True)
+        temp_space.temp_space.untrack(record_path)
+        part_path.unlink(missing_ok=True)
+
+
+def abort_session(session_id: str) -> None:
+    load_session(session_id)
+    shutil.rmtree(get_session_dir(session_id), ignore_errors=True)
+    logger.info(f"abort upload session success: {session_id}")
+
+
+def count_sessions() -> int:
+    try:
+        with os.scandir(get_sessions_dir()) as entries:
+            return sum(1 for entry in entries if _SESSION_ID_PATTERN.match(entry.name) is not None)
+    except FileNotFoundError:
+        return 0
+
+
+def expire_sessions(ttl: float) -> tuple[int, int]:
+    """删除超过ttl秒没有写入的上传会话及其中的部分文件，返回删除的会话数和部分文件占用的字节数
+
+    会话目录、ranges目录和部分文件的修改时间都会在写入块时更新，取最晚的一个作为最近活动时间
+    """
+    try:
+        with os.scandir(get_sessions_dir()) as entries:
+            session_ids = [entry.name for entry in entries if _SESSION_ID_PATTERN.match(entry.name) is not None]
+    except FileNotFoundError:
+        return 0, 0
+
+    now = time.time()
+    expired = freed = 0
+    for session_id in session_ids:
+        session_dir = get_sessions_dir() / session_id
+        part_blocks, mtimes = 0, []
+        # 创建会话时中断可能没有部分文件，只按会话目录的修改时间判断
+        for path in (session_dir, session_dir / "ranges", session_dir / PART_FILENAME):
+            try:
+                stat_result = path.stat()
+            except OSError:
+                continue
+            mtimes.append(stat_result.st_mtime)
+            if path.name == PART_FILENAME:
+                part_blocks = stat_result.st_blocks
+        if not mtimes or now - max(mtimes) <= ttl:
+            continue
+        freed += part_blocks * 512
+        shutil.rmtree(session_dir, ignore_errors=True)
+        expired += 1
+        logger.info(f"expire upload session: {session_id}")
+    return expired, freed
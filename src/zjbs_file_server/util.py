@@ -1,9 +1,17 @@
+import os
+import shutil
 import uuid
 from pathlib import Path
 from typing import Never
 
 from fastapi import HTTPException
-from starlette.status import HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND, HTTP_500_INTERNAL_SERVER_ERROR
+from loguru import logger
+from starlette.status import (
+    HTTP_400_BAD_REQUEST,
+    HTTP_404_NOT_FOUND,
+    HTTP_500_INTERNAL_SERVER_ERROR,
+    HTTP_507_INSUFFICIENT_STORAGE,
+)
 
 from zjbs_file_server.settings import settings
 
@@ -20,9 +28,46 @@ def raise_internal_server_error(message: str) -> Never:
     raise HTTPException(status_code=HTTP_500_INTERNAL_SERVER_ERROR, detail=message)
 
 
-def get_os_path(url_path: str, base_path: Path = settings.FILE_DIR) -> Path:
-    return base_path / url_path.lstrip("/")
+def raise_insufficient_storage(message: str) -> Never:
+    raise HTTPException(status_code=HTTP_507_INSUFFICIENT_STORAGE, detail=message)
+
+
+def get_os_path(url_path: str, base_path: Path | None = None) -> Path:
+    """base_path默认为调用时的FILE_DIR"""
+    return (settings.FILE_DIR if base_path is None else base_path) / url_path.lstrip("/")
 
 
 def new_temp_file() -> Path:
     return settings.TEMP_DIR / str(uuid.uuid4())
+
+
+def directory_size(path: str) -> int:
+    """文件夹中所有文件的总字节数，不跟随符号链接，遍历时消失的条目忽略"""
+    total = 0
+    stack = [path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            total += entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+    return total
+
+
+def check_free_space(path: Path, size: int) -> None:
+    """写入size字节后path所在文件系统的空闲空间少于MIN_FREE_SPACE时返回507"""
+    free = shutil.disk_usage(path).free
+    if free - size < settings.MIN_FREE_SPACE:
+        logger.error(f"check free space fail: {path}, {size=}, {free=}")
+        raise_insufficient_storage(f"not enough free space for {size} bytes")
+
+
+def parse_form_bool(value: str) -> bool:
+    return value.strip().lower() in ("1", "true", "on", "yes")
@@ -4,6 +4,11 @@ from tempfile import SpooledTemporaryFile, TemporaryDirectory
 
 import pytest
 
+from zjbs_file_server.archive_cache import archive_cache
+from zjbs_file_server.checksum import checksum_store
+from zjbs_file_server.dedup_store import dedup_store
+from zjbs_file_server.settings import settings
+from zjbs_file_server.temp_space import temp_space
 from zjbs_file_server.util import get_os_path
 
 
@@ -43,3 +48,52 @@ def file_server_directory(request) -> Path:
         yield dir_path
     finally:
         shutil.rmtree(dir_path)
+
+
+def redirect_storage(root: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    file_dir, temp_dir = root / "file", root / "temp"
+    file_dir.mkdir()
+    temp_dir.mkdir()
+    monkeypatch.setattr(settings, "FILE_DIR", file_dir)
+    monkeypatch.setattr(settings, "TEMP_DIR", temp_dir)
+    monkeypatch.setattr(archive_cache, "cache_dir", temp_dir / "archive_cache")
+    monkeypatch.setattr(temp_space, "temp_dir", temp_dir)
+    monkeypatch.setattr(dedup_store, "store_dir", root / "blob")
+
+
+@pytest.fixture(scope="session", autouse=True)
+def session_storage(tmp_path_factory: pytest.TempPathFactory) -> Path:
+    """模块级的TestClient启动时创建目录、清理临时文件，也不能用.data；整个测试过程都不打开默认的校验值数据库"""
+    root = tmp_path_factory.mktemp("session_storage")
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        redirect_storage(root, monkeypatch)
+        monkeypatch.setattr(settings, "CHECKSUM_DB_PATH", root / "checksum.sqlite3")
+        with checksum_store.lock:
+            monkeypatch.setattr(checksum_store, "db_path", settings.CHECKSUM_DB_PATH)
+            checksum_store.connection = None
+        try:
+            yield root
+        finally:
+            with checksum_store.lock:
+                if checksum_store.connection is not None:
+                    checksum_store.connection.close()
+                checksum_store.connection = None
+
+
+@pytest.fixture(autouse=True)
+def isolated_storage(tmp_path_factory: pytest.TempPathFactory, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """每个测试使用单独的FILE_DIR、TEMP_DIR和校验值数据库，不读写.data，也不占用测试自己的tmp_path"""
+    root = tmp_path_factory.mktemp("storage")
+    redirect_storage(root, monkeypatch)
+    monkeypatch.setattr(settings, "CHECKSUM_DB_PATH", root / "checksum.sqlite3")
+    with checksum_store.lock:
+        previous_connection = checksum_store.connection
+        monkeypatch.setattr(checksum_store, "db_path", settings.CHECKSUM_DB_PATH)
+        checksum_store.connection = None
+    try:
+        yield root
+    finally:
+        with checksum_store.lock:
+            if checksum_store.connection is not None:
+                checksum_store.connection.close()
+            checksum_store.connection = previous_connection
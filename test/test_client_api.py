@@ -1,12 +1,27 @@
+import base64
+import hashlib
+import os
 import shutil
+import time
+import uuid
+import zlib
+from io import BytesIO
 from pathlib import Path
 from tempfile import SpooledTemporaryFile, TemporaryDirectory
+from zipfile import ZIP_STORED, ZipFile
 
 import pytest
+from fastapi.testclient import TestClient
+from httpx import HTTPStatusError
 
-from zjbs_file_client import AsyncClient, CompressMethod
+from zjbs_file_client import AsyncClient, Client, CompressMethod, FileType, ListSortKey, SyncDirection, SyncPlan
+from zjbs_file_client.client import _DirectoryUploadBody, _ProducerClosed
+from zjbs_file_client.delta import BlockSignature, iter_delta
+from zjbs_file_server.checksum import checksum_store
+from zjbs_file_server.dedup_store import dedup_store
 from zjbs_file_server.main import app
 from zjbs_file_server.settings import settings
+from zjbs_file_server.temp_space import temp_space
 from zjbs_file_server.util import get_os_path
 
 
@@ -20,15 +35,23 @@ async def test_download_file(file_server_file: Path):
 
 
 @pytest.mark.parametrize("file_server_file", ["/test_download_directory/test.txt"], indirect=True)
-async def test_download_directory(file_server_file: Path):
+@pytest.mark.parametrize(
+    "compress_method", [CompressMethod.txz, CompressMethod.tzst, CompressMethod.ptgz, CompressMethod.not_compressed]
+)
+async def test_download_directory(file_server_file: Path, compress_method: CompressMethod):
     async with AsyncClient(base_url="http://testserver", app=app, timeout=None) as client:
         with TemporaryDirectory() as tmp_dir:
-            await client.download_directory("/test_download_directory", tmp_dir)
+            # 不压缩的tar包没有压缩级别
+            compress_level = None if compress_method == CompressMethod.not_compressed else 1
+            await client.download_directory(
+                "/test_download_directory", tmp_dir, compress_method, compress_level=compress_level, compress_threads=2
+            )
             downloaded_dir = get_os_path("/test_download_directory", Path(tmp_dir))
             downloaded_files = list(downloaded_dir.iterdir())
             assert len(downloaded_files) == 1
             downloaded_file = downloaded_files[0]
             assert downloaded_file.read_text() == file_server_file.read_text()
+            assert not file_server_file.parent.with_suffix(".tar.xz").exists()
 
 
 async def test_upload(temp_file: SpooledTemporaryFile) -> None:
@@ -41,13 +64,525 @@ async def test_upload(temp_file: SpooledTemporaryFile) -> None:
             uploaded_path.unlink(missing_ok=True)
 
 
-async def test_upload_directory(temp_directory: Path) -> None:
+@pytest.mark.parametrize(
+    "compress_method",
+    [CompressMethod.not_compressed, CompressMethod.tgz, CompressMethod.txz, CompressMethod.tzst, CompressMethod.ptgz],
+)
+async def test_upload_directory(temp_directory: Path, compress_method: CompressMethod) -> None:
     async with AsyncClient(base_url="http://testserver", app=app, timeout=None) as client:
         uploaded_dir = settings.FILE_DIR / temp_directory.name
         uploaded_file = uploaded_dir / "test.txt"
         try:
-            await client.upload_directory("/", temp_directory, CompressMethod.tgz, mkdir=False)
+            await client.upload_directory("/", temp_directory, compress_method, mkdir=False)
             assert list(uploaded_dir.iterdir()) == [uploaded_file]
             assert uploaded_file.read_text() == "test content"
         finally:
             shutil.rmtree(uploaded_dir, ignore_errors=True)
+
+
+@pytest.mark.parametrize("file_server_file", ["/test_download_file_resume/test.txt"], indirect=True)
+async def test_download_file_resume(file_server_file: Path):
+    async with AsyncClient(base_url="http://testserver", app=app, timeout=None) as client:
+        with TemporaryDirectory() as tmp_dir:
+            target = Path(tmp_dir) / "test.txt"
+            etag_path = Path(tmp_dir) / "test.txt.etag"
+            content = file_server_file.read_bytes()
+            # 没有记录ETag时从头下载
+            target.write_bytes(b"XXXX")
+            etag = await client.download_file("/test_download_file_resume/test.txt", target, resume=True)
+            assert target.read_bytes() == content
+            assert not etag_path.exists()
+            await client.download_file("/test_download_file_resume/test.txt", target, resume=True)
+            assert target.read_bytes() == content
+
+            # ETag匹配时从已下载的位置继续
+            target.write_bytes(b"XXXX")
+            etag_path.write_text(etag)
+            await client.download_file("/test_download_file_resume/test.txt", target, resume=True)
+            assert target.read_bytes() == b"XXXX" + content[4:]
+            assert not etag_path.exists()
+
+            # 已经完整时服务器返回416，不修改文件
+            etag_path.write_text(etag)
+            await client.download_file("/test_download_file_resume/test.txt", target, resume=True)
+            assert target.read_bytes() == b"XXXX" + content[4:]
+
+            # 服务器上的文件变化后If-Range不匹配，从头下载
+            target.write_bytes(b"XXXX")
+            etag_path.write_text(etag)
+            file_server_file.write_text("changed content")
+            await client.download_file("/test_download_file_resume/test.txt", target, resume=True)
+            assert target.read_bytes() == b"changed content"
+
+
+@pytest.mark.parametrize("file_server_file", ["/test_download_if_none_match/test.txt"], indirect=True)
+@pytest.mark.parametrize("segments", [1, 2])
+async def test_download_if_none_match(file_server_file: Path, tmp_path: Path, segments: int):
+    async with AsyncClient(base_url="http://testserver", app=app, timeout=None) as client:
+        target = tmp_path / "test.txt"
+        etag = await client.download_file("/test_download_if_none_match/test.txt", target, segments=segments)
+        assert etag is not None
+        target.write_text("local copy")
+        new_etag = await client.download_file(
+            "/test_download_if_none_match/test.txt", target, segments=segments, if_none_match=etag
+        )
+        assert new_etag == etag
+        assert target.read_text() == "local copy"
+
+        file_server_file.write_text("changed content")
+        os.utime(file_server_file, ns=(0, 10**9 * 2**31))
+        new_etag = await client.download_file(
+            "/test_download_if_none_match/test.txt", target, segments=segments, if_none_match=etag
+        )
+        assert new_etag != etag
+        assert target.read_text() == "changed content"
+
+        response = await client.inner.post("/download-directory", params={"path": "/test_download_if_none_match"})
+        downloaded_dir = await client.download_directory(
+            "/test_download_if_none_match", tmp_path, if_none_match=response.headers["ETag"]
+        )
+        assert downloaded_dir == tmp_path / "test_download_if_none_match"
+        assert not downloaded_dir.exists()
+
+
+async def test_upload_session(tmp_path: Path) -> None:
+    local_file = tmp_path / "big.bin"
+    content = bytes(range(256)) * 40
+    local_file.write_bytes(content)
+    uploaded_path = settings.FILE_DIR / "test_upload_session" / "big.bin"
+    async with AsyncClient(base_url="http://testserver", app=app, timeout=None) as client:
+        try:
+            session = await client.create_upload_session("/test_upload_session", "big.bin", len(content), mkdir=True)
+            await client.upload_chunk(session.session_id, 1000, content[1000:2000])
+            # 部分文件不在目标文件夹中
+            assert list(uploaded_path.parent.iterdir()) == []
+            with pytest.raises(HTTPStatusError):
+                await client.commit_upload_session(session.session_id)
+            assert (await client.get_upload_session(session.session_id)).received == [(1000, 2000)]
+
+            await client.upload_session_file(session.session_id, local_file, chunk_size=1024, concurrency=3)
+            assert uploaded_path.read_bytes() == content
+            assert list(uploaded_path.parent.iterdir()) == [uploaded_path]
+            # 提交时记录了校验值
+            checksums = checksum_store.get(uploaded_path, uploaded_path.stat())
+            assert checksums is not None and checksums.sha256 == hashlib.sha256(content).hexdigest()
+
+            # 部分文件丢失时返回404
+            session = await client.create_upload_session("/test_upload_session", "empty.bin", 0)
+            (settings.TEMP_DIR / "upload_session" / session.session_id / "data.part").unlink()
+            with pytest.raises(HTTPStatusError) as exc_info:
+                await client.commit_upload_session(session.session_id)
+            assert exc_info.value.response.status_code == 404
+        finally:
+            shutil.rmtree(uploaded_path.parent, ignore_errors=True)
+
+
+@pytest.mark.parametrize("file_server_file", ["/test_download_file_segmented/test.txt"], indirect=True)
+async def test_download_file_segmented(file_server_file: Path, tmp_path: Path):
+    file_server_file.write_bytes(bytes(range(256)) * 100)
+    async with AsyncClient(base_url="http://testserver", app=app, timeout=None) as client:
+        target = tmp_path / "test.txt"
+        await client.download_file("/test_download_file_segmented/test.txt", target, segments=7)
+        assert target.read_bytes() == file_server_file.read_bytes()
+
+    # 同步客户端不能直接挂载ASGI应用，借用TestClient的transport
+    with Client(base_url="http://testserver", transport=TestClient(app)._transport, timeout=None) as client:
+        target = tmp_path / "test_sync.txt"
+        client.download_file("/test_download_file_segmented/test.txt", target, segments=3)
+        assert target.read_bytes() == file_server_file.read_bytes()
+
+
+async def test_directory_upload_body_close(tmp_path: Path) -> None:
+    (tmp_path / "data.bin").write_bytes(os.urandom(16 * 1024 * 1024))
+    body = _DirectoryUploadBody(tmp_path, CompressMethod.not_compressed, False, "boundary")
+    chunks = body.aiter_chunks()
+    assert await anext(chunks) == body.preamble
+    await anext(chunks)
+    # 发送中途放弃时生产线程退出，取数据的线程也不会一直阻塞
+    await body.aclose()
+    assert not body.thread.is_alive()
+    with pytest.raises(_ProducerClosed):
+        await anext(chunks)
+
+
+def test_upload_directory_streaming(tmp_path: Path) -> None:
+    local_dir = tmp_path / "test_upload_directory_streaming"
+    local_dir.mkdir()
+    # 随机内容不可压缩，压缩结果会分成多个数据块发送
+    content = os.urandom(3 * 1024 * 1024)
+    (local_dir / "data.bin").write_bytes(content)
+    uploaded_dir = settings.FILE_DIR / local_dir.name
+    with Client(base_url="http://testserver", transport=TestClient(app)._transport, timeout=None) as client:
+        try:
+            client.upload_directory("/", local_dir, CompressMethod.tgz)
+            assert (uploaded_dir / "data.bin").read_bytes() == content
+        finally:
+            shutil.rmtree(uploaded_dir, ignore_errors=True)
+
+
+@pytest.mark.parametrize("file_server_directory", ["/test_list_directory"], indirect=True)
+async def test_list_directory(file_server_directory: Path) -> None:
+    for index in range(5):
+        (file_server_directory / f"{index}.edf").write_bytes(b"x" * (5 - index))
+    (file_server_directory / "sub").mkdir()
+    async with AsyncClient(base_url="http://testserver", app=app, timeout=None) as client:
+        infos = await client.list_directory("/test_list_directory")
+        assert sorted(info.name for info in infos) == ["0.edf", "1.edf", "2.edf", "3.edf", "4.edf", "sub"]
+        infos = await client.list_directory("/test_list_directory", name_pattern="*.edf", file_type=FileType.file)
+        assert len(infos) == 5
+
+        names, cursor = [], None
+        while True:
+            page, cursor = await client.list_directory_page(
+                "/test_list_directory", 2, cursor, sort=ListSortKey.size, file_type=FileType.file
+            )
+            names += [info.name for info in page]
+            if cursor is None:
+                break
+        assert names == ["4.edf", "3.edf", "2.edf", "1.edf", "0.edf"]
+
+        page, cursor = await client.list_directory_page("/test_list_directory", 10, reverse=True)
+        assert [info.name for info in page] == ["sub", "4.edf", "3.edf", "2.edf", "1.edf", "0.edf"]
+        assert cursor is None
+
+        # 通过接口写入后缓存的列表立即失效
+        await client.upload("/test_list_directory", b"new", "5.edf")
+        await client.rename("/test_list_directory/0.edf", "6.edf")
+        infos = await client.list_directory("/test_list_directory", sort=ListSortKey.name)
+        assert [info.name for info in infos] == ["1.edf", "2.edf", "3.edf", "4.edf", "5.edf", "6.edf", "sub"]
+
+
+@pytest.mark.parametrize("file_server_directory", ["/test_walk_directory"], indirect=True)
+async def test_walk_directory(file_server_directory: Path) -> None:
+    (file_server_directory / "a" / "b").mkdir(parents=True)
+    (file_server_directory / "a" / "1.edf").write_text("1")
+    (file_server_directory / "a" / "b" / "2.edf").write_text("2")
+    (file_server_directory / "skip").mkdir()
+    (file_server_directory / "skip" / "3.edf").write_text("3")
+    (file_server_directory / "a" / "loop").symlink_to("..")
+    async with AsyncClient(base_url="http://testserver", app=app, timeout=None) as client:
+        infos = {info.path: info async for info in client.walk_directory("/test_walk_directory")}
+        assert set(infos) == {"a", "a/1.edf", "a/b", "a/b/2.edf", "a/loop", "skip", "skip/3.edf"}
+        assert infos["a/loop"].type == FileType.symlink
+        (file_server_directory / "a" / "loop").unlink()
+        infos = [
+            info async for info in client.walk_directory("/test_walk_directory", include=["*.edf"], exclude=["skip"])
+        ]
+        assert sorted(info.path for info in infos) == ["a/1.edf", "a/b/2.edf"]
+        assert all(info.size == 1 for info in infos)
+        paths = {info.path async for info in client.walk_directory("/test_walk_directory", max_depth=2)}
+        assert paths == {"a", "a/1.edf", "a/b", "skip", "skip/3.edf"}
+
+    with Client(base_url="http://testserver", transport=TestClient(app)._transport, timeout=None) as client:
+        paths = [info.path for info in client.walk_directory("/test_walk_directory", max_depth=1)]
+        assert sorted(paths) == ["a", "skip"]
+
+
+@pytest.mark.parametrize("file_server_directory", ["/test_batch"], indirect=True)
+async def test_batch_operations(file_server_directory: Path) -> None:
+    async with AsyncClient(base_url="http://testserver", app=app, timeout=None) as client:
+        files = [(f"{index}.json", f"{{{index}}}".encode()) for index in range(20)]
+        files.append(("big.bin", os.urandom(3 * 1024 * 1024)))
+        files.append(("bad?.json", b"{}"))
+        results = await client.upload_many("/test_batch", files)
+        assert [result.success for result in results] == [True] * 21 + [False]
+        assert (file_server_directory / "7.json").read_text() == "{7}"
+        assert (file_server_directory / "big.bin").read_bytes() == files[20][1]
+
+        results = await client.upload_many("/test_batch", [("0.json", b"new"), ("20.json", b"{20}")])
+        assert [result.success for result in results] == [False, True]
+        assert (file_server_directory / "0.json").read_text() == "{0}"
+
+        results = await client.rename_many([("/test_batch/0.json", "zero.json"), ("/test_batch/missing", "x")])
+        assert [result.success for result in results] == [True, False]
+        results = await client.delete_many(["/test_batch/zero.json", "/test_batch/1.json", "/test_batch/missing"])
+        assert [result.success for result in results] == [True, True, False]
+        assert not (file_server_directory / "zero.json").exists()
+
+
+@pytest.mark.parametrize(
+    "compress_method",
+    [CompressMethod.zip, CompressMethod.tgz, CompressMethod.txz, CompressMethod.tzst, CompressMethod.ptgz],
+)
+async def test_adaptive_compression(tmp_path: Path, compress_method: CompressMethod) -> None:
+    local_dir = tmp_path / "test_adaptive_compression"
+    (local_dir / "sub").mkdir(parents=True)
+    contents = {
+        "random.bin": os.urandom(256 * 1024),
+        "scan.nii.gz": os.urandom(1024),
+        "sub/text.txt": b"compressible " * 20000,
+        "sub/random.h5": os.urandom(100 * 1024),
+    }
+    for name, content in contents.items():
+        (local_dir / name).write_bytes(content)
+    uploaded_dir = settings.FILE_DIR / local_dir.name
+    async with AsyncClient(base_url="http://testserver", app=app, timeout=None) as client:
+        try:
+            if compress_method != CompressMethod.zip:
+                await client.upload_directory("/", local_dir, compress_method, adaptive=True)
+            else:
+                shutil.copytree(local_dir, uploaded_dir)
+            for name, content in contents.items():
+                assert (uploaded_dir / name).read_bytes() == content
+
+            download_dir = tmp_path / "download"
+            if compress_method != CompressMethod.zip:
+                await client.download_directory(f"/{local_dir.name}", download_dir, compress_method, adaptive=True)
+                for name, content in contents.items():
+                    assert (download_dir / local_dir.name / name).read_bytes() == content
+            else:
+                response = await client.inner.post(
+                    "/download-directory",
+                    params={"path": f"/{local_dir.name}", "compress_method": "zip", "adaptive": True},
+                )
+                with ZipFile(BytesIO(response.raise_for_status().content)) as zip_file:
+                    stored = {info.filename for info in zip_file.infolist() if info.compress_type == ZIP_STORED}
+                    assert stored == {
+                        f"{local_dir.name}/random.bin",
+                        f"{local_dir.name}/scan.nii.gz",
+                        f"{local_dir.name}/sub/random.h5",
+                    }
+                    for name, content in contents.items():
+                        assert zip_file.read(f"{local_dir.name}/{name}") == content
+        finally:
+            shutil.rmtree(uploaded_dir, ignore_errors=True)
+
+
+async def test_checksum(tmp_path: Path) -> None:
+    content = os.urandom(3 * 1024 * 1024)
+    sha256 = hashlib.sha256(content).hexdigest()
+    uploaded_dir = settings.FILE_DIR / "test_checksum"
+    async with AsyncClient(base_url="http://testserver", app=app, timeout=None) as client:
+        try:
+            with pytest.raises(HTTPStatusError):
+                await client.upload("/test_checksum", content, "test.bin", mkdir=True, expected_sha256="0" * 64)
+            assert not (uploaded_dir / "test.bin").exists()
+            await client.upload("/test_checksum", content, "test.bin", expected_sha256=sha256.upper())
+
+            response = await client.inner.post("/download-file", params={"path": "/test_checksum/test.bin"})
+            assert response.headers["Repr-Digest"] == f"sha-256=:{base64.b64encode(bytes.fromhex(sha256)).decode()}:"
+            target = tmp_path / "test.bin"
+            await client.download_file("/test_checksum/test.bin", target, verify=True)
+            assert target.read_bytes() == content
+
+            await client.rename("/test_checksum/test.bin", "renamed.bin")
+            checksum = await client.checksum("/test_checksum/renamed.bin")
+            assert (checksum.size, checksum.sha256) == (len(content), sha256)
+            assert checksum.crc32 == f"{zlib.crc32(content):08x}"
+
+            # 上传文件夹时解压得到的文件也有校验值
+            local_dir = tmp_path / "directory"
+            local_dir.mkdir()
+            (local_dir / "a.txt").write_text("a")
+            await client.upload_directory("/test_checksum", local_dir, CompressMethod.tgz)
+            response = await client.inner.post("/download-file", params={"path": "/test_checksum/directory/a.txt"})
+            assert "Repr-Digest" in response.headers
+            checksum = await client.checksum("/test_checksum/directory/a.txt")
+            assert checksum.sha256 == hashlib.sha256(b"a").hexdigest()
+
+            # 没有记录的文件在查询时计算
+            (uploaded_dir / "plain.txt").write_text("plain")
+            response = await client.inner.post("/download-file", params={"path": "/test_checksum/plain.txt"})
+            assert "Repr-Digest" not in response.headers
+            assert (await client.checksum("/test_checksum/plain.txt")).sha256 == hashlib.sha256(b"plain").hexdigest()
+            await client.download_file("/test_checksum/plain.txt", tmp_path / "plain.txt", verify=True)
+        finally:
+            shutil.rmtree(uploaded_dir, ignore_errors=True)
+
+
+async def test_dedup_store(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(dedup_store, "enabled", True)
+    monkeypatch.setattr(dedup_store, "gc_interval", 0)
+    monkeypatch.setattr(dedup_store, "store_dir", settings.TEMP_DIR / "test_dedup_store")
+    content = os.urandom(1024 * 1024)
+    sha256 = hashlib.sha256(content).hexdigest()
+    uploaded_dir = settings.FILE_DIR / "test_dedup_store"
+    async with AsyncClient(base_url="http://testserver", app=app, timeout=None) as client:
+        try:
+            await client.upload("/test_dedup_store", content, "a.bin", mkdir=True)
+            a_mtime = (uploaded_dir / "a.bin").stat().st_mtime_ns
+            await client.upload("/test_dedup_store", content, "b.bin")
+            assert await client.upload_by_hash("/test_dedup_store", "c.bin", sha256)
+            assert not await client.upload_by_hash("/test_dedup_store", "d.bin", "0" * 64)
+            local_dir = tmp_path / "directory"
+            local_dir.mkdir()
+            (local_dir / "e.bin").write_bytes(content)
+            os.utime(local_dir / "e.bin", (1_000_000_000, 1_000_000_000))
+            await client.upload_directory("/test_dedup_store", local_dir, CompressMethod.tgz)
+
+            # 链接不修改共享的inode，已有文件的修改时间不变；解压的文件保留压缩包中的修改时间，不去重
+            paths = [uploaded_dir / name for name in ("a.bin", "b.bin", "c.bin")]
+            assert len({path.stat().st_ino for path in paths}) == 1
+            assert (uploaded_dir / "a.bin").stat().st_mtime_ns == a_mtime
+            assert dedup_store.blob_path(sha256).stat().st_nlink == 4
+            assert (uploaded_dir / "directory/e.bin").stat().st_mtime == 1_000_000_000
+            assert (uploaded_dir / "directory/e.bin").stat().st_nlink == 1
+            assert (await client.checksum("/test_dedup_store/c.bin")).sha256 == sha256
+
+            # 覆盖和删除只影响一个链接
+            await client.upload("/test_dedup_store", b"new content", "a.bin", allow_overwrite=True)
+            assert await client.delete("/test_dedup_store/b.bin")
+            assert (uploaded_dir / "a.bin").read_bytes() == b"new content"
+            assert (uploaded_dir / "c.bin").read_bytes() == content
+            assert dedup_store.collect_garbage() == 0
+            # 链接会让a.bin的修改时间倒退，不去重
+            assert not await client.upload_by_hash("/test_dedup_store", "a.bin", sha256, allow_overwrite=True)
+
+            assert await client.delete("/test_dedup_store", recursive=True)
+            assert dedup_store.collect_garbage() == 2
+            assert not dedup_store.blob_path(sha256).exists()
+        finally:
+            shutil.rmtree(uploaded_dir, ignore_errors=True)
+            shutil.rmtree(dedup_store.store_dir, ignore_errors=True)
+
+
+async def test_upload_delta(tmp_path: Path) -> None:
+    base = os.urandom(4 * 1024 * 1024 + 123)
+    content = base[: 1024 * 1024] + os.urandom(100) + base[1024 * 1024 : 3 * 1024 * 1024]
+    content += b"x" * 10 + base[3 * 1024 * 1024 + 10 :] + os.urandom(1000)
+    local_file = tmp_path / "test.bin"
+    local_file.write_bytes(content)
+    uploaded_dir = settings.FILE_DIR / "test_upload_delta"
+    async with AsyncClient(base_url="http://testserver", app=app, timeout=None) as client:
+        try:
+            # 服务器上没有该文件时上传完整的文件
+            (tmp_path / "base.bin").write_bytes(base)
+            uploaded_dir.mkdir(parents=True, exist_ok=True)
+            assert not await client.upload_delta("/test_upload_delta/test.bin", tmp_path / "base.bin")
+            assert (uploaded_dir / "test.bin").read_bytes() == base
+
+            response = await client.inner.post("/delta/signature", params={"path": "/test_upload_delta/test.bin"})
+            signature = BlockSignature(response.content, int(response.headers["X-Block-Size"]), len(base))
+            assert sum(len(chunk) for chunk in iter_delta(local_file, signature)) < 64 * 1024
+            assert await client.upload_delta("/test_upload_delta/test.bin", local_file)
+            assert (uploaded_dir / "test.bin").read_bytes() == content
+            assert (await client.checksum("/test_upload_delta/test.bin")).sha256 == hashlib.sha256(content).hexdigest()
+
+            # 获取签名后文件被修改时拒绝上传
+            response = await client.inner.post(
+                "/delta/upload",
+                params={
+                    "path": "/test_upload_delta/test.bin",
+                    "base_etag": response.headers["ETag"],
+                    "block_size": 4096,
+                },
+                content=b"E" + hashlib.sha256(b"").digest(),
+            )
+            assert response.status_code == 400
+        finally:
+            shutil.rmtree(uploaded_dir, ignore_errors=True)
+
+
+async def test_sync(tmp_path: Path) -> None:
+    local_dir = tmp_path / "local"
+    (local_dir / "sub").mkdir(parents=True)
+    (local_dir / "a.txt").write_text("a")
+    (local_dir / "sub" / "b.txt").write_text("b")
+    uploaded_dir = settings.FILE_DIR / "test_sync"
+    try:
+        with Client(base_url="http://testserver", transport=TestClient(app)._transport, timeout=None) as client:
+            plan = client.sync(local_dir, "/test_sync", SyncDirection.upload)
+            assert plan.transfer == ["a.txt", "sub/b.txt"]
+            assert (uploaded_dir / "sub" / "b.txt").read_text() == "b"
+            assert client.sync(local_dir, "/test_sync", SyncDirection.upload).transfer == []
+
+            (local_dir / "a.txt").write_text("changed")
+            (local_dir / "sub" / "b.txt").unlink()
+            (local_dir / "c.txt").write_text("c")
+            plan = client.sync(local_dir, "/test_sync", SyncDirection.upload, dry_run=True)
+            assert plan == SyncPlan(transfer=["a.txt", "c.txt"], delete=[])
+            assert (uploaded_dir / "a.txt").read_text() == "a"
+            plan = client.sync(local_dir, "/test_sync", SyncDirection.upload, delete=True)
+            assert plan == SyncPlan(transfer=["a.txt", "c.txt"], delete=["sub/b.txt"])
+            assert not (uploaded_dir / "sub" / "b.txt").exists()
+
+            # 大小相同、本地更新但内容相同的文件比较sha256后不传输
+            os.utime(local_dir / "c.txt", (time.time() + 3600, time.time() + 3600))
+            assert client.sync(local_dir, "/test_sync", SyncDirection.upload).transfer == []
+
+        download_dir = tmp_path / "download"
+        async with AsyncClient(base_url="http://testserver", app=app, timeout=None) as client:
+            plan = await client.sync(download_dir, "/test_sync", SyncDirection.download)
+            assert plan.transfer == ["a.txt", "c.txt"]
+            assert (download_dir / "a.txt").read_text() == "changed"
+            assert (await client.sync(download_dir, "/test_sync", SyncDirection.download)).transfer == []
+            os.utime(uploaded_dir / "c.txt", (time.time() + 7200, time.time() + 7200))
+            assert (await client.sync(download_dir, "/test_sync", SyncDirection.download)).transfer == []
+            assert abs((download_dir / "c.txt").stat().st_mtime - (uploaded_dir / "c.txt").stat().st_mtime) < 0.001
+
+            # 类型不同的项只在delete为True时删除
+            (download_dir / "c.txt").unlink()
+            (download_dir / "c.txt").mkdir()
+            (download_dir / "c.txt" / "keep").write_text("keep")
+            plan = await client.sync(download_dir, "/test_sync", SyncDirection.download)
+            assert plan == SyncPlan(transfer=[], delete=[], conflicts=["c.txt"])
+            assert (download_dir / "c.txt" / "keep").read_text() == "keep"
+            plan = await client.sync(download_dir, "/test_sync", SyncDirection.download, delete=True)
+            assert plan == SyncPlan(transfer=["c.txt"], delete=["c.txt"])
+            assert (download_dir / "c.txt").read_text() == "c"
+
+            # 大小相同的文件比较sha256
+            (download_dir / "a.txt").write_text("CHANGED")
+            os.utime(download_dir / "a.txt", (0, 0))
+            plan = await client.sync(download_dir, "/test_sync", SyncDirection.download, checksum=True)
+            assert plan.transfer == ["a.txt"]
+            assert (download_dir / "a.txt").read_text() == "changed"
+    finally:
+        shutil.rmtree(uploaded_dir, ignore_errors=True)
+
+
+async def test_temp_space(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(temp_space, "quota", 1024)
+    monkeypatch.setattr(temp_space, "session_ttl", 60)
+    orphan_path = settings.TEMP_DIR / "archive_cache" / f"{uuid.uuid4()}.tmp"
+    active_path = settings.TEMP_DIR / "archive_cache" / f"{uuid.uuid4()}.tmp"
+    # 不是本服务创建的文件不清理
+    foreign_path = settings.TEMP_DIR / "foreign.txt"
+    uploaded_dir = settings.FILE_DIR / "test_temp_space"
+    async with AsyncClient(base_url="http://testserver", app=app, timeout=None) as client:
+        # 超过配额时无法预留
+        with temp_space.reservation() as reservation:
+            assert not reservation.record(2048)
+        # 配额小于RESERVE_STEP时小文件仍然可以预留
+        with temp_space.reservation() as reservation:
+            assert reservation.record(100)
+            assert reservation.size == 1024
+        with pytest.raises(HTTPStatusError) as exc_info:
+            await client.create_upload_session("/test_temp_space", "huge.bin", 1 << 62, mkdir=True)
+        assert exc_info.value.response.status_code == 507
+
+        session = await client.create_upload_session("/test_temp_space", "big.bin", 1024, mkdir=True)
+        await client.upload_chunk(session.session_id, 0, b"x" * 100)
+        session_dir = settings.TEMP_DIR / "upload_session" / session.session_id
+        orphan_path.parent.mkdir(parents=True, exist_ok=True)
+        orphan_path.write_bytes(b"orphan")
+        active_path.write_bytes(b"active")
+        foreign_path.write_bytes(b"foreign")
+        # 进程崩溃后遗留在FILE_DIR中的临时文件，登记记录不属于当前进程
+        tracked_path = uploaded_dir / "tracked.bin.tmp"
+        tracked_path.write_bytes(b"tracked")
+        record_path = temp_space.track(tracked_path)
+        temp_space.tracked.discard(str(record_path))
+        for path in (
+            orphan_path,
+            foreign_path,
+            record_path,
+            session_dir,
+            session_dir / "ranges",
+            session_dir / "data.part",
+            tracked_path,
+        ):
+            os.utime(path, (0, 0))
+
+        usage = await client.temp_space_usage()
+        temp_space.sweep()
+        assert not orphan_path.exists()
+        assert active_path.exists()
+        assert foreign_path.exists()
+        assert not record_path.exists()
+        assert not session_dir.exists()
+        assert list(uploaded_dir.iterdir()) == []
+        new_usage = await client.temp_space_usage()
+        assert new_usage.quota == 1024
+        assert new_usage.swept_files == usage.swept_files + 3
+        assert new_usage.last_sweep is not None
@@ -1,10 +1,28 @@
+import gzip
+import hashlib
+import os
+import shutil
+import tarfile
+import time
+import zlib
+from io import BytesIO
 from pathlib import Path
 from tempfile import SpooledTemporaryFile
+from zipfile import ZipFile
 
 import pytest
 from fastapi.testclient import TestClient
+from starlette.background import BackgroundTask
+from starlette.datastructures import Headers
 
+from zjbs_file_server import codec, listing, service
+from zjbs_file_server.archive_cache import ArchiveCache, archive_cache, tree_fingerprint
+from zjbs_file_server.file_response import RangeFileResponse
+from zjbs_file_server.listing_cache import ListingCache
 from zjbs_file_server.main import app
+from zjbs_file_server.response_compression import CompressionMiddleware, choose_encoding, write_precompressed
+from zjbs_file_server.settings import settings
+from zjbs_file_server.types import CompressMethod
 from zjbs_file_server.util import get_os_path
 
 
@@ -30,3 +48,468 @@ def test_restful_upload(client: TestClient, temp_file: SpooledTemporaryFile) ->
 def test_restful_download_file(client: TestClient, file_server_file: Path) -> None:
     response = client.get("/restful/test_restful_download_file/test.txt").raise_for_status()
     assert response.content == file_server_file.read_bytes()
+
+
+@pytest.mark.parametrize("file_server_directory", ["/test_restful_list_symlinks"], indirect=True)
+def test_restful_list_symlinks(client: TestClient, file_server_directory: Path) -> None:
+    (file_server_directory / "sub").mkdir()
+    (file_server_directory / "link").symlink_to("sub")
+    (file_server_directory / "broken").symlink_to("missing")
+    url = "/restful/test_restful_list_symlinks"
+
+    # 不跟随符号链接时列出链接本身，失效的链接也列出
+    infos = client.get(url, params={"list": True, "follow_symlinks": False}).raise_for_status().json()
+    assert sorted((info["name"], info["type"], info["size"]) for info in infos) == [
+        ("broken", "symlink", None),
+        ("link", "symlink", None),
+        ("sub", "directory", None),
+    ]
+    infos = client.get(url, params={"list": True}).raise_for_status().json()
+    assert sorted((info["name"], info["type"]) for info in infos) == [("sub", "directory"), ("sub", "directory")]
+
+
+@pytest.mark.parametrize("file_server_file", ["/test_restful_download_range/test.txt"], indirect=True)
+def test_restful_download_range(client: TestClient, file_server_file: Path) -> None:
+    content = file_server_file.read_bytes()
+    url = "/restful/test_restful_download_range/test.txt"
+
+    response = client.get(url, headers={"Range": "bytes=5-"})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == f"bytes 5-{len(content) - 1}/{len(content)}"
+    assert response.content == content[5:]
+
+    response = client.get(url, headers={"Range": "bytes=0-3,-4"})
+    assert response.status_code == 206
+    assert response.headers["Content-Type"].startswith("multipart/byteranges")
+    assert b"Content-Range: bytes 0-3/12\r\n\r\ntest\r\n" in response.content
+    assert b"Content-Range: bytes 8-11/12\r\n\r\ntent\r\n" in response.content
+
+    response = client.get(url, headers={"Range": "bytes=100-"})
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == f"bytes */{len(content)}"
+
+    response = client.get(url, headers={"Range": "bytes=5-", "If-Range": '"outdated"'})
+    assert response.status_code == 200
+    assert response.headers["Accept-Ranges"] == "bytes"
+    assert response.content == content
+
+
+@pytest.mark.parametrize("file_server_file", ["/test_restful_download_directory/test.txt"], indirect=True)
+def test_restful_download_directory_zip(client: TestClient, file_server_file: Path) -> None:
+    response = client.get("/restful/test_restful_download_directory", params={"compress": "zip"}).raise_for_status()
+    assert response.headers["Content-Type"] == "application/zip"
+    assert "content-length" not in response.headers
+    with ZipFile(BytesIO(response.content)) as zip_file:
+        assert zip_file.read("test_restful_download_directory/test.txt") == file_server_file.read_bytes()
+
+
+def test_restful_archive_cache(client: TestClient, monkeypatch: pytest.MonkeyPatch) -> None:
+    file_path = settings.FILE_DIR / "test_restful_archive_cache" / "test.txt"
+    file_path.parent.mkdir()
+    file_path.write_text("test content")
+    url = "/restful/test_restful_archive_cache"
+    params, headers = {"compress": "tgz"}, {"Accept-Encoding": "identity"}
+    first = client.get(url, params=params, headers=headers).raise_for_status()
+    assert "content-length" not in first.headers
+    assert len(list(archive_cache.cache_dir.glob("*.archive"))) == 1
+
+    second = client.get(url, params=params, headers=headers).raise_for_status()
+    assert second.headers["Content-Length"] == str(len(first.content))
+    assert second.content == first.content
+    # 命中时创建的临时链接在发送完成后删除
+    assert list(archive_cache.cache_dir.glob("*.tmp")) == []
+
+    file_path.write_text("changed content")
+    third = client.get(url, params=params, headers=headers).raise_for_status()
+    assert "content-length" not in third.headers
+    with tarfile.open(fileobj=BytesIO(third.content), mode="r:gz") as tar_file:
+        assert tar_file.extractfile("test_restful_archive_cache/test.txt").read() == b"changed content"
+
+    # 不缓存时不遍历文件树，没有ETag
+    monkeypatch.setattr(archive_cache, "max_size", 0)
+    monkeypatch.setattr(service, "tree_stat", None)
+    response = client.get(url, params=params, headers=headers).raise_for_status()
+    assert "etag" not in response.headers
+    with tarfile.open(fileobj=BytesIO(response.content), mode="r:gz") as tar_file:
+        assert tar_file.extractfile("test_restful_archive_cache/test.txt").read() == b"changed content"
+
+
+@pytest.mark.parametrize("file_server_file", ["/test_restful_conditional_get/test.txt"], indirect=True)
+def test_restful_conditional_get(client: TestClient, file_server_file: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    url = "/restful/test_restful_conditional_get/test.txt"
+    first = client.get(url).raise_for_status()
+    etag, last_modified = first.headers["ETag"], first.headers["Last-Modified"]
+    for headers in (
+        {"If-None-Match": etag},
+        {"If-None-Match": f'"other", W/{etag}'},
+        {"If-Modified-Since": last_modified},
+    ):
+        response = client.get(url, headers=headers)
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["ETag"] == etag
+
+    file_server_file.write_text("changed content")
+    os.utime(file_server_file, ns=(0, 10**9 * 2**31))
+    response = client.get(url, headers={"If-None-Match": etag, "If-Modified-Since": last_modified})
+    assert response.status_code == 200
+    assert response.content == b"changed content"
+
+    monkeypatch.setattr(settings, "FILE_ETAG_CONTENT_HASH", True)
+    response = client.get(url).raise_for_status()
+    assert response.headers["ETag"] == f'"{hashlib.sha256(b"changed content").hexdigest()}"'
+    assert client.get(url, headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+    # 文件夹压缩包使用文件树指纹生成的弱ETag，304时不压缩
+    url, params = "/restful/test_restful_conditional_get", {"compress": "tgz"}
+    response = client.get(url, params=params).raise_for_status()
+    etag = response.headers["ETag"]
+    assert etag.startswith('W/"')
+    assert client.get(url, params=params, headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(url, params={"compress": "txz"}, headers={"If-None-Match": etag}).status_code == 200
+    file_server_file.write_text("changed again")
+    assert client.get(url, params=params, headers={"If-None-Match": etag}).status_code == 200
+
+
+@pytest.mark.parametrize("file_server_file", ["/test_restful_response_compression/test.txt"], indirect=True)
+def test_restful_response_compression(
+    client: TestClient, file_server_file: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    assert choose_encoding("gzip, zstd;q=0.5, br;q=0", ["zstd", "br", "gzip"]) == "gzip"
+    assert choose_encoding("*", ["zstd", "gzip"]) == "zstd"
+    assert choose_encoding("identity", ["zstd", "gzip"]) is None
+    for index in range(50):
+        (file_server_file.parent / f"{index}.txt").write_text("")
+
+    # 列表是JSON，按客户端接受的编码压缩
+    url = "/restful/test_restful_response_compression"
+    response = client.get(url, params={"list": True}, headers={"Accept-Encoding": "zstd;q=0.5, gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "accept-encoding" in response.headers["Vary"].lower()
+    assert len(response.json()) == 51
+
+    # 文件响应不压缩，保留Content-Length和Range支持
+    url = "/restful/test_restful_response_compression/test.txt"
+    content = file_server_file.read_bytes()
+    response = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.headers["Content-Length"] == str(len(content))
+    etag = response.headers["ETag"]
+    try:
+        # 文件旁同名的.gz是用户的另一个文件，不能当作预压缩文件发送
+        file_server_file.with_name("test.txt.gz").write_bytes(gzip.compress(b"unrelated user file"))
+        monkeypatch.setattr(settings, "PRECOMPRESSED_DIR", tmp_path / "precompressed")
+        response = client.get(url, headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in response.headers
+        assert response.content == content
+
+        # PRECOMPRESSED_DIR中与文件大小和修改时间匹配的预压缩文件
+        precompressed_path = write_precompressed(file_server_file, "gzip")
+        response = client.get(url, headers={"Accept-Encoding": "gzip"})
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert response.headers["Content-Length"] == str(precompressed_path.stat().st_size)
+        assert response.headers["ETag"] == f'{etag[:-1]}-gzip"'
+        assert response.content == content
+        assert (
+            client.get(url, headers={"Accept-Encoding": "gzip", "If-None-Match": response.headers["ETag"]}).status_code
+            == 304
+        )
+
+        response = client.get(url, headers={"Accept-Encoding": "gzip", "Range": "bytes=0-3"})
+        assert "content-encoding" not in response.headers
+        assert response.content == content[:4]
+        response = client.get(url, headers={"Accept-Encoding": "identity"})
+        assert "content-encoding" not in response.headers
+        assert response.headers["Vary"] == "Accept-Encoding"
+
+        # 原文件更新后预压缩文件不再匹配
+        file_server_file.write_text("changed content")
+        response = client.get(url, headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in response.headers
+        assert response.content == b"changed content"
+    finally:
+        shutil.rmtree(file_server_file.parent)
+
+
+async def test_compression_stream_flush() -> None:
+    lines = [b'{"name": "a"}\n', b'{"name": "b"}\n']
+
+    async def app(scope, receive, send) -> None:
+        headers = [(b"content-type", b"application/x-ndjson")]
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        for line in lines:
+            await send({"type": "http.response.body", "body": line * 100, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    messages = []
+
+    async def send(message: dict) -> None:
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "headers": [(b"accept-encoding", b"gzip")]}
+    await CompressionMiddleware(app, 100, ["gzip"])(scope, None, send)
+    assert Headers(raw=messages[0]["headers"])["content-encoding"] == "gzip"
+    # 每块数据发送时都可以完整解压，不用等到响应结束
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for message, line in zip(messages[1:], lines):
+        assert decompressor.decompress(message["body"]) == line * 100
+    assert decompressor.decompress(messages[-1]["body"]) == b""
+
+    # 小于minimum_size没有压缩的响应、客户端不接受压缩的响应也带Vary
+    async def small_app(scope, receive, send) -> None:
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": b"[]"})
+
+    for request_headers in ([(b"accept-encoding", b"gzip")], []):
+        messages.clear()
+        await CompressionMiddleware(small_app, 100, ["gzip"])({**scope, "headers": request_headers}, None, send)
+        headers = Headers(raw=messages[0]["headers"])
+        assert "content-encoding" not in headers
+        assert headers["vary"] == "Accept-Encoding"
+
+
+def test_archive_cache_evict(tmp_path: Path) -> None:
+    cache = ArchiveCache(tmp_path / "cache", max_size=10)
+    keys = {}
+    for name in ["old", "recent", "new"]:
+        source_dir = tmp_path / name
+        source_dir.mkdir()
+        (source_dir / "test.txt").write_text(name)
+        fingerprint = tree_fingerprint(source_dir, False)
+        keys[name] = ArchiveCache.cache_key(source_dir, CompressMethod.tgz, None, False, fingerprint)
+        assert cache.get(keys[name]) is None
+        chunks = cache.iter_and_store(iter([b"123", b"45"]), keys[name], source_dir, False, fingerprint)
+        assert b"".join(chunks) == b"12345"
+        if name != "new":
+            os.utime(cache.entry_path(keys[name]), ns=(0, {"old": 1, "recent": 2}[name]))
+        if name == "recent":
+            # 使用过的old比recent新，超过上限时先淘汰recent
+            cache.get(keys["old"]).unlink()
+    assert cache.get(keys["recent"]) is None
+    assert sorted(path.name for path in cache.cache_dir.iterdir()) == sorted(
+        cache.entry_path(keys[name]).name for name in ["old", "new"]
+    )
+
+    # 正在发送的缓存文件被淘汰后仍然可以读取
+    pinned_path = cache.get(keys["new"])
+    cache.max_size = 0
+    cache.evict()
+    assert cache.get(keys["new"]) is None
+    assert pinned_path.read_bytes() == b"12345"
+
+
+async def test_file_response_pathsend(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    file_path = tmp_path / "test.txt"
+    file_path.write_text("test content")
+    messages = []
+
+    async def send(message: dict) -> None:
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "headers": [], "extensions": {"http.response.pathsend": {}}}
+    await RangeFileResponse(file_path)(scope, None, send)
+    assert [message["type"] for message in messages] == ["http.response.start", "http.response.pathsend"]
+    assert messages[1]["path"] == str(file_path)
+
+    # 范围请求和有background的响应按块发送
+    for headers, background in (([(b"range", b"bytes=5-")], None), ([], BackgroundTask(lambda: None))):
+        messages.clear()
+        await RangeFileResponse(file_path, background=background)({**scope, "headers": headers}, None, send)
+        assert {message["type"] for message in messages} == {"http.response.start", "http.response.body"}
+
+    # 关闭FILE_PATHSEND时按块发送
+    monkeypatch.setattr(settings, "FILE_PATHSEND", False)
+    messages.clear()
+    await RangeFileResponse(file_path)(scope, None, send)
+    assert {message["type"] for message in messages} == {"http.response.start", "http.response.body"}
+
+
+def test_restful_upload_form_fields(client: TestClient, temp_file: SpooledTemporaryFile) -> None:
+    response = client.post(
+        "/restful/test_restful_upload_form_fields/test.txt", data={"mkdir": "false"}, files={"file": temp_file}
+    )
+    assert response.status_code == 400
+    assert not get_os_path("test_restful_upload_form_fields").exists()
+
+    upload_path = "test/test_restful_upload_form_fields.txt"
+    uploaded_file_path = get_os_path(upload_path)
+    try:
+        uploaded_file_path.parent.mkdir(parents=True, exist_ok=True)
+        uploaded_file_path.write_text("old content")
+        temp_file.seek(0)
+        response = client.post(f"/restful/{upload_path}", files={"file": temp_file})
+        assert response.status_code == 400
+        temp_file.seek(0)
+        client.post(
+            f"/restful/{upload_path}", data={"allow_overwrite": "true"}, files={"file": temp_file}
+        ).raise_for_status()
+        assert uploaded_file_path.read_text() == "test content"
+        assert list(uploaded_file_path.parent.iterdir()) == [uploaded_file_path]
+    finally:
+        uploaded_file_path.unlink(missing_ok=True)
+
+
+def test_parallel_gzip_writer(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(codec, "PARALLEL_GZIP_BLOCK_SIZE", 1000)
+    content = os.urandom(10_500)
+    output = BytesIO()
+    with codec.open_compress_writer(output, CompressMethod.ptgz, 6, 4) as writer:
+        writer.write(content[:3333])
+        writer.write(content[3333:])
+    assert output.getvalue().count(b"\x1f\x8b\x08") >= 11
+    assert gzip.decompress(output.getvalue()) == content
+
+
+def test_upload_directory_stream_extract(client: TestClient) -> None:
+    tar_buffer = BytesIO()
+    with tarfile.open(fileobj=tar_buffer, mode="w:gz") as tar_file:
+        content = os.urandom(3 * 1024 * 1024)
+        tar_info = tarfile.TarInfo("test_upload_directory_stream/data.bin")
+        tar_info.size = len(content)
+        tar_file.addfile(tar_info, BytesIO(content))
+    parent_dir = get_os_path("/test_upload_directory_stream_parent")
+    try:
+        client.post(
+            "/upload-directory",
+            params={"parent_dir": "/test_upload_directory_stream_parent", "compress_method": "tgz"},
+            files={"compressed_dir": ("dir.tgz", tar_buffer.getvalue())},
+        ).raise_for_status()
+        assert (parent_dir / "test_upload_directory_stream" / "data.bin").read_bytes() == content
+
+        response = client.post(
+            "/upload-directory",
+            params={"parent_dir": "/test_upload_directory_stream_parent", "compress_method": "tgz"},
+            files={"compressed_dir": ("dir.tgz", tar_buffer.getvalue()[: 1024 * 1024])},
+        )
+        assert response.status_code == 400
+        assert [path.name for path in parent_dir.iterdir()] == ["test_upload_directory_stream"]
+    finally:
+        shutil.rmtree(parent_dir, ignore_errors=True)
+
+
+def test_upload_multipart_incomplete(client: TestClient) -> None:
+    boundary = "test-boundary"
+    headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+    file_part = f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="a.txt"\r\n\r\ncontent\r\n'
+    field_part = f'--{boundary}\r\nContent-Disposition: form-data; name="mkdir"\r\n\r\ntrue\r\n'
+    closing = f"--{boundary}--\r\n"
+
+    def upload(url: str, body: str) -> int:
+        return client.post(url, params={"directory": "/"}, content=body.encode(), headers=headers).status_code
+
+    # 截断在文件内容中或结尾的分隔符之前，以及文件之后的控制字段，都不写入文件
+    for body in (file_part[:-12], file_part, file_part + field_part + closing):
+        assert upload("/upload-file", body) == 400
+        assert list(settings.FILE_DIR.iterdir()) == []
+    # 批量上传时收到字段结尾的文件已经写入，之后的截断或控制字段仍然返回400
+    files_part = file_part.replace('name="file"', 'name="files"')
+    assert upload("/upload-files", files_part[:-12]) == 400
+    assert list(settings.FILE_DIR.iterdir()) == []
+    assert upload("/upload-files", files_part) == 400
+    assert upload("/upload-files", files_part + field_part + closing) == 400
+    (settings.FILE_DIR / "a.txt").unlink()
+    assert upload("/upload-file", field_part + file_part + closing) == 200
+    assert (settings.FILE_DIR / "a.txt").read_text() == "content"
+
+
+def test_upload_directory_unsafe_archive(client: TestClient) -> None:
+    url_dir = "/test_upload_directory_unsafe"
+    parent_dir = get_os_path(url_dir)
+    parent_dir.mkdir(exist_ok=True)
+
+    def upload(compress_method: str, content: bytes) -> int:
+        return client.post(
+            "/upload-directory",
+            params={"parent_dir": url_dir, "compress_method": compress_method},
+            files={"compressed_dir": (f"dir.{compress_method}", content)},
+        ).status_code
+
+    def tar_archive(*tar_infos: tarfile.TarInfo) -> bytes:
+        tar_buffer = BytesIO()
+        with tarfile.open(fileobj=tar_buffer, mode="w:gz") as tar_file:
+            for tar_info in tar_infos:
+                tar_file.addfile(tar_info, BytesIO(b"x" * tar_info.size))
+        return tar_buffer.getvalue()
+
+    def tar_member(name: str, size: int = 1, **kwargs) -> tarfile.TarInfo:
+        tar_info = tarfile.TarInfo(name)
+        tar_info.size = size
+        for key, value in kwargs.items():
+            setattr(tar_info, key, value)
+        return tar_info
+
+    try:
+        # 路径在目标文件夹之外的成员
+        assert upload("tgz", tar_archive(tar_member("../escaped.txt"))) == 400
+        assert upload("tgz", tar_archive(tar_member("link", 0, type=tarfile.SYMTYPE, linkname="/etc/passwd"))) == 400
+        zip_buffer = BytesIO()
+        with ZipFile(zip_buffer, "w") as zip_file:
+            zip_file.writestr("ok.txt", b"x")
+            zip_file.writestr("../escaped.txt", b"x")
+        assert upload("zip", zip_buffer.getvalue()) == 400
+        assert upload("zip", b"not a zip") == 400
+        assert not (parent_dir.parent / "escaped.txt").exists()
+        assert list(parent_dir.iterdir()) == []
+
+        # 与已有条目类型不同时不发布任何条目
+        (parent_dir / "existing").write_text("file")
+        assert upload("tgz", tar_archive(tar_member("new.txt"), tar_member("existing/inner.txt"))) == 400
+        assert sorted(path.name for path in parent_dir.iterdir()) == ["existing"]
+        assert (parent_dir / "existing").read_text() == "file"
+    finally:
+        shutil.rmtree(parent_dir, ignore_errors=True)
+
+
+def test_listing_cache_mtime_fallback(tmp_path: Path) -> None:
+    cache = ListingCache(100, ttl=60, use_inotify=False)
+    (tmp_path / "a.txt").write_text("a")
+    list(cache.iter_and_store(tmp_path, True, listing.scan_directory(tmp_path, True)))
+    assert [entry.name for entry in cache.get(tmp_path, True)] == ["a.txt"]
+
+    (tmp_path / "b.txt").write_text("b")
+    os.utime(tmp_path, ns=(0, tmp_path.stat().st_mtime_ns + 1))
+    assert cache.get(tmp_path, True) is None
+
+    list(cache.iter_and_store(tmp_path, True, listing.scan_directory(tmp_path, True)))
+    assert cache.get(tmp_path, True) is not None
+    cache.invalidate(tmp_path)
+    assert cache.get(tmp_path, True) is None
+
+
+def test_listing_cache_inotify(tmp_path: Path) -> None:
+    cache = ListingCache(100, ttl=60)
+    (tmp_path / "a.txt").write_text("a")
+    list(cache.iter_and_store(tmp_path, True, listing.scan_directory(tmp_path, True)))
+    if cache.inotify is None:
+        pytest.skip("inotify not available")
+    assert cache.get(tmp_path, True) is not None
+
+    # 修改文件内容不会改变文件夹的mtime，只能由inotify发现
+    (tmp_path / "a.txt").write_text("changed")
+    deadline = time.monotonic() + 5
+    while cache.get(tmp_path, True) is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cache.get(tmp_path, True) is None
+
+
+@pytest.mark.parametrize("file_server_file", ["/test_metrics/test.txt"], indirect=True)
+def test_metrics(client: TestClient, file_server_file: Path) -> None:
+    def sample(name: str) -> float:
+        response = client.get("/metrics").raise_for_status()
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        values = dict(line.rsplit(" ", 1) for line in response.text.splitlines() if not line.startswith("#"))
+        return float(values.get(name, 0))
+
+    requests_name = 'zjbs_http_requests_total{method="GET",route="/restful/{server_path:path}",status="200"}'
+    listing_name = 'zjbs_listing_entries_count{operation="list"}'
+    archive_name = 'zjbs_archive_bytes_total{operation="compress",compress_method="tgz"}'
+    before = [sample(name) for name in (requests_name, listing_name, archive_name)]
+    client.get("/restful/test_metrics/test.txt").raise_for_status()
+    client.post("/list-directory", params={"directory": "/test_metrics"}).raise_for_status()
+    client.get("/restful/test_metrics", params={"compress": "tgz"}).raise_for_status()
+
+    assert sample(requests_name) == before[0] + 2
+    assert sample(listing_name) == before[1] + 1
+    assert sample(archive_name) > before[2]
+    assert sample('zjbs_http_response_bytes_total{route="/restful/{server_path:path}"}') > 0
+    assert sample('zjbs_disk_bytes{directory="file",kind="free"}') > 0